@@ -0,0 +1,96 @@
+# Default vs. --fast ingestion (src.preprocess.fast_ingest), per source.
+# Run from repo root:
+#   uv run python -m scripts.gen_synthetic --out_dir data/synthetic/100k --records 100k --format mixed
+#   uv run python -m scripts.bench_ingest_fast --data_dir data/synthetic/100k --repeat 3
+# Per source, reports records/sec for
+#   - mapping alone: records already parsed in memory -> row batches (mapper + row dicts + from_pylist
+#     vs. extractor tuples + column build)
+#   - whole ingest: ingest_dir_to_table, parsing included
+# and checks that both paths give equal tables.
+import argparse, json, tempfile, time
+from pathlib import Path
+
+import pyarrow as pa
+
+from src.preprocess.aggregate_dir import MALFORMED, MAPPERS, SCHEMA, _iter_json_files, _iter_records_from_file, \
+    _row, ingest_dir_to_table
+from src.preprocess.fast_ingest import EXTRACTORS, HAVE_ORJSON, tuples_to_batch
+
+SOURCES = ["dsld", "amazon", "knowde", "internal"]
+
+def _best(fn, repeat: int):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return out, best
+
+def map_default(src, objs, only_on_market):
+    mapper = MAPPERS[src]
+    rows = []
+    for obj in objs:
+        rec = mapper(obj, only_on_market) if src == "dsld" else mapper(obj)
+        if rec:
+            rows.append(_row(rec))
+    return pa.RecordBatch.from_pylist(rows, schema=SCHEMA)
+
+def map_fast(src, objs, only_on_market):
+    extract = EXTRACTORS[src]
+    rows = []
+    for obj in objs:
+        rec = extract(obj, obj["_file"], only_on_market)
+        if rec:
+            rows.append(rec)
+    return tuples_to_batch(rows)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data_dir", type=Path, required=True, help="one sub-directory per source")
+    ap.add_argument("--sources", nargs="+", default=SOURCES, choices=SOURCES)
+    ap.add_argument("--batch_size", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", type=Path, default=None, help="optional JSON results file")
+    a = ap.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for src in a.sources:
+            in_dir, on_market = a.data_dir / src, src == "dsld"
+            objs = []
+            for fp in _iter_json_files(in_dir):
+                for obj in _iter_records_from_file(fp):
+                    if obj is MALFORMED:
+                        continue
+                    obj["_file"] = fp.as_posix()
+                    objs.append(obj)
+            rb_default, t_map_default = _best(lambda: map_default(src, objs, on_market), a.repeat)
+            rb_fast, t_map_fast = _best(lambda: map_fast(src, objs, on_market), a.repeat)
+
+            def ingest(fast):
+                return ingest_dir_to_table(src, in_dir, a.batch_size, only_on_market=on_market,
+                                           stats_path=Path(tmp) / "stats.json", fast=fast)
+            (tbl_default, stats), t_default = _best(lambda: ingest(False), a.repeat)
+            (tbl_fast, _), t_fast = _best(lambda: ingest(True), a.repeat)
+
+            n = stats["records_emitted"]
+            row = {
+                "src": src, "parsed": len(objs), "records": n, "orjson": HAVE_ORJSON,
+                "map_default_records_per_s": round(rb_default.num_rows / t_map_default, 1) if t_map_default else None,
+                "map_fast_records_per_s": round(rb_fast.num_rows / t_map_fast, 1) if t_map_fast else None,
+                "map_speedup": round(t_map_default / t_map_fast, 2) if t_map_fast else None,
+                "ingest_default_records_per_s": round(n / t_default, 1) if t_default else None,
+                "ingest_fast_records_per_s": round(n / t_fast, 1) if t_fast else None,
+                "ingest_speedup": round(t_default / t_fast, 2) if t_fast else None,
+                "identical": rb_default.equals(rb_fast) and tbl_default.equals(tbl_fast),
+            }
+            results.append(row)
+            print(json.dumps(row))
+
+    if a.out:
+        a.out.parent.mkdir(parents=True, exist_ok=True)
+        a.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Throughput of aggregate_dir ingestion vs. worker count.
+# Run from repo root:
+#   uv run python -m scripts.bench_ingest_workers --src dsld --in_dir data/raw/dsld_dataset --workers 1 2 4 8
+import argparse, json, tempfile, time
+from pathlib import Path
+
+from src.preprocess.aggregate_dir import ingest_dir_to_parquet, _iter_json_files
+from src.utils.provenance import sha256_of_file
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--src", choices=["dsld","amazon","knowde","internal"], required=True)
+    ap.add_argument("--in_dir", type=Path, required=True)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--batch_size", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--out", type=Path, default=None, help="optional JSON results file")
+    a = ap.parse_args()
+
+    n_files = sum(1 for _ in _iter_json_files(a.in_dir))
+    results, ref_digest = [], None
+    with tempfile.TemporaryDirectory() as tmp:
+        for w in a.workers:
+            out = Path(tmp) / f"{a.src}_w{w}.parquet"
+            best, stats = None, {}
+            for _ in range(a.repeat):
+                t0 = time.perf_counter()
+                stats = ingest_dir_to_parquet(a.src, a.in_dir, out, batch_size=a.batch_size,
+                                              workers=w, stats_path=Path(tmp) / "stats.json")
+                dt = time.perf_counter() - t0
+                best = dt if best is None else min(best, dt)
+            digest = sha256_of_file(out)
+            ref_digest = ref_digest or digest
+            row = {
+                "workers": w, "seconds": round(best, 3),
+                "files_per_s": round(n_files / best, 1) if best else None,
+                "records_per_s": round(stats["records_emitted"] / best, 1) if best else None,
+                "speedup": round(results[0]["seconds"] / best, 2) if results and best else 1.0,
+                "identical_to_first": digest == ref_digest,
+                **stats,
+            }
+            results.append(row)
+            print(json.dumps(row))
+
+    if a.out:
+        a.out.parent.mkdir(parents=True, exist_ok=True)
+        a.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
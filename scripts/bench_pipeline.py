@@ -0,0 +1,64 @@
+# End-to-end wall time: Snakemake (one `uv run python -m` per rule) vs. the in-process runner (src.pipeline).
+# Run from repo root:
+#   uv run python -m scripts.bench_pipeline --config workflow/config.yaml --repeat 3
+# Each contender writes into its own temp copy of the `outputs` paths; the final
+# outputs (quality report, UC-1, UC-2) are compared by sha256.
+import argparse, json, shlex, subprocess, sys, tempfile, time
+from pathlib import Path
+
+import yaml
+
+from src.utils.provenance import sha256_of_file
+
+FINAL = ["quality_report_path", "uc1_path", "uc2_path"]
+
+def _config(base: dict, root: Path) -> Path:
+    cfg = dict(base, outputs={k: (root / v).as_posix() for k, v in base["outputs"].items()})
+    path = root / "config.yaml"
+    root.mkdir(parents=True, exist_ok=True)
+    path.write_text(yaml.safe_dump(cfg), encoding="utf-8")
+    return path
+
+def _time(cmd: list, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--config", type=Path, default=Path("workflow/config.yaml"))
+    ap.add_argument("--jobs", type=int, default=4, help="snakemake -j")
+    ap.add_argument("--snakemake", default="uv run snakemake", help="snakemake command")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--out", type=Path, default=None, help="optional JSON results file")
+    a = ap.parse_args()
+
+    base = yaml.safe_load(a.config.read_text(encoding="utf-8"))
+    results, digests = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        contenders = {
+            "snakemake": lambda cfg: shlex.split(a.snakemake) + ["-j", str(a.jobs), "--forceall", "--quiet",
+                                                                  "--configfile", cfg.as_posix()],
+            "pipeline": lambda cfg: [sys.executable, "-m", "src.pipeline", "--config", cfg.as_posix()],
+        }
+        for name, cmd in contenders.items():
+            root = Path(tmp) / name
+            cfg = _config(base, root)
+            seconds = _time(cmd(cfg), a.repeat)
+            digests[name] = [sha256_of_file(root / base["outputs"][k]) for k in FINAL]
+            row = {"runner": name, "seconds": round(seconds, 3),
+                   "speedup": round(results[0]["seconds"] / seconds, 2) if results and seconds else 1.0,
+                   "identical_to_first": digests[name] == next(iter(digests.values()))}
+            results.append(row)
+            print(json.dumps(row))
+
+    if a.out:
+        a.out.parent.mkdir(parents=True, exist_ok=True)
+        a.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# Load test for the query service (src.views.query): latency percentiles and throughput over HTTP.
+# Run from repo root:
+#   uv run python -m scripts.bench_query_service --in data/interim/integrated.parquet --syn rules/synonyms.csv
+#   uv run python -m scripts.bench_query_service --url http://127.0.0.1:8765 --concurrency 32 --requests 5000
+# Without --url the service is loaded and served in-process on a free port. The query mix is drawn
+# from --targets: single ingredients, pairs, and company-narrowed queries, /products and /companies.
+# A first pass sends every distinct query once (cold: computed by the service), then --requests
+# queries drawn from the same mix with repeats (mostly answered from the LRU cache) over
+# --concurrency keep-alive connections. Reports p50/p90/p99/max latency in ms and requests/s per
+# pass, plus direct QueryService call latencies when in-process.
+import argparse, asyncio, json, random, sys, time
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+from src.views.export import load_targets
+from src.views.query import QueryService, start_server
+
+def _percentiles(ms: list) -> dict:
+    if not ms:
+        return {"n": 0}
+    a = np.asarray(ms)
+    p50, p90, p99 = np.percentile(a, [50, 90, 99])
+    return {"n": len(a), "p50_ms": round(p50, 3), "p90_ms": round(p90, 3), "p99_ms": round(p99, 3),
+            "max_ms": round(a.max(), 3), "mean_ms": round(a.mean(), 3)}
+
+def query_mix(targets: list, companies: list, n_distinct: int, rng: random.Random) -> list:
+    """Distinct request targets (path?query)."""
+    mix = set()
+    for _ in range(n_distinct * 20):
+        if len(mix) >= n_distinct:
+            break
+        kind = rng.choice(["/products", "/products", "/companies"])
+        ings = rng.sample(targets, 2 if len(targets) > 1 and rng.random() < 0.3 else 1)
+        params = [("ingredient", t) for t in ings]
+        if companies and rng.random() < 0.3:
+            params.append(("company", rng.choice(companies)))
+        if kind == "/products":
+            params.append(("limit", 100))
+        mix.add(f"{kind}?{urlencode(params)}")
+    return sorted(mix)
+
+async def _client(host: str, port: int, queue: asyncio.Queue, latencies: list, errors: list) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            try:
+                target = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            t0 = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                h = await reader.readline()
+                if h in (b"\r\n", b""):
+                    break
+                name, _, value = h.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if status != 200:
+                errors.append((status, target))
+    finally:
+        writer.close()
+
+async def run_pass(host: str, port: int, targets: list, concurrency: int) -> dict:
+    queue: asyncio.Queue = asyncio.Queue()
+    for t in targets:
+        queue.put_nowait(t)
+    latencies, errors = [], []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, queue, latencies, errors) for _ in range(min(concurrency, len(targets)))))
+    wall = time.perf_counter() - t0
+    return {**_percentiles(latencies), "requests_per_s": round(len(latencies) / wall, 1) if wall else None,
+            "errors": len(errors)}
+
+def bench_direct(service: QueryService, targets: list, companies: list, rng: random.Random) -> dict:
+    """Library-call latency without HTTP: cold (cache cleared) and cached."""
+    cold, cached = [], []
+    for t in targets:
+        company = rng.choice(companies) if companies and rng.random() < 0.3 else None
+        service.cache.clear()
+        for out in (cold, cached):
+            t0 = time.perf_counter()
+            service.products([t], company=company, limit=100)
+            out.append((time.perf_counter() - t0) * 1000)
+    return {"cold": _percentiles(cold), "cached": _percentiles(cached)}
+
+async def bench(a, service) -> dict:
+    server = None
+    if a.url:
+        url = urlsplit(a.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        server = await start_server(service, "127.0.0.1", 0)
+        host, port = server.sockets[0].getsockname()[:2]
+    rng = random.Random(a.seed)
+    targets = load_targets(a.targets)
+    companies = []
+    if service is not None:
+        counts = service.df["company_name"].value_counts()
+        companies = [c for c in counts.index[:50] if c]
+    distinct = query_mix(targets, companies, a.distinct, rng)
+    try:
+        cold = await run_pass(host, port, distinct, a.concurrency)
+        warm = await run_pass(host, port, [rng.choice(distinct) for _ in range(a.requests)], a.concurrency)
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+    out = {"distinct_queries": len(distinct), "concurrency": a.concurrency, "cold": cold, "mixed_repeats": warm}
+    if service is not None:
+        out["direct"] = bench_direct(service, targets, companies, rng)
+        out["health"] = service.health()
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", type=Path, default=Path("data/interim/integrated.parquet"))
+    ap.add_argument("--syn", type=Path, default=None)
+    ap.add_argument("--url", default=None, help="benchmark a running `src.views.query serve` instead")
+    ap.add_argument("--targets", type=Path, default=Path("workflow/targets.txt"))
+    ap.add_argument("--distinct", type=int, default=200, help="distinct queries in the mix")
+    ap.add_argument("--requests", type=int, default=2000, help="requests in the repeated pass")
+    ap.add_argument("--concurrency", type=int, default=16, help="keep-alive client connections")
+    ap.add_argument("--cache_size", type=int, default=1024)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", type=Path, default=None, help="optional JSON results file")
+    a = ap.parse_args()
+
+    service = None
+    if not a.url:
+        service = QueryService(a.inp, a.syn, cache_size=a.cache_size)
+        print(json.dumps({"rows": len(service.df), "load_seconds": service.load_seconds}), file=sys.stderr)
+    results = asyncio.run(bench(a, service))
+    print(json.dumps(results, indent=2))
+    if a.out:
+        a.out.parent.mkdir(parents=True, exist_ok=True)
+        a.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Raw JSON vs. the parsed-record cache (src.preprocess.record_cache), per source.
+# Run from repo root:
+#   uv run python -m scripts.gen_synthetic --out_dir data/synthetic/100k --records 100k --format mixed
+#   uv run python -m scripts.bench_record_cache --data_dir data/synthetic/100k --repeat 3
+# Per source, reports records/sec for
+#   - reading records alone: the streaming reader, the one-shot (--fast) reader, and a warm cache
+#     (memory-mapped IPC + marshal)
+#   - whole ingest (ingest_dir_to_table) as a remap would run it: raw JSON vs. a warm cache, default
+#     and --fast
+# plus the cold run (parse + fill) and the cache size on disk, and checks that all tables are equal.
+import argparse, json, tempfile, time
+from pathlib import Path
+
+from src.preprocess.aggregate_dir import _iter_json_files, _iter_records_from_file, ingest_dir_to_table
+from src.preprocess.fast_ingest import iter_records
+from src.preprocess.record_cache import RecordCache
+
+SOURCES = ["dsld", "amazon", "knowde", "internal"]
+
+def _best(fn, repeat: int):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return out, best
+
+def _count(files, read) -> int:
+    return sum(1 for fp in files for _ in read(fp))
+
+def _rate(n: int, t: float):
+    return round(n / t, 1) if t else None
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data_dir", type=Path, required=True, help="one sub-directory per source")
+    ap.add_argument("--sources", nargs="+", default=SOURCES, choices=SOURCES)
+    ap.add_argument("--batch_size", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", type=Path, default=None, help="optional JSON results file")
+    a = ap.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "records"
+        for src in a.sources:
+            in_dir, on_market = a.data_dir / src, src == "dsld"
+            files = list(_iter_json_files(in_dir))
+
+            def ingest(fast, cache=None):
+                return ingest_dir_to_table(src, in_dir, a.batch_size, only_on_market=on_market,
+                                           stats_path=Path(tmp) / "stats.json", fast=fast, record_cache=cache)
+            (tbl_raw, stats), t_raw = _best(lambda: ingest(False), a.repeat)
+            (tbl_raw_fast, _), t_raw_fast = _best(lambda: ingest(True), a.repeat)
+            (tbl_cold, _), t_cold = _best(lambda: ingest(False, root), 1)
+            (tbl_warm, _), t_warm = _best(lambda: ingest(False, root), a.repeat)
+            (tbl_warm_fast, _), t_warm_fast = _best(lambda: ingest(True, root), a.repeat)
+
+            cache = RecordCache(root, src)
+            cache.index(files)
+            n_parsed, t_read = _best(lambda: _count(files, _iter_records_from_file), a.repeat)
+            _, t_read_fast = _best(lambda: _count(files, iter_records), a.repeat)
+            _, t_read_cache = _best(lambda: _count(files, lambda fp: cache.records(fp, iter_records)), a.repeat)
+
+            n = stats["records_emitted"]
+            row = {
+                "src": src, "files": len(files), "parsed": n_parsed, "records": n,
+                "raw_mb": round(sum(fp.stat().st_size for fp in files) / 1e6, 2),
+                "cache_mb": round(sum(p.stat().st_size for p in cache.dir.glob("*.arrow")) / 1e6, 2),
+                "read_stream_records_per_s": _rate(n_parsed, t_read),
+                "read_oneshot_records_per_s": _rate(n_parsed, t_read_fast),
+                "read_cache_records_per_s": _rate(n_parsed, t_read_cache),
+                "read_speedup_vs_stream": round(t_read / t_read_cache, 2) if t_read_cache else None,
+                "ingest_raw_records_per_s": _rate(n, t_raw),
+                "ingest_cold_cache_records_per_s": _rate(n, t_cold),
+                "ingest_warm_cache_records_per_s": _rate(n, t_warm),
+                "ingest_speedup": round(t_raw / t_warm, 2) if t_warm else None,
+                "ingest_fast_raw_records_per_s": _rate(n, t_raw_fast),
+                "ingest_fast_warm_cache_records_per_s": _rate(n, t_warm_fast),
+                "ingest_fast_speedup": round(t_raw_fast / t_warm_fast, 2) if t_warm_fast else None,
+                "identical": all(tbl_raw.equals(t) for t in (tbl_raw_fast, tbl_cold, tbl_warm, tbl_warm_fast)),
+            }
+            results.append(row)
+            print(json.dumps(row))
+
+    if a.out:
+        a.out.parent.mkdir(parents=True, exist_ok=True)
+        a.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
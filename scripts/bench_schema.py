@@ -0,0 +1,73 @@
+# Parquet schema v1 (all large_string) vs v2 (typed + dictionary-encoded): file size and read time.
+# Run from repo root:
+#   uv run python -m scripts.bench_schema --in data/interim/integrated.parquet --repeat 5
+import argparse, json, tempfile, time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.utils.schema import FIELDS_V2, SCHEMA_V1, TEXT, read_table, schema_version, upgrade_batch
+
+def to_v1(tbl: pa.Table) -> pa.Table:
+    """Any-version table -> legacy all-string layout (lists ", "-joined, numbers as label text)."""
+    cols, names = [], []
+    for f, col in zip(tbl.schema, tbl.columns):
+        if f.name in TEXT.values():
+            continue
+        names.append(f.name)
+        if TEXT.get(f.name) in tbl.column_names:
+            col = tbl.column(TEXT[f.name])
+        elif pa.types.is_dictionary(f.type):
+            col = col.cast(f.type.value_type)
+        elif pa.types.is_list(f.type):
+            col = pc.binary_join(col, pa.scalar(", ", pa.large_string()))
+        cols.append(col.cast(pa.large_string()))
+    return pa.Table.from_arrays(cols, names=names).replace_schema_metadata(SCHEMA_V1.metadata)
+
+def to_v2(tbl: pa.Table) -> pa.Table:
+    extra = pa.schema([f for f in tbl.schema if f.name not in FIELDS_V2])
+    return pa.Table.from_batches([upgrade_batch(rb, extra) for rb in tbl.to_batches()])
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--out", type=Path, default=None, help="optional JSON results file")
+    a = ap.parse_args()
+
+    src = pq.read_table(a.inp)
+    v1 = to_v1(src) if schema_version(src.schema) == 2 else src
+    v2 = to_v2(v1)
+    with tempfile.TemporaryDirectory() as tmp:
+        p1, p2 = Path(tmp) / "v1.parquet", Path(tmp) / "v2.parquet"
+        pq.write_table(v1, p1, compression="snappy")
+        pq.write_table(v2, p2, compression="snappy")
+        res = {
+            "rows": v1.num_rows,
+            "v1_bytes": p1.stat().st_size,
+            "v2_bytes": p2.stat().st_size,
+            "v1_read_table_s": round(best_of(lambda: pq.read_table(p1), a.repeat), 4),
+            "v2_read_table_s": round(best_of(lambda: pq.read_table(p2), a.repeat), 4),
+            # what downstream stages pay for an old file: read + on-the-fly upgrade
+            "v1_compat_read_s": round(best_of(lambda: read_table(p1), a.repeat), 4),
+            "v1_in_memory_bytes": v1.nbytes,
+            "v2_in_memory_bytes": v2.nbytes,
+        }
+    res["size_ratio"] = round(res["v2_bytes"] / res["v1_bytes"], 3)
+    print(json.dumps(res, indent=2))
+    if a.out:
+        a.out.parent.mkdir(parents=True, exist_ok=True)
+        a.out.write_text(json.dumps(res, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Per-stage benchmark on synthetic corpora (scripts.gen_synthetic): ingest, harmonize, merge,
+# near_duplicates, validate, export. Stages hand tables over in memory (as src.pipeline does), so
+# each timing covers that stage's own work; ingest includes JSON parsing of the raw files.
+# Run from repo root:
+#   uv run python -m scripts.bench_stages --records 10k 100k --repeat 3
+#   uv run python -m scripts.bench_stages --records 100k --baseline reports/bench/stages_<commit>.json
+# Corpora are cached under --data_root/<records>_<format>_s<seed> and reused. Results are JSON
+# (default reports/bench/stages_<git commit>.json). --baseline flags stages that got slower than a
+# previous results file by more than --threshold, and then exits 1.
+import argparse, json, platform, sys, tempfile, time
+from pathlib import Path
+
+from scripts.gen_synthetic import FORMATS, generate, parse_count
+from src.integrate.merge import link_records
+from src.preprocess.aggregate_dir import ingest_dir_to_table
+from src.preprocess.harmonize import harmonize_tables
+from src.utils.instrument import compare
+from src.utils.provenance import git_commit, iso_now
+from src.utils.schema import to_pandas
+from src.validate.checks import run_checks
+from src.validate.near_duplicates import ID_COLS, find_near_duplicates
+from src.views.export import build_views, load_targets
+
+SOURCES = ["dsld", "amazon", "knowde", "internal"]
+
+def _timed(fn, repeat: int):
+    """Best-of-`repeat` wall and CPU seconds; returns (result of the last call, wall, cpu)."""
+    best_wall = best_cpu = None
+    for _ in range(repeat):
+        c0, t0 = time.process_time(), time.perf_counter()
+        out = fn()
+        wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+        if best_wall is None or wall < best_wall:
+            best_wall, best_cpu = wall, cpu
+    return out, best_wall, best_cpu
+
+def bench_scale(data_dir: Path, a, schema: dict, stats_dir: Path) -> list:
+    rows = []
+    def record(stage, wall, cpu, rows_in, rows_out):
+        row = {"stage": stage, "seconds": round(wall, 4), "cpu_s": round(cpu, 4), "rows_in": rows_in,
+               "rows_out": rows_out, "records_per_s": round(rows_in / wall, 1) if wall else None}
+        rows.append(row)
+        print(json.dumps({"records": a.scale, **row}), file=sys.stderr)
+
+    tables = []
+    for src in SOURCES:
+        (tbl, stats), wall, cpu = _timed(lambda: ingest_dir_to_table(
+            src, data_dir / src, a.batch_size, only_on_market=src == "dsld", workers=a.workers if src == "dsld" else 1,
+            stats_path=stats_dir / f"ingest_stats_{src}.json", fast=a.fast), a.repeat)
+        record(f"ingest_{src}", wall, cpu, stats["records_emitted"], tbl.num_rows)
+        tables.append(tbl)
+    n_in = sum(t.num_rows for t in tables)
+
+    harmonized, wall, cpu = _timed(lambda: harmonize_tables(tables, Path(a.syn), Path(a.units),
+                                                            vocab_path=Path(a.vocab)), a.repeat)
+    record("harmonize", wall, cpu, n_in, harmonized.num_rows)
+    del tables
+
+    (integrated, stats), wall, cpu = _timed(lambda: link_records(harmonized, a.workers), a.repeat)
+    record("merge", wall, cpu, harmonized.num_rows, stats["clusters"])
+    del harmonized
+
+    cols = [c for c in ID_COLS + ["ingredients"] if c in integrated.column_names]
+    (clusters, _), wall, cpu = _timed(lambda: find_near_duplicates(integrated.select(cols)), a.repeat)
+    record("near_duplicates", wall, cpu, integrated.num_rows, clusters.num_rows)
+
+    metrics, wall, cpu = _timed(lambda: run_checks(integrated, schema, clusters), a.repeat)
+    record("validate", wall, cpu, integrated.num_rows, len(metrics))
+
+    targets = load_targets(Path(a.targets))
+    (uc1, _), wall, cpu = _timed(lambda: build_views(to_pandas(integrated), targets, Path(a.syn)), a.repeat)
+    record("export", wall, cpu, integrated.num_rows, len(uc1))
+    return rows
+
+def _as_history(results: dict, rid: str) -> list:
+    return [{"run_id": rid, "stage": f"{run['records']}:{s['stage']}", "wall_s": s["seconds"]}
+            for run in results["runs"] for s in run["stages"]]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--records", nargs="+", default=["10k"], help="total synthetic records per scale (10k, 100k, 1M)")
+    ap.add_argument("--format", default="mixed", choices=list(FORMATS) + ["mixed"])
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--data_root", type=Path, default=Path("data/synthetic"), help="generated corpora (reused)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--batch_size", type=int, default=2000)
+    ap.add_argument("--workers", type=int, default=1, help="DSLD ingest / merge process pool size")
+    ap.add_argument("--fast", action="store_true", help="ingest with src.preprocess.fast_ingest")
+    ap.add_argument("--syn", default="rules/synonyms.csv")
+    ap.add_argument("--units", default="rules/units.csv")
+    ap.add_argument("--vocab", default="rules/ingredients.txt")
+    ap.add_argument("--targets", default="workflow/targets.txt")
+    ap.add_argument("--schema", type=Path, default=Path("metadata/dataset.schema.json"))
+    ap.add_argument("--out", type=Path, default=None, help="results JSON (default reports/bench/stages_<commit>.json)")
+    ap.add_argument("--baseline", type=Path, default=None, help="earlier results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.2, help="regression = slower than baseline by this share")
+    a = ap.parse_args()
+
+    schema = json.loads(a.schema.read_text(encoding="utf-8"))
+    commit = git_commit()
+    results = {"git_commit": commit, "timestamp_utc": iso_now(), "python": platform.python_version(),
+               "platform": platform.platform(), "format": a.format, "seed": a.seed, "repeat": a.repeat,
+               "workers": a.workers, "fast_ingest": a.fast, "runs": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in a.records:
+            a.scale = n = parse_count(scale)
+            data_dir = a.data_root / f"{n}_{a.format.replace('.', '_')}_s{a.seed}"
+            if not (data_dir / "done.json").exists():
+                info = generate(data_dir, n, a.seed, fmt=a.format)
+                (data_dir / "done.json").write_text(json.dumps(info), encoding="utf-8")
+            results["runs"].append({"records": n, "stages": bench_scale(data_dir, a, schema, Path(tmp))})
+
+    out = a.out or Path("reports/bench") / f"stages_{(commit or 'nogit')[:12]}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(json.dumps({"results": out.as_posix()}))
+
+    if a.baseline:
+        base = json.loads(a.baseline.read_text(encoding="utf-8"))
+        rows = compare(_as_history(base, "baseline") + _as_history(results, "current"), "current",
+                       baseline_runs=1, threshold=a.threshold)
+        for r in rows:
+            print(json.dumps(r))
+        sys.exit(1 if any(r["regression"] for r in rows) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# UC-1 target matching: per-target str.contains loop (previous export.py) vs. TargetMatcher.
+# Run from repo root:
+#   uv run python -m scripts.bench_uc1_match --in data/interim/integrated.parquet --targets workflow/targets.txt --n_targets 10 100 1000 5000
+import argparse, json, time
+from pathlib import Path
+
+from src.views.export import read_df, load_targets
+from src.preprocess.canonical import load_synonyms
+from src.views.matcher import TargetMatcher, tokenize
+
+def legacy_loop(lc, targets):
+    # the pre-automaton export.py loop: one regex scan of the whole column per target
+    n = 0
+    for t in targets:
+        n += int(lc.str.contains(t.lower(), na=False).sum())
+    return n
+
+def scaled_targets(base, texts, n):
+    """base targets padded with distinct 1-3 token phrases drawn from the ingredient text."""
+    out, seen = list(base), {b.lower() for b in base}
+    for s in texts:
+        toks = tokenize(s)
+        for k in (1, 2, 3):
+            for i in range(0, max(0, len(toks) - k + 1)):
+                if len(out) >= n:
+                    return out[:n]
+                ph = " ".join(toks[i:i + k])
+                if ph not in seen and not ph.isdigit():
+                    seen.add(ph)
+                    out.append(ph)
+    return out[:n]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True)
+    ap.add_argument("--targets", required=True)
+    ap.add_argument("--syn", default="rules/synonyms.csv")
+    ap.add_argument("--n_targets", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--out", type=Path, default=None, help="optional JSON results file")
+    a = ap.parse_args()
+
+    df = read_df(a.inp).fillna("")
+    texts = df["ingredients"].astype(str).tolist()
+    lc = df["ingredients"].astype(str).str.lower()
+    base = load_targets(Path(a.targets))
+    syn = load_synonyms(Path(a.syn))
+
+    results = []
+    for n in a.n_targets:
+        targets = scaled_targets(base, texts, n)
+        t0 = time.perf_counter()
+        n_legacy = legacy_loop(lc, targets)
+        t_legacy = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        m = TargetMatcher(targets, syn)
+        t_build = time.perf_counter() - t0
+        hits = m.match_many(texts)
+        t_auto = time.perf_counter() - t0
+        row = {"rows": len(texts), "targets": len(targets),
+               "legacy_s": round(t_legacy, 4), "automaton_s": round(t_auto, 4), "automaton_build_s": round(t_build, 4),
+               "speedup": round(t_legacy / t_auto, 1) if t_auto else None,
+               "legacy_hits": n_legacy, "automaton_hits": sum(len(h) for h in hits)}
+        results.append(row)
+        print(json.dumps(row))
+    if a.out:
+        a.out.parent.mkdir(parents=True, exist_ok=True)
+        a.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# Synthetic raw corpora in the shapes map_dsld / map_amazon / map_knowde / map_internal consume.
+# Run from repo root:
+#   uv run python -m scripts.gen_synthetic --out_dir data/synthetic/100k --records 100k --format mixed
+# Writes <out_dir>/{dsld,amazon,knowde,internal}/part-NNNNN.<ext>. The output depends only on
+# (--seed, --records, --per_file, --format). Products come from a shared catalog, so the same
+# product turns up in several sources, sometimes with a reworded name or a missing id, which
+# gives entity resolution and near-duplicate detection real work.
+import argparse, gzip, json, random
+from pathlib import Path
+
+SOURCE_SHARE = {"dsld": 0.4, "amazon": 0.3, "knowde": 0.15, "internal": 0.15}
+FORMATS = {"json": ".json", "ndjson": ".jsonl", "json.gz": ".json.gz", "ndjson.gz": ".jsonl.gz"}
+
+INGREDIENTS = [
+    "Vitamin A", "Vitamin B6", "Vitamin B12", "Vitamin C", "Vitamin D3", "Vitamin E", "Vitamin K2",
+    "Biotin", "Folate", "Niacin", "Riboflavin", "Thiamin", "Pantothenic Acid", "Calcium", "Magnesium",
+    "Zinc", "Iron", "Selenium", "Copper", "Manganese", "Chromium", "Iodine", "Potassium", "Omega-3",
+    "Fish Oil", "Coenzyme Q10", "Ashwagandha", "Turmeric", "Curcumin", "Ginger", "Green Tea Extract",
+    "Elderberry", "Echinacea", "Probiotic Blend", "Lactobacillus acidophilus", "Collagen", "Hyaluronic Acid",
+    "Glucosamine", "Chondroitin", "MSM", "Melatonin", "L-Theanine", "Rhodiola", "Reishi", "Lion's Mane",
+    "Cordyceps", "Black Pepper Extract", "MCT Oil", "Ox Bile", "Creatine", "Whey Protein", "Caffeine",
+]
+ALIASES = ["cholecalciferol", "menaquinone-7", "MK-7", "ascorbic acid", "pyridoxine", "cobalamin",
+           "magnesium citrate", "zinc picolinate", "piperine", "ubiquinone"]
+OTHER = ["Hypromellose", "Rice Flour", "Magnesium Stearate", "Silicon Dioxide", "Gelatin", "Glycerin",
+         "Cellulose", "Water", "Sunflower Lecithin", "Maltodextrin"]
+INCI = ["Caprylic/Capric Triglyceride", "Glyceryl Stearate", "Tocopherol", "Sodium Hyaluronate",
+        "Ascorbyl Palmitate", "Xanthan Gum", "Lecithin", "Citric Acid", "Squalane", "Niacinamide"]
+FUNCTIONS = ["Emollient", "Antioxidant", "Emulsifier", "Thickener", "Preservative", "Conditioner"]
+CERTS = ["Kosher", "Halal", "Non-GMO", "Vegan", "GMP", "ISO 9001", "RSPO MassBalance Certified"]
+FORMS = [("Capsule", "Capsule(s)"), ("Softgel", "Softgel(s)"), ("Tablet", "Tablet(s)"),
+         ("Powder", "Scoop(s)"), ("Liquid", "mL"), ("Gummy", "Gummies"), ("Lozenge", "Lozenge(s)")]
+CLAIMS = ["Immune Health", "Bone Health", "Energy Support", "Heart Health", "Joint Support",
+          "Sleep Support", "Digestive Health", "Cognitive Support"]
+WORDS = ["Advanced", "Ultra", "Daily", "Pure", "Max", "Complete", "Organic", "Plus", "Extra Strength",
+         "Whole Food", "Active", "Balance", "Essential", "Premium", "Gold", "Natural"]
+SYLLABLES = ["na", "vi", "ta", "pu", "re", "li", "fe", "gre", "bio", "tru", "pri", "so", "la", "o", "cea",
+             "ter", "zen", "ka", "mo", "ri", "vo", "lu", "xa", "den"]
+BRAND_B = ["Labs", "Nutrition", "Naturals", "Health", "Wellness", "Botanicals", "Essentials", "Works"]
+
+def parse_count(s: str) -> int:
+    """'10k' / '1M' / '2500' -> int."""
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+class Catalog:
+    """Deterministic product catalog: product i is the same in every source and every run."""
+    def __init__(self, n_products: int, seed: int):
+        self.n, self.seed = max(1, n_products), seed
+        rng = random.Random(seed)
+        # about 25 products per brand; Zipf-ish popularity: few large brands, long tail
+        brands = set()
+        while len(brands) < max(20, self.n // 25):
+            word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+            brands.add(f"{word} {rng.choice(BRAND_B)}")
+        self.brands = sorted(brands)
+        rng.shuffle(self.brands)
+        self.brand_weights = [1.0 / (k + 1) ** 0.8 for k in range(len(self.brands))]
+
+    def product(self, i: int) -> dict:
+        rng = random.Random(self.seed * 1_000_003 + i)
+        brand = rng.choices(self.brands, self.brand_weights)[0]
+        actives = rng.sample(INGREDIENTS, rng.randint(1, 6))
+        if rng.random() < 0.2:
+            actives.append(rng.choice(ALIASES))
+        form, unit = rng.choice(FORMS)
+        count = rng.choice([30, 60, 90, 120, 180, 240])
+        name = f"{brand.split()[0]} {rng.choice(WORDS)} {' '.join(actives[:2])}"
+        return {
+            "idx": i, "brand": brand, "company": brand + (" Inc." if rng.random() < 0.5 else " LLC"),
+            "name": name, "actives": actives, "other": rng.sample(OTHER, rng.randint(0, 3)),
+            "form": form, "unit": unit, "serving": rng.choice([1, 1, 2, 2, 3, 0.5]), "count": count,
+            "upc": _upc(rng),
+            "asin": "B0" + "".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(8)),
+            "claims": rng.sample(CLAIMS, rng.randint(0, 3)),
+            "date": f"20{rng.randint(18, 25)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        }
+
+def _upc(rng: random.Random) -> str:
+    """UPC-A as printed on labels, with a valid check digit (src.integrate.merge checks it)."""
+    body = f"{rng.randint(0, 9)}{rng.randint(10000, 99999)}{rng.randint(10000, 99999)}"
+    rng.randint(0, 9)  # keeps the random stream of the other fields unchanged
+    check = (10 - sum(int(c) * (3 if k % 2 == 0 else 1) for k, c in enumerate(reversed(body))) % 10) % 10
+    return f"{body[0]} {body[1:6]} {body[6:]} {check}"
+
+def _variant(name: str, rng: random.Random) -> str:
+    # the small differences sources show for one product
+    r = rng.random()
+    if r < 0.1:
+        return name.upper()
+    if r < 0.2:
+        return f"{name} - {rng.choice([60, 120])} Count"
+    if r < 0.25:
+        return f" {name} "
+    return name
+
+def gen_dsld(p: dict, rng: random.Random, k: int) -> dict:
+    off = rng.random() < 0.15
+    def qty():
+        amount, unit = (0, "NP") if rng.random() < 0.1 else (rng.choice([5, 25, 100, 500, 1.5]), rng.choice(["mg", "mcg", "IU", "Gram(s)"]))
+        return [{"servingSizeOrder": 1, "servingSizeQuantity": p["serving"], "operator": "=", "quantity": amount,
+                 "unit": unit, "dailyValueTargetGroup": [{"name": "Adults and children 4 or more years of age",
+                                                          "operator": "=", "percent": rng.choice([None, 50, 100, 250])}],
+                 "servingSizeUnit": p["unit"]}]
+    rows = [{"order": j + 1, "name": a, "category": "vitamin", "ingredientGroup": a, "quantity": qty(),
+             "nestedRows": [{"order": 1, "name": rng.choice(ALIASES), "quantity": qty(), "nestedRows": []}]
+                           if rng.random() < 0.1 else []}
+            for j, a in enumerate(p["actives"])]
+    return {
+        "id": 100000 + k, "fullName": _variant(p["name"], rng), "brandName": p["brand"],
+        "upcSku": p["upc"] if rng.random() < 0.9 else "", "manufacturerName": p["company"],
+        "offMarket": 1 if off else 0, "entryDate": p["date"],
+        "physicalState": {"langualCode": "E0159", "langualCodeDescription": p["form"]},
+        "servingSizes": [{"order": 1, "minQuantity": p["serving"], "maxQuantity": p["serving"], "unit": p["unit"]}],
+        "netContents": [{"order": 1, "quantity": p["count"], "unit": p["unit"], "display": f"{p['count']} {p['unit']}"}],
+        "ingredientRows": rows,
+        "otheringredients": {"text": ", ".join(p["other"]), "ingredients": [{"order": j + 1, "name": o} for j, o in enumerate(p["other"])]},
+        "claims": [{"langualCode": "P0265", "langualCodeDescription": c} for c in p["claims"]],
+        "statements": [{"type": "General Statements", "notes": "These statements have not been evaluated by the FDA."}]
+                      if rng.random() < 0.5 else [],
+    }
+
+def gen_amazon(p: dict, rng: random.Random, k: int) -> dict:
+    return {
+        "rank": k % 100 + 1, "asin": p["asin"],
+        "product_name": f"{_variant(p['name'], rng)} | {rng.choice(WORDS)} Formula - {p['count']} {p['form']}s",
+        "product_url": f"https://www.amazon.com/dp/{p['asin']}", "brand": p["brand"],
+        "updated_at": f"{p['date']}T12:00:00+0000", "price": f"${rng.randint(8, 60)}.99",
+        "unit_price": f"${rng.randint(5, 90) / 100:.2f} per count", "unit_count": f"{p['count']}.00 Count",
+        "item_form": p["form"], "manufacturer": p["company"] if rng.random() < 0.6 else "",
+        "ingredients": ", ".join(p["actives"] + p["other"]) if rng.random() < 0.85 else "",
+        "about_this_item": [f"{c.upper()} - supports {c.lower()}." for c in p["claims"]],
+        "rating": f"{rng.uniform(3.5, 5):.1f}",
+    }
+
+def gen_knowde(p: dict, rng: random.Random, k: int) -> dict:
+    inci = rng.choice(INCI) if rng.random() < 0.7 else p["actives"][0]
+    slug = f"{p['brand'].lower().replace(' ', '-')}-{k}"
+    return {
+        "product_name": f" {p['brand'].split()[0].upper()}® {inci} {rng.randint(100, 9999)} ",
+        "link": f"https://www.knowde.com/stores/{p['brand'].lower().replace(' ', '-')}/products/{slug}",
+        "company_name": p["company"],
+        "product_details": {
+            "description": f"{inci} for food, beverage and personal care applications.",
+            "INCI Name": inci, "Ingredient Name": inci,
+            "Function": ", ".join(rng.sample(FUNCTIONS, rng.randint(1, 3))),
+            "Certifications & Compliance": ", ".join(rng.sample(CERTS, rng.randint(0, 4))),
+        },
+    }
+
+def gen_internal(p: dict, rng: random.Random, k: int) -> dict:
+    domain = p["brand"].lower().replace(" ", "") + ".com"
+    return {
+        "product_name": _variant(p["name"], rng), "product_type": rng.choice(["Finished Product", "Supplement"]),
+        "ingredients": p["actives"] + p["other"], "company_name": domain,
+        "product_link": f"https://{domain}/products/{p['idx']}",
+        "completion_tokens": rng.randint(300, 900), "prompt_tokens": rng.randint(500, 1200),
+    }
+
+GENERATORS = {"dsld": gen_dsld, "amazon": gen_amazon, "knowde": gen_knowde, "internal": gen_internal}
+
+def iter_records(src: str, n: int, catalog: Catalog, seed: int):
+    rng = random.Random(f"{seed}:{src}")
+    gen = GENERATORS[src]
+    for k in range(n):
+        # popular products are listed more often and in more sources
+        i = min(int(rng.paretovariate(1.2)) - 1, catalog.n - 1) if rng.random() < 0.3 else rng.randrange(catalog.n)
+        yield gen(catalog.product(i), rng, k)
+
+def _write_part(path: Path, recs: list, fmt: str) -> None:
+    if fmt.startswith("ndjson"):
+        text = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recs)
+    else:
+        text = json.dumps(recs, ensure_ascii=False)
+    data = text.encode("utf-8")
+    # mtime=0 keeps gzip members byte-identical across runs
+    path.write_bytes(gzip.compress(data, mtime=0) if fmt.endswith(".gz") else data)
+
+def write_source(src: str, n: int, out_dir: Path, catalog: Catalog, seed: int,
+                 per_file: int = 500, fmt: str = "json") -> int:
+    """Stream `n` records of `src` into part files; `fmt` "mixed" rotates through FORMATS. Returns files written."""
+    d = out_dir / src
+    d.mkdir(parents=True, exist_ok=True)
+    fmts = list(FORMATS) if fmt == "mixed" else [fmt]
+    part, buf = 0, []
+    for rec in iter_records(src, n, catalog, seed):
+        buf.append(rec)
+        if len(buf) == per_file:
+            f = fmts[part % len(fmts)]
+            _write_part(d / f"part-{part:05d}{FORMATS[f]}", buf, f)
+            part, buf = part + 1, []
+    if buf:
+        f = fmts[part % len(fmts)]
+        _write_part(d / f"part-{part:05d}{FORMATS[f]}", buf, f)
+        part += 1
+    return part
+
+def generate(out_dir: Path, records: int, seed: int = 0, per_file: int = 500, fmt: str = "json",
+             sources=tuple(SOURCE_SHARE)) -> dict:
+    """`records` in total, split across sources by SOURCE_SHARE. Returns {src: {records, files}}."""
+    catalog = Catalog(int(records * 0.6), seed)
+    out = {}
+    for src in sources:
+        n = max(1, round(records * SOURCE_SHARE[src]))
+        out[src] = {"records": n, "files": write_source(src, n, out_dir, catalog, seed, per_file, fmt)}
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out_dir", type=Path, required=True)
+    ap.add_argument("--records", default="10k", help="total records across sources, e.g. 10k, 100k, 1M")
+    ap.add_argument("--format", default="json", choices=list(FORMATS) + ["mixed"])
+    ap.add_argument("--per_file", type=int, default=500, help="records per part file")
+    ap.add_argument("--sources", nargs="+", default=list(SOURCE_SHARE), choices=list(SOURCE_SHARE))
+    ap.add_argument("--seed", type=int, default=0)
+    a = ap.parse_args()
+
+    info = generate(a.out_dir, parse_count(a.records), a.seed, a.per_file, a.format, a.sources)
+    print(json.dumps({"out_dir": a.out_dir.as_posix(), "format": a.format, "seed": a.seed, "sources": info}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+One entry point for every stage: `python main.py <command> [stage args]`.
+
+Each command names the stage module whose `main()` it runs; the module is
+imported only when its command is dispatched, so `main.py provenance
+checksums` loads what src.utils.provenance needs (the standard library) and
+not pyarrow, pandas or the other stages. Stage arguments are passed through
+unchanged: `main.py harmonize --dsld ...` is `python -m src.preprocess.harmonize
+--dsld ...`. Without a command (or with options first) main.py runs the
+whole pipeline, as before.
+
+Commands marked light must start without the heavy dependencies. `startup`
+measures that, in the manner of `python -X importtime`: it imports each
+command's module in a fresh interpreter, reports the cumulative import time
+and any heavy packages that came with it, and exits 1 when a light command
+imports one or takes longer than --budget_ms (heavy commands are reported
+only):
+
+  uv run python main.py provenance checksums --out provenance/checksums.txt data/curated/uc1_products.csv
+  uv run python main.py startup --budget_ms 100
+"""
+from __future__ import annotations
+import argparse, importlib, json, re, subprocess, sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ("pyarrow", "pandas", "numpy", "jsonschema", "yaml", "duckdb")
+DEFAULT_COMMAND = "pipeline"
+
+class Command(NamedTuple):
+    module: str
+    help: str
+    light: bool = False
+
+COMMANDS: Dict[str, Command] = {
+    "pipeline": Command("src.pipeline", "whole pipeline in one process (default)"),
+    "ingest": Command("src.preprocess.aggregate_dir", "raw JSON directory -> per-source Parquet"),
+    "harmonize": Command("src.preprocess.harmonize", "per-source Parquet -> harmonized"),
+    "merge": Command("src.integrate.merge", "entity resolution -> integrated + golden"),
+    "index": Command("src.integrate.ingredient_index", "ingredient -> rows index"),
+    "near-duplicates": Command("src.validate.near_duplicates", "near-duplicate pairs"),
+    "checks": Command("src.validate.checks", "quality report"),
+    "export": Command("src.views.export", "UC-1 / UC-2 views"),
+    "query": Command("src.views.query", "warm query service and one-shot queries"),
+    "resolve": Command("src.preprocess.ingredient_resolver", "raw ingredient strings -> canonical names", True),
+    "profile": Command("src.preprocess.profile", "field profile of raw records", True),
+    "provenance": Command("src.utils.provenance", "manifest, checksums, run metadata", True),
+    "stage-cache": Command("src.utils.stage_cache", "run a command through the stage cache; stats, clear", True),
+    "instrument": Command("src.utils.instrument", "compare stage metrics against earlier runs", True),
+}
+
+class Startup(NamedTuple):
+    command: str
+    module: str
+    light: bool
+    import_ms: float
+    heavy: List[str]
+
+_IMPORTTIME = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)\s*$")
+
+def import_time(module: str, repeat: int = 5) -> tuple[float, List[str]]:
+    """Best-of-``repeat`` cumulative import time of ``module`` (ms) and the heavy packages it imports."""
+    best, heavy = None, set()
+    for _ in range(repeat):
+        res = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        for line in res.stderr.splitlines():
+            m = _IMPORTTIME.match(line)
+            if not m:
+                continue
+            name = m.group(4)
+            if name.split(".")[0] in HEAVY:
+                heavy.add(name.split(".")[0])
+            if name == module:
+                ms = int(m.group(2)) / 1000
+                best = ms if best is None else min(best, ms)
+    return round(best or 0.0, 1), sorted(heavy)
+
+def startup(commands: Optional[List[str]] = None, repeat: int = 5) -> List[Startup]:
+    rows = []
+    for name in commands or list(COMMANDS):
+        cmd = COMMANDS[name]
+        ms, heavy = import_time(cmd.module, repeat)
+        rows.append(Startup(name, cmd.module, cmd.light, ms, heavy))
+    return rows
+
+def _startup_main(argv: List[str]) -> None:
+    ap = argparse.ArgumentParser(prog="main.py startup",
+                                 description="Import time of each command's module (regression guard for light commands)")
+    ap.add_argument("--commands", nargs="*", default=None, choices=list(COMMANDS))
+    ap.add_argument("--budget_ms", type=float, default=100.0, help="import time allowed for a light command")
+    ap.add_argument("--repeat", type=int, default=5, help="best of this many fresh interpreters")
+    a = ap.parse_args(argv)
+    failed = False
+    for r in startup(a.commands, a.repeat):
+        ok = not r.light or (not r.heavy and r.import_ms <= a.budget_ms)
+        failed |= not ok
+        print(json.dumps({**r._asdict(), "ok": ok}))
+    sys.exit(1 if failed else 0)
+
+def _usage() -> str:
+    width = max(map(len, COMMANDS))
+    lines = [f"  {name:<{width}}  {cmd.help}" for name, cmd in COMMANDS.items()]
+    lines.append(f"  {'startup':<{width}}  import time per command (exits 1 if a light command is slow)")
+    return "usage: main.py [command] [args ...]\n\ncommands:\n" + "\n".join(lines) + \
+           "\n\nmain.py <command> -h shows the command's own options."
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in ("-h", "--help"):
+        print(_usage())
+        return
+    name = argv[0] if argv and not argv[0].startswith("-") else DEFAULT_COMMAND
+    rest = argv[1:] if argv and argv[0] == name else argv
+    if name == "startup":
+        _startup_main(rest)
+        return
+    if name not in COMMANDS:
+        sys.exit(f"main.py: unknown command {name!r}\n\n{_usage()}")
+    sys.argv = [f"main.py {name}", *rest]  # stage CLIs parse sys.argv
+    importlib.import_module(COMMANDS[name].module).main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Persisted ingredient inverted index over integrated.parquet.
+
+For each field (`ingredients`, `other_ingredients`) two sections are built:
+- `<field>.item`  canonical ingredient (list item, lower-cased, synonyms applied) -> row ids
+- `<field>.token` alphanumeric token (same tokenizer as the UC-1 matcher)      -> row ids
+
+Each section is stored as `<section>.terms.json` (sorted term list),
+`<section>.offsets.npy` (uint64, n_terms + 1) and `<section>.postings.npy`
+(uint32 row ids, sorted within each term). Arrays are opened with
+mmap_mode="r", so loading the index is cheap and posting lists are paged in
+on demand. `meta.json` records the row count and sha256 of the indexed
+Parquet so stale indexes can be detected. `IngredientIndex.from_table`
+builds the same sections in memory (src.views.query).
+
+CLI:
+  uv run python -m src.integrate.ingredient_index --in data/interim/integrated.parquet --syn rules/synonyms.csv --out data/interim/ingredient_index
+"""
+from __future__ import annotations
+import argparse, json
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.preprocess.canonical import alias_map, load_synonyms, normalize_item
+from src.utils.provenance import HashCache, hash_files
+from src.utils.schema import iter_batches, table_batches
+from src.views.matcher import TargetMatcher, tokenize
+
+INDEX_VERSION = 1
+FIELDS = ["ingredients", "other_ingredients"]
+
+# ---------------- build ----------------
+class _SectionBuilder:
+    def __init__(self):
+        self.term_ids: Dict[str, int] = {}
+        self.tids = array("I")
+        self.rows = array("I")
+
+    def add(self, row: int, terms: Iterable[str]) -> None:
+        ids = self.term_ids
+        for t in terms:
+            tid = ids.get(t)
+            if tid is None:
+                tid = ids[t] = len(ids)
+            self.tids.append(tid)
+            self.rows.append(row)
+
+    def arrays(self) -> tuple:
+        """(sorted terms, offsets, postings) as stored on disk."""
+        terms = sorted(self.term_ids)
+        # remap insertion-order ids to sorted-term ids, then group postings by term
+        remap = np.empty(len(terms), dtype=np.uint32)
+        for new_id, t in enumerate(terms):
+            remap[self.term_ids[t]] = new_id
+        tids = remap[np.frombuffer(self.tids, dtype=np.uint32)] if len(self.tids) else np.empty(0, np.uint32)
+        rows = np.frombuffer(self.rows, dtype=np.uint32) if len(self.rows) else np.empty(0, np.uint32)
+        order = np.lexsort((rows, tids))
+        postings = rows[order]
+        offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+        np.cumsum(np.bincount(tids, minlength=len(terms)), out=offsets[1:])
+        return terms, offsets, postings.astype(np.uint32, copy=False)
+
+    def save(self, out_dir: Path, name: str) -> int:
+        terms, offsets, postings = self.arrays()
+        (out_dir / f"{name}.terms.json").write_text(json.dumps(terms, ensure_ascii=False), encoding="utf-8")
+        np.save(out_dir / f"{name}.offsets.npy", offsets)
+        np.save(out_dir / f"{name}.postings.npy", postings)
+        return len(terms)
+
+def _build_sections(batches: Iterable[pa.RecordBatch], fields: List[str],
+                    syn_path: Optional[Path]) -> Tuple[Dict[str, _SectionBuilder], int]:
+    amap = alias_map(load_synonyms(syn_path))
+    builders = {f"{f}.{kind}": _SectionBuilder() for f in fields for kind in ("item", "token")}
+    memo: Dict[tuple, tuple] = {}
+    row = 0
+    for rb in batches:
+        cols = {f: rb.column(f).to_pylist() for f in fields}
+        for i in range(rb.num_rows):
+            for f in fields:
+                v = cols[f][i]
+                if not v:
+                    continue
+                key = tuple(v)
+                terms = memo.get(key)
+                if terms is None:
+                    # per distinct list: dedupe so each posting list holds a row at most once
+                    items = (normalize_item(it) for it in v)
+                    terms = memo[key] = (tuple(dict.fromkeys(amap.get(n, n) for n in items if n)),
+                                         tuple(dict.fromkeys(tokenize(", ".join(v)))))
+                builders[f"{f}.item"].add(row + i, terms[0])
+                builders[f"{f}.token"].add(row + i, terms[1])
+        row += rb.num_rows
+    return builders, row
+
+def build_index(parquet_path: Path, out_dir: Path, syn_path: Optional[Path] = None,
+                batch_size: int = 65536) -> Dict[str, object]:
+    names = pq.read_schema(parquet_path).names
+    fields = [f for f in FIELDS if f in names]
+    builders, row = _build_sections(iter_batches(parquet_path, batch_size=batch_size, columns=fields),
+                                    fields, syn_path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sections = {name: b.save(out_dir, name) for name, b in builders.items()}
+    digest = hash_files([parquet_path], HashCache())[parquet_path.as_posix()]
+    meta = {
+        "version": INDEX_VERSION,
+        "rows": row,
+        "source_path": parquet_path.as_posix(),
+        "source_sha256": digest[1] if not isinstance(digest, Exception) else "",
+        "sections": sections,
+    }
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
+
+# ---------------- query ----------------
+class IngredientIndex:
+    """Read-only view over a persisted index; posting lists are memory-mapped."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.meta = json.loads((self.root / "meta.json").read_text(encoding="utf-8"))
+        self._sections: Dict[str, tuple] = {}
+
+    @classmethod
+    def from_table(cls, tbl: pa.Table, syn_path: Optional[Path] = None, batch_size: int = 65536) -> "IngredientIndex":
+        """The same sections as `build_index`, built over an in-memory v2 table and kept in memory."""
+        fields = [f for f in FIELDS if f in tbl.column_names]
+        builders, rows = _build_sections(table_batches(tbl, batch_size, fields), fields, syn_path)
+        self = cls.__new__(cls)
+        self.root, self._sections = None, {}
+        for name, b in builders.items():
+            terms, offsets, postings = b.arrays()
+            self._sections[name] = ({t: i for i, t in enumerate(terms)}, offsets, postings)
+        self.meta = {"version": INDEX_VERSION, "rows": rows,
+                     "sections": {name: len(sec[0]) for name, sec in self._sections.items()}}
+        return self
+
+    def matches_source(self, parquet_path: Path) -> bool:
+        d = hash_files([Path(parquet_path)], HashCache())[Path(parquet_path).as_posix()]
+        return not isinstance(d, Exception) and d[1] == self.meta.get("source_sha256")
+
+    def _section(self, name: str) -> tuple:
+        sec = self._sections.get(name)
+        if sec is None:
+            terms = json.loads((self.root / f"{name}.terms.json").read_text(encoding="utf-8"))
+            sec = self._sections[name] = (
+                {t: i for i, t in enumerate(terms)},
+                np.load(self.root / f"{name}.offsets.npy", mmap_mode="r"),
+                np.load(self.root / f"{name}.postings.npy", mmap_mode="r"),
+            )
+        return sec
+
+    def postings(self, section: str, term: str) -> np.ndarray:
+        ids, offsets, postings = self._section(section)
+        tid = ids.get(term)
+        if tid is None:
+            return np.empty(0, dtype=np.uint32)
+        return postings[int(offsets[tid]):int(offsets[tid + 1])]
+
+    def rows_with_ingredient(self, name: str, field: str = "ingredients",
+                             synonyms: Optional[Dict[str, List[str]]] = None) -> np.ndarray:
+        """Rows whose `field` list contains the canonical ingredient `name`."""
+        n = normalize_item(name)
+        n = alias_map(synonyms).get(n, n) if synonyms else n
+        return np.asarray(self.postings(f"{field}.item", n))
+
+    def rows_with_tokens(self, tokens: List[str], field: str = "ingredients", stop_below: int = 0) -> np.ndarray:
+        """Rows containing every token (any order). With ``stop_below`` > 0 the
+        intersection stops early once the candidate set is that small, returning a superset."""
+        lists = sorted((self.postings(f"{field}.token", t) for t in dict.fromkeys(tokens)), key=len)
+        if not lists:
+            return np.empty(0, dtype=np.uint32)
+        cand = np.asarray(lists[0])
+        for pl in lists[1:]:
+            if len(cand) <= stop_below:
+                break
+            cand = np.intersect1d(cand, pl, assume_unique=True)
+        return cand
+
+    def candidate_rows(self, matcher: TargetMatcher, field: str = "ingredients") -> np.ndarray:
+        """Superset of rows in which any of the matcher's surface forms can occur."""
+        parts = [self.rows_with_tokens(toks, field, stop_below=256) for _, toks in matcher.surfaces]
+        parts = [p for p in parts if len(p)]
+        return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint32)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True, type=Path)
+    ap.add_argument("--syn", default=None, type=Path)
+    ap.add_argument("--out", required=True, type=Path, help="index directory")
+    a = ap.parse_args()
+    build_index(a.inp, a.out, a.syn)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,365 @@
-import argparse
+"""
+Cross-source entity resolution: harmonized.parquet -> integrated.parquet + golden.parquet.
+
+Records are never compared all-pairs. Each record emits a few blocking keys and
+only records sharing a key are compared:
+- `id:`  DSLD UPC/GTIN (upcSku: 8/12/13/14 digits with a valid check digit,
+         zero-padded to 14), Amazon ASIN, or curated_id (identical key fields).
+         Members from the same source are linked without comparison; when an id
+         block spans sources, its groups are scored like any other candidates
+         (brand guard included), so an id alone never merges across sources
+- `bn:`  normalized brand (company name when brand is empty) + one of the
+         record's 3 rarest product-name tokens
+- `nm:`  pair of rare name tokens, for records without brand or company
+Blocks above --max_block members (generic keys) are skipped. Candidate pairs are
+scored on name-token Jaccard (or containment, when ingredient lists agree) and
+penalized when canonical ingredients disagree; matches are unioned into clusters. Block comparison runs on a process pool (--workers).
+
+Outputs:
+- integrated.parquet  every harmonized row, in order, plus `curated_id`
+                      (SHA-256 over key fields) and `cluster_id`
+- golden.parquet      one merged record per cluster: per field, the first
+                      non-empty value by source priority (DSLD, Internal,
+                      Amazon, Knowde), then newest entry_date; plus `n_records`,
+                      `sources` and `source_record_ids`
+- provenance/merge_stats.json  block / comparison / cluster counts
+
+CLI:
+  uv run python -m src.integrate.merge --in data/interim/harmonized.parquet --out data/interim/integrated.parquet --golden data/interim/golden.parquet --workers 4
+"""
+from __future__ import annotations
+import argparse, hashlib, json, re, unicodedata
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 
+from src.preprocess.canonical import normalize_item
+from src.utils import instrument
+from src.utils.schema import read_table
+
+SOURCE_PRIORITY = ["DSLD", "Internal", "Amazon", "Knowde"]
+CURATED_ID_FIELDS = ["source", "source_record_id", "product_name", "brand", "link", "entry_date"]
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_ASIN = re.compile(r"^B0[0-9A-Z]{8}$")
+_CORP_SUFFIX = {"inc", "llc", "ltd", "co", "corp", "corporation", "company", "gmbh", "sa", "ag", "plc", "the"}
+# packaging / size words carry no product identity
+_NAME_STOP = {"and", "with", "for", "of", "the", "a", "in", "by", "to", "count", "ct", "pack", "capsule", "capsules",
+              "caps", "tablet", "tablets", "softgel", "softgels", "gummies", "servings", "supplement", "dietary",
+              "mg", "mcg", "g", "iu", "oz", "fl", "ml", "lb"}
+
+# ---------------- normalization / features ----------------
+def norm_text(s: Optional[str]) -> str:
+    s = unicodedata.normalize("NFKD", s or "").encode("ascii", "ignore").decode().lower()
+    return _NON_ALNUM.sub(" ", s).strip()
+
+def norm_brand(brand: Optional[str], company: Optional[str] = None) -> str:
+    toks = [t for t in norm_text(brand or company).split() if t not in _CORP_SUFFIX]
+    return " ".join(toks)
+
+def gtin_ok(digits: str) -> bool:
+    """GTIN-8/12/13/14 with a valid mod-10 check digit."""
+    if len(digits) not in (8, 12, 13, 14) or not digits.isdigit():
+        return False
+    total = sum(int(c) * (3 if k % 2 == 0 else 1) for k, c in enumerate(reversed(digits[:-1])))
+    return (10 - total % 10) % 10 == int(digits[-1])
+
+def norm_id(source: str, rid: Optional[str]) -> Optional[str]:
+    """Id blocking key, only for fields that are real product ids: DSLD upcSku (GTIN) and Amazon ASIN.
+
+    Other sources' ids (Internal, Knowde) are local keys; a numeric one must not
+    pass for a UPC. DSLD falls back to dsldId when upcSku is empty, which the
+    length and check-digit test keeps out.
+    """
+    rid = (rid or "").strip()
+    if source == "DSLD":
+        digits = re.sub(r"[\s-]", "", rid)
+        return "id:upc:" + digits.zfill(14) if gtin_ok(digits) else None
+    if source == "Amazon" and _ASIN.match(rid.upper()):
+        return "id:asin:" + rid.upper()
+    return None
+
+def name_tokens(name: Optional[str], brand_norm: str) -> frozenset:
+    """Identity tokens of a product name: brand words, packaging words and quantities
+    ("120 capsules", "10 000 iu") are dropped; model numbers ("EF 2006") are kept."""
+    skip = set(brand_norm.split())
+    toks = norm_text(name).split()
+    out = []
+    for k, t in enumerate(toks):
+        if t in skip or t in _NAME_STOP or len(t) < 2 and not t.isdigit():
+            continue
+        if t.isdigit() and any(u in _NAME_STOP for u in toks[k + 1:k + 3]):
+            continue
+        out.append(t)
+    return frozenset(out)
+
+def _memo_map(fn, keys) -> list:
+    """``fn(*k)`` per distinct key (listings repeat names/brands/ingredient lists heavily)."""
+    memo: Dict = {}
+    out = []
+    for k in keys:
+        v = memo.get(k)
+        if v is None:
+            v = memo[k] = fn(*k)
+        out.append(v)
+    return out
+
+def _ingredient_set(*items: str) -> frozenset:
+    return frozenset(n for n in (normalize_item(i) for i in items) if n)
+
+class Features:
+    """Per-record comparison features, as parallel lists indexed by row."""
+    def __init__(self, tbl: pa.Table):
+        cols = {k: tbl.column(k).to_pylist() for k in
+                ("source", "source_record_id", "product_name", "brand", "company_name", "ingredients")}
+        self.n = tbl.num_rows
+        self.source = cols["source"]
+        self.brand = _memo_map(norm_brand, zip(cols["brand"], cols["company_name"]))
+        self.ids = _memo_map(norm_id, zip(cols["source"], cols["source_record_id"]))
+        self.names = _memo_map(name_tokens, zip(cols["product_name"], self.brand))
+        self.ings = _memo_map(_ingredient_set, (tuple(v or ()) for v in cols["ingredients"]))
+
+def blocking_keys(f: Features, cids: List[str], rare_k: int = 3) -> Dict[str, List[int]]:
+    df = Counter(t for toks in f.names for t in toks)
+    blocks: Dict[str, List[int]] = defaultdict(list)
+    for i in range(f.n):
+        blocks["id:cur:" + cids[i]].append(i)
+        if f.ids[i]:
+            blocks[f.ids[i]].append(i)
+        rare = sorted(f.names[i], key=lambda t: (df[t], t))[:rare_k]
+        if f.brand[i]:
+            for t in rare:
+                blocks[f"bn:{f.brand[i]}|{t}"].append(i)
+        else:
+            for a, b in combinations(sorted(rare), 2):
+                blocks[f"nm:{a}|{b}"].append(i)
+    return blocks
+
+# ---------------- pair scoring (runs in workers) ----------------
+_F: Optional[Features] = None
+
+def _init_worker(features: Features) -> None:
+    global _F
+    _F = features
+
+def score(f: Features, i: int, j: int) -> float:
+    if f.brand[i] and f.brand[j] and f.brand[i] != f.brand[j]:
+        return 0.0
+    a, b = f.names[i], f.names[j]
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    s = inter / len(a | b)
+    ia, ib = f.ings[i], f.ings[j]
+    if ia and ib:
+        ing = len(ia & ib) / len(ia | ib)
+        # label names differ a lot across sources (DSLD "MycoAdrenal" vs a long Amazon
+        # title): a name contained in the other counts when the ingredient lists agree
+        if inter == min(len(a), len(b)):
+            s = max(s, ing)
+        if ing < 0.5:
+            s *= ing / 0.5
+    return s
+
+def _compare_blocks(blocks: List[List[int]], threshold: float) -> Tuple[List[Tuple[int, int]], int]:
+    f, seen, out = _F, set(), []
+    for rows in blocks:
+        for i, j in combinations(rows, 2):
+            if (i, j) in seen:
+                continue
+            seen.add((i, j))
+            if score(f, i, j) >= threshold:
+                out.append((i, j))
+    return out, len(seen)
+
+# ---------------- clustering ----------------
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = np.arange(n)
+
+    def find(self, x: int) -> int:
+        p = self.parent
+        root = x
+        while p[root] != root:
+            root = p[root]
+        while p[x] != root:
+            p[x], x = root, p[x]
+        return int(root)
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+def curated_ids(tbl: pa.Table) -> List[str]:
+    cols = [tbl.column(k).to_pylist() if k in tbl.column_names else [None] * tbl.num_rows for k in CURATED_ID_FIELDS]
+    return [hashlib.sha256("\x1f".join("" if v is None else str(v) for v in vals).encode("utf-8")).hexdigest()[:20]
+            for vals in zip(*cols)]
+
+def resolve(tbl: pa.Table, cids: List[str], workers: int = 1, threshold: float = 0.8,
+            max_block: int = 500) -> Tuple[np.ndarray, Dict]:
+    """Return (root row per record, stats)."""
+    f = Features(tbl)
+    uf = _UnionFind(f.n)
+    blocks = blocking_keys(f, cids)
+    cross_id = []
+    for key, rows in blocks.items():
+        if key.startswith("id:"):
+            by_source: Dict[str, List[int]] = defaultdict(list)
+            for r in rows:
+                by_source[f.source[r]].append(r)
+            for group in by_source.values():
+                for r in group[1:]:
+                    uf.union(group[0], r)
+            if len(by_source) > 1:  # an id shared across sources is only a candidate
+                cross_id.append(rows)
+    # compare one representative per id-linked group, so re-crawled copies do not inflate blocks
+    todo, skipped = [], 0
+    for rows in [rows for key, rows in blocks.items() if not key.startswith("id:")] + cross_id:
+        reps = list(dict.fromkeys(uf.find(r) for r in rows))
+        if len(reps) < 2:
+            continue
+        if len(reps) > max_block:
+            skipped += 1
+        else:
+            todo.append(reps)
+    # balance work by pair count, not block count
+    todo.sort(key=len, reverse=True)
+    chunks: List[List[List[int]]] = [[] for _ in range(max(1, workers * 4))]
+    load = [0] * len(chunks)
+    for rows in todo:
+        k = load.index(min(load))
+        chunks[k].append(rows)
+        load[k] += len(rows) * (len(rows) - 1) // 2
+    chunks = [c for c in chunks if c]
+    comparisons = 0
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(f,)) as ex:
+            results = list(ex.map(_compare_blocks, chunks, [threshold] * len(chunks)))
+    else:
+        _init_worker(f)
+        results = [_compare_blocks(c, threshold) for c in chunks]
+    matches = 0
+    for pairs, n_cmp in results:
+        comparisons += n_cmp
+        matches += len(pairs)
+        for i, j in pairs:
+            uf.union(i, j)
+    roots = np.fromiter((uf.find(i) for i in range(f.n)), dtype=np.int64, count=f.n)
+    stats = {"records": f.n, "blocks": len(todo), "blocks_skipped": skipped,
+             "comparisons": comparisons, "matched_pairs": matches}
+    return roots, stats
+
+# ---------------- golden records ----------------
+def _empty_to_null(col: pa.ChunkedArray) -> pa.ChunkedArray:
+    t = col.type
+    if pa.types.is_dictionary(t):
+        col = col.cast(t.value_type)
+        t = t.value_type
+    if pa.types.is_string(t) or pa.types.is_large_string(t):
+        return pc.if_else(pc.equal(pc.utf8_trim_whitespace(col), ""), pa.scalar(None, t), col)
+    if pa.types.is_list(t):
+        return pc.if_else(pc.equal(pc.list_value_length(col), 0), pa.scalar(None, t), col)
+    return col
+
+def golden_records(tbl: pa.Table) -> pa.Table:
+    """One row per cluster_id, each field from the highest-priority member that has it."""
+    prio = {s: i for i, s in enumerate(SOURCE_PRIORITY)}
+    src = tbl.column("source").cast(pa.string()).to_pylist()
+    work = tbl.append_column("_prio", pa.array([prio.get(s, len(prio)) for s in src], pa.int32())) \
+              .append_column("_row", pa.array(np.arange(tbl.num_rows)))
+    work = work.sort_by([("cluster_id", "ascending"), ("_prio", "ascending"),
+                         ("entry_date", "descending"), ("_row", "ascending")])
+    pos = pa.array(np.arange(work.num_rows))
+    keys = work.select(["cluster_id"])
+    firsts = {}
+    for name in tbl.column_names:
+        if name in ("cluster_id", "curated_id"):
+            continue
+        col = _empty_to_null(work.column(name))
+        firsts[name] = pc.if_else(pc.is_null(col), pa.scalar(None, pa.int64()), pos)
+    grouped = keys.append_column("_n", pa.array(np.ones(work.num_rows, np.int64)))
+    for name, first in firsts.items():
+        grouped = grouped.append_column(f"_f_{name}", first)
+    grouped = grouped.append_column("_sources", work.column("source").cast(pa.string())) \
+                     .append_column("_ids", _empty_to_null(work.column("source_record_id")))
+    agg = grouped.group_by("cluster_id", use_threads=False).aggregate(
+        [("_n", "sum")] + [(f"_f_{n}", "min") for n in firsts] + [("_sources", "distinct"), ("_ids", "distinct")])
+    agg = agg.sort_by("cluster_id")
+    cols = {"cluster_id": agg.column("cluster_id")}
+    for name in firsts:
+        idx = agg.column(f"_f_{name}_min")
+        cols[name] = pc.take(work.column(name), idx)
+    cols["n_records"] = agg.column("_n_sum")
+    # distinct keeps first-seen order (= source priority) and skips nulls
+    cols["sources"] = agg.column("_sources_distinct")
+    cols["source_record_ids"] = agg.column("_ids_distinct")
+    return pa.table(cols)
+
+def link_records(tbl: pa.Table, workers: int = 1, threshold: float = 0.8,
+                 max_block: int = 500) -> Tuple[pa.Table, Dict]:
+    """Harmonized table -> (integrated table with curated_id / cluster_id, stats)."""
+    cids = curated_ids(tbl)
+    roots, stats = resolve(tbl, cids, workers, threshold, max_block)
+    # cluster id = smallest curated_id among members, so it does not depend on row order
+    by_root: Dict[int, str] = {}
+    for r, c in zip(roots.tolist(), cids):
+        if r not in by_root or c < by_root[r]:
+            by_root[r] = c
+    cluster = [by_root[r] for r in roots.tolist()]
+    out = tbl.append_column("curated_id", pa.array(cids, pa.large_string())) \
+             .append_column("cluster_id", pa.array(cluster, pa.large_string()))
+    sizes = Counter(cluster)
+    stats.update({"clusters": len(sizes), "multi_record_clusters": sum(1 for v in sizes.values() if v > 1),
+                  "largest_cluster": max(sizes.values(), default=0)})
+    return out, stats
+
+def golden_stats(golden: pa.Table, stats: Dict) -> None:
+    stats["multi_source_clusters"] = sum(1 for v in golden.column("sources").to_pylist() if len(v) > 1)
+
+def write_stats(stats: Dict, stats_path: Optional[Path] = None) -> None:
+    prov = stats_path or Path("provenance") / "merge_stats.json"
+    try:
+        prov.parent.mkdir(parents=True, exist_ok=True)
+        prov.write_text(json.dumps(stats, indent=2), encoding="utf-8")
+    except Exception:
+        pass
+
+def merge(in_path: Path, out_path: Path, golden_path: Optional[Path] = None, workers: int = 1,
+          threshold: float = 0.8, max_block: int = 500, stats_path: Optional[Path] = None) -> Dict:
+    out, stats = link_records(read_table(in_path), workers, threshold, max_block)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(out, out_path, compression="snappy")
+    if golden_path:
+        golden = golden_records(out)
+        golden_stats(golden, stats)
+        golden_path.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(golden, golden_path, compression="snappy")
+    write_stats(stats, stats_path)
+    return stats
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--in", dest="inp", required=True)
-    ap.add_argument("--out", dest="out", required=True)
+    ap.add_argument("--in", dest="inp", required=True, type=Path)
+    ap.add_argument("--out", dest="out", required=True, type=Path)
+    ap.add_argument("--golden", default=None, type=Path, help="golden-record Parquet (one row per cluster)")
+    ap.add_argument("--workers", type=int, default=1, help="process pool size for block comparison; 1 = serial")
+    ap.add_argument("--threshold", type=float, default=0.8, help="pair score needed to link two records")
+    ap.add_argument("--max_block", type=int, default=500, help="skip (non-id) blocks larger than this")
+    instrument.add_profile_arg(ap)
     a = ap.parse_args()
+    instrument.configure(a.profile)
 
-    Path(a.out).parent.mkdir(parents=True, exist_ok=True)
-    tbl = pq.read_table(a.inp)
-    pq.write_table(tbl, a.out, compression="snappy")
+    with instrument.stage("integrate", inputs=[a.inp], outputs=[a.out] + ([a.golden] if a.golden else [])) as rec:
+        stats = merge(a.inp, a.out, a.golden, a.workers, a.threshold, a.max_block)
+        rec.rows_in, rec.rows_out = stats["records"], stats["clusters"]
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,222 @@
+"""
+Single-process pipeline runner: the Snakefile DAG without a subprocess per rule.
+
+Stages run in one interpreter and hand Arrow tables to each other in memory:
+
+  manifest ─┐
+  dsld ─────┤
+  amazon ───┼─> harmonize -> integrate ─┬─> near_duplicates -> validate ─┬─> checksums, run_meta
+  knowde ───┤                           └─> export (UC-1 / UC-2) ────────┘
+  internal ─┘
+
+Independent stages (the manifest and the four sources; validation and
+export) run concurrently on a thread pool. Arrow kernels release the GIL,
+and the CPU-heavy steps bring their own process pools (`ingest_workers`
+for DSLD, `merge_workers` for entity resolution). Those pools are started
+with "forkserver": forking a process that is running other threads can
+deadlock the children.
+
+Final outputs are the same files as the Snakefile: the quality report, the
+UC-1/UC-2 CSVs, the DSLD dosage table, the manifest, checksums and run
+metadata, plus the provenance stats JSONs. Intermediate Parquet (per-source files, harmonized,
+integrated, golden, near-duplicates) and the ingredient index are written
+only for the groups named in --keep. With `incremental_ingest: true` the
+per-source files are always written, because the incremental store lives
+next to them. With `partition_by` set, the per-source and harmonized outputs
+are always written as partitioned datasets (src.utils.dataset) and read
+back, so downstream stages see rows in the same partition-grouped order as
+under the Snakefile.
+
+Snakemake is unchanged and remains the way to rebuild single targets.
+
+Each stage also appends a record to the stage metrics history
+(src.utils.instrument) next to `runmeta_path`; --profile DIR dumps a cProfile
+per stage.
+
+CLI:
+  uv run python main.py --config workflow/config.yaml
+  uv run python -m src.pipeline --keep integrated ingredient_index
+"""
+from __future__ import annotations
+import argparse, json, multiprocessing, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import yaml
+
+from src.integrate import merge as merge_mod
+from src.integrate.ingredient_index import build_index
+from src.preprocess.aggregate_dir import ingest_dir_to_parquet, ingest_dir_to_table
+from src.preprocess.harmonize import harmonize_tables
+from src.utils import instrument
+from src.utils.dataset import DEFAULT_ROW_GROUP_SIZE, write_partitioned
+from src.utils.provenance import HashCache, write_checksums, write_manifest, write_runmeta
+from src.utils.schema import read_table, to_pandas
+from src.validate import near_duplicates as nd_mod
+from src.validate.checks import run_checks, write_report
+from src.views.export import build_views, load_targets, write_view
+
+SOURCES = ["dsld", "amazon", "knowde", "internal"]
+KEEP = ["sources", "harmonized", "integrated", "golden", "near_duplicates", "ingredient_index"]
+SCHEMA_PATH = Path("metadata/dataset.schema.json")
+
+class Timings:
+    """Wall-clock seconds per stage (stages on different threads overlap); see src.utils.instrument."""
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str, **kw):
+        with instrument.stage(name, **kw) as rec:
+            t0 = time.perf_counter()
+            try:
+                yield rec
+            finally:
+                self.seconds[name] = round(time.perf_counter() - t0, 3)
+
+def _write_parquet(tbl: pa.Table, path: Path, row_group_size: Optional[int] = None) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(tbl, path, compression="snappy", row_group_size=row_group_size)
+
+def _partitioned(tbl: pa.Table, path: Path, params: dict) -> pa.Table:
+    """Write ``tbl`` as a dataset directory and read it back in dataset order."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_partitioned(tbl, path, params["partition_by"], params.get("row_group_size", DEFAULT_ROW_GROUP_SIZE))
+    return read_table(path)
+
+def _ingest(cfg: dict, src: str, keep: set, t: Timings) -> pa.Table:
+    params, out = cfg["params"], Path(cfg["outputs"][f"{src}_parquet"])
+    in_dir = Path(cfg["inputs"][f"{src}_dir"])
+    kw = dict(batch_size=params["batch_size"],
+              # as in the Snakefile: on-market filter and process pool are DSLD-only
+              only_on_market=src == "dsld" and params.get("only_on_market", False),
+              workers=params.get("ingest_workers", 1) if src == "dsld" else 1,
+              fast=params.get("fast_ingest", False),
+              record_cache=Path(params["record_cache"]) if params.get("record_cache") else None)
+    if src == "dsld":  # the dosage table comes out of the same pass and is always written
+        kw.update(dosage_path=Path(cfg["outputs"]["dsld_dosage"]), units_path=Path(params["units_file"]))
+    with t.stage(f"aggregate_{src}", inputs=[in_dir]) as rec:
+        if params.get("incremental_ingest", False):
+            ingest_dir_to_parquet(src, in_dir, out, incremental=True, partition_by=params.get("partition_by") or None,
+                                  row_group_size=params.get("row_group_size", DEFAULT_ROW_GROUP_SIZE), **kw)
+            tbl = read_table(out)
+        else:
+            tbl, _ = ingest_dir_to_table(src, in_dir, **kw)
+            if params.get("partition_by"):
+                tbl = _partitioned(tbl, out, params)
+            elif "sources" in keep:
+                _write_parquet(tbl, out, kw["batch_size"])
+        rec.rows_out = tbl.num_rows
+        return tbl
+
+def _validate(cfg: dict, integrated: pa.Table, schema: dict, keep: set, t: Timings) -> None:
+    outs = cfg["outputs"]
+    with t.stage("near_duplicates") as rec:
+        rec.rows_in = integrated.num_rows
+        cols = [c for c in nd_mod.ID_COLS + ["ingredients"] if c in integrated.column_names]
+        clusters, stats = nd_mod.find_near_duplicates(integrated.select(cols))
+        nd_mod.write_stats(stats)
+        if "near_duplicates" in keep:
+            _write_parquet(clusters, Path(outs["near_duplicates"]))
+    with t.stage("validate_curated", outputs=[outs["quality_report_path"]]) as rec:
+        rec.rows_in = integrated.num_rows
+        write_report(run_checks(integrated, schema, clusters), Path(outs["quality_report_path"]))
+
+def _export(cfg: dict, integrated: pa.Table, t: Timings) -> None:
+    outs, params = cfg["outputs"], cfg["params"]
+    with t.stage("export_views", outputs=[outs["uc1_path"], outs["uc2_path"]]) as rec:
+        uc1, uc2 = build_views(to_pandas(integrated), load_targets(Path(params["targets_file"])),
+                               Path(params["synonyms_file"]))
+        write_view(uc1, outs["uc1_path"])
+        write_view(uc2, outs["uc2_path"])
+        rec.rows_in, rec.rows_out = integrated.num_rows, len(uc1)
+
+def run_pipeline(config_path: Path, keep: Iterable[str] = (), schema_path: Path = SCHEMA_PATH,
+                 threads: int = 6, profile_dir: Optional[Path] = None) -> Dict[str, float]:
+    """Run every stage of the Snakefile in this process; returns per-stage wall seconds.
+
+    Call under the "forkserver" start method (as `main` does) when ingest or merge workers > 1.
+    """
+    cfg = yaml.safe_load(config_path.read_text(encoding="utf-8"))
+    keep = set(KEEP) if "all" in keep else set(keep)
+    if "ingredient_index" in keep:
+        keep.add("integrated")  # the index is keyed to the integrated.parquet it was built from
+    params, outs = cfg["params"], cfg["outputs"]
+    schema = json.loads(schema_path.read_text(encoding="utf-8"))
+    instrument.configure(profile_dir, Path(outs["runmeta_path"]).parent / instrument.HISTORY_PATH.name)
+    instrument.run_id()
+    t = Timings()
+
+    with t.stage("total", profile=False), ThreadPoolExecutor(max_workers=threads) as ex:
+        def manifest():
+            with t.stage("manifest_raw"):
+                write_manifest(Path(cfg["inputs"]["raw_root"]), Path(outs["manifest_path"]), HashCache())
+        manifest_job = ex.submit(manifest)
+        ingest_jobs = [ex.submit(_ingest, cfg, src, keep, t) for src in SOURCES]
+        tables: List[pa.Table] = [job.result() for job in ingest_jobs]
+
+        with t.stage("harmonize") as rec:
+            rec.rows_in = sum(tbl.num_rows for tbl in tables)
+            vocab = params.get("ingredient_vocab")
+            harmonized = harmonize_tables(tables, Path(params["synonyms_file"]), Path(params["units_file"]),
+                                          vocab_path=Path(vocab) if vocab else None,
+                                          unresolved_path=Path(outs["unresolved_ingredients_path"]))
+            del tables
+            rec.rows_out = harmonized.num_rows
+            if params.get("partition_by"):
+                harmonized = _partitioned(harmonized, Path(outs["harmonized"]), params)
+            elif "harmonized" in keep:
+                _write_parquet(harmonized, Path(outs["harmonized"]))
+
+        with t.stage("integrate") as rec:
+            integrated, stats = merge_mod.link_records(harmonized, params.get("merge_workers", 1))
+            del harmonized
+            if "golden" in keep:
+                golden = merge_mod.golden_records(integrated)
+                merge_mod.golden_stats(golden, stats)
+                _write_parquet(golden, Path(outs["golden"]))
+            merge_mod.write_stats(stats)
+            rec.rows_in, rec.rows_out = stats["records"], stats["clusters"]
+            if "integrated" in keep:
+                _write_parquet(integrated, Path(outs["integrated"]))
+
+        jobs = [ex.submit(_validate, cfg, integrated, schema, keep, t), ex.submit(_export, cfg, integrated, t)]
+        if "ingredient_index" in keep:
+            def index():
+                with t.stage("ingredient_index"):
+                    build_index(Path(outs["integrated"]), Path(outs["ingredient_index"]), Path(params["synonyms_file"]))
+            jobs.append(ex.submit(index))
+        for job in jobs:
+            job.result()
+        manifest_job.result()
+
+        with t.stage("checksums"):
+            listed = [outs["quality_report_path"], outs["uc1_path"], outs["uc2_path"]]
+            if "integrated" in keep:  # src.views.query reloads when this checksum changes
+                listed.append(outs["integrated"])
+            write_checksums(listed, Path(outs["checksums_path"]), HashCache())
+        write_runmeta(config_path, Path(outs["runmeta_path"]))
+    return t.seconds
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Run the whole pipeline in one process (alternative to snakemake).")
+    ap.add_argument("--config", type=Path, default=Path("workflow/config.yaml"))
+    ap.add_argument("--schema", type=Path, default=SCHEMA_PATH)
+    ap.add_argument("--keep", nargs="*", default=[], choices=KEEP + ["all"],
+                    help="intermediate outputs to write (default: none)")
+    ap.add_argument("--threads", type=int, default=6, help="concurrent stages")
+    instrument.add_profile_arg(ap)
+    a = ap.parse_args(argv)
+    multiprocessing.set_start_method("forkserver", force=True)
+    # the server imports the stages once, so workers fork from it warm instead of re-importing pyarrow/pandas
+    multiprocessing.set_forkserver_preload(["__main__", "src.preprocess.aggregate_dir", "src.preprocess.fast_ingest",
+                                            "src.integrate.merge",
+                                            "src.validate.checks", "src.views.export"])
+    run_pipeline(a.config, a.keep, a.schema, a.threads, a.profile)
+
+if __name__ == "__main__":
+    main()
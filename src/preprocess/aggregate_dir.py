@@ -2,28 +2,61 @@
 """
 Robust directory ingestion:
 - supports .json / .jsonl / .ndjson / .jl / .json.gz / .gz
-- supports top-level array JSON and NDJSON (one JSON per line)
+- supports top-level array JSON and NDJSON (one JSON per line), streamed record
+  by record so memory stays bounded for multi-GB dumps; a malformed array element
+  or NDJSON line is skipped (to the next element or line) and counted in the
+  stats as records_malformed
 - tolerant field extraction for amazon/knowde
-- writes Parquet with all-string columns
+- writes Parquet with the typed v2 schema from src.utils.schema (dictionary-encoded
+  categoricals, float quantities, bool on_market, list ingredients/claims);
+  --schema_version 1 keeps the legacy all-string layout
 - writes provenance stats to provenance/ingest_stats_<src>.json
+- optional --workers N: files are sharded across a process pool, each worker
+  spills Arrow IPC batches, and the parent merges shards in file order so the
+  Parquet output is identical to the serial path
+- optional --incremental: per-source state (size, mtime_ns, sha256, stats per
+  file) and one stored fragment of rows per raw file, so only new/changed files
+  are parsed and the output is assembled from the fragments in walk order (the
+  same file as a full build); a change to the code that builds rows (mappers,
+  fast path) re-parses everything
+- `ingest_dir_to_table` runs the same ingestion into an in-memory Arrow table
+  (used by src.pipeline, which only writes Parquet on request)
+- optional --fast: src.preprocess.fast_ingest parses each file in one call
+  (orjson when installed) and maps records to tuples instead of dicts; same output
+- optional --partition_by source entry_year: --out becomes a hive-partitioned
+  dataset directory (src.utils.dataset) with --row_group_size row groups
+- optional --dosage_out (DSLD): per-ingredient dosage rows from the same parsed
+  records, written as their own Parquet (src.preprocess.dosage)
+- optional --record_cache DIR: parsed records are kept per raw file (keyed by its
+  sha256) and re-read memory-mapped, so a mapper or FIELDS change does not
+  re-parse the JSON (src.preprocess.record_cache)
 """
 
 from __future__ import annotations
-import argparse, json, os, gzip
+import argparse, hashlib, json, os, gzip, re, tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Dict, Any, Iterable, List, Optional
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 
 import pyarrow as pa
+import pyarrow.ipc
 import pyarrow.parquet as pq
 
+from src.preprocess.canonical import load_units
+from src.preprocess.dosage import ROW_SCHEMA as DOSAGE_ROW_SCHEMA, DosageWriter, dsld_dosage_rows, rows_to_batch
+from src.preprocess.record_cache import RecordCache
+from src.utils import instrument
+from src.utils.dataset import DEFAULT_ROW_GROUP_SIZE, PartitionedWriter, add_partition_args, remove
+from src.utils.provenance import sha256_of_file
+from src.utils.stage_cache import code_version
+from src.utils.schema import CURRENT_VERSION, FIELDS, ITEMS, ROW_SCHEMA, schema_for, schema_version, upgrade_batch
+
 # ------------------ utils ------------------
-FIELDS = [
-    "source","source_path","source_record_id",
-    "product_name","brand","company_name","link","on_market","entry_date","form",
-    "serving_size","serving_unit","net_quantity","net_unit",
-    "ingredients","other_ingredients","claims","statements"
-]
-SCHEMA = pa.schema([(k, pa.large_string()) for k in FIELDS])
+# rows are built as v1 (all-string) records plus the items of list-valued source
+# fields; _RowGroupWriter upgrades them to the typed v2 schema per row group unless
+# --schema_version 1 is requested (then the items columns are dropped)
+SCHEMA = ROW_SCHEMA
 
 def _to_str(v: Any) -> Optional[str]:
     if v is None:
@@ -35,34 +68,163 @@ def _to_str(v: Any) -> Optional[str]:
 def _open_text(path: Path):
     return gzip.open(path, "rt", encoding="utf-8") if str(path).lower().endswith((".gz",)) else open(path, "r", encoding="utf-8")
 
-def _iter_records_from_file(path: Path) -> Iterable[Dict[str, Any]]:
-    # Try: whole-file JSON -> list -> NDJSON lines
+# Streaming reader: text is pulled in _READ_CHUNK pieces and decoded value by value
+# with JSONDecoder.raw_decode, so memory is bounded by the largest single record
+# (capped at _MAX_RECORD_CHARS) rather than by the file size.
+_READ_CHUNK = 1 << 20
+_MAX_RECORD_CHARS = 64 << 20
+_DECODER = json.JSONDecoder()
+_WS = " \t\r\n"
+MALFORMED = None  # what the readers yield for a skipped malformed value (None survives the record cache)
+# a value cut off by the window ends in an unterminated string or fails within a token of the end
+# (a literal, number or \uXXXX\uXXXX escape); anything earlier is malformed JSON
+_TRUNCATED_TAIL = 16
+
+# resync inside an array: outside strings stop at quotes, brackets and commas; inside at quotes and escapes
+_STRUCTURAL = re.compile(r'["\[\]{},]')
+_IN_STRING = re.compile(r'["\\]')
+
+def _truncated(buf: str, err: json.JSONDecodeError) -> bool:
+    """Whether a decode error is the window ending mid-value (more text may fix it) rather than bad JSON."""
+    return err.msg.startswith("Unterminated string") or len(buf) - err.pos <= _TRUNCATED_TAIL
+
+class _TextStream:
+    """Sliding text window over a file handle."""
+    def __init__(self, f, chunk_size: int = _READ_CHUNK):
+        self.f, self.chunk_size = f, chunk_size
+        self.buf, self.pos, self.eof = "", 0, False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # drop consumed text before growing the window
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_ws(self) -> Optional[str]:
+        """Advance past whitespace; return the next char or None at EOF."""
+        while True:
+            n = len(self.buf)
+            while self.pos < n and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < n:
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def skip_element(self) -> None:
+        """Move pos past the array element at pos: to the next ',' or ']' at its own depth (or EOF).
+
+        Brackets and strings (with escapes) are tracked; skipped text is dropped as the scan
+        goes, so a runaway element costs no more memory than a read chunk.
+        """
+        depth, in_str, i = 0, False, self.pos
+        while True:
+            m = (_IN_STRING if in_str else _STRUCTURAL).search(self.buf, i)
+            if m is None:
+                self.pos = len(self.buf)
+                if not self.fill():
+                    return
+                i = self.pos
+                continue
+            i, ch = m.end(), m.group()
+            if in_str:
+                if ch == "\\":
+                    if i >= len(self.buf):  # the escaped char is in the next chunk
+                        self.pos = i - 1
+                        if not self.fill():
+                            self.pos = len(self.buf)
+                            return
+                        i = self.pos + 1
+                    i += 1
+                else:
+                    in_str = False
+            elif ch == '"':
+                in_str = True
+            elif ch in "[{":
+                depth += 1
+            elif ch in "]}" and depth:
+                depth -= 1
+            elif ch in ",]" and not depth:
+                self.pos = i - 1
+                return
+
+    def decode(self, line_mode: bool = False, in_array: bool = False):
+        """Decode the value at pos, reading more text as needed.
+
+        Returns (obj, ok). On a malformed value ok is False and the window is
+        resynced: to the next element of an array (``in_array``), else to the next line.
+        """
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+                self.pos = end
+                return obj, True
+            except json.JSONDecodeError as e:
+                nl = self.buf.find("\n", self.pos)
+                # NDJSON: a complete line failed to decode -> malformed record
+                if line_mode and nl != -1:
+                    self.pos = nl + 1
+                    return None, False
+                # only a value cut off by the end of the window is worth reading more text for
+                if _truncated(self.buf, e) and len(self.buf) - self.pos < _MAX_RECORD_CHARS and self.fill():
+                    continue
+                if in_array:
+                    self.skip_element()
+                    return None, False
+                nl = self.buf.find("\n", self.pos)
+                self.pos = nl + 1 if nl != -1 else len(self.buf)
+                return None, False
+
+def _iter_json_array(ts: _TextStream) -> Iterable[Dict[str, Any]]:
+    ts.pos += 1  # '['
+    while True:
+        c = ts.skip_ws()
+        if c is None or c == "]":
+            return
+        if c == ",":
+            ts.pos += 1
+            continue
+        obj, ok = ts.decode(in_array=True)
+        if not ok:
+            yield MALFORMED  # skipped to the next element
+        elif isinstance(obj, dict):
+            yield obj
+
+def _iter_json_values(ts: _TextStream, line_mode: bool = False) -> Iterable[Dict[str, Any]]:
+    # one or more whitespace-separated JSON values: a single (pretty-printed) object or NDJSON
+    while True:
+        c = ts.skip_ws()
+        if c is None:
+            return
+        start = ts.pos
+        obj, ok = ts.decode(line_mode)
+        if ok and not line_mode:
+            # a first value that sat on one line means NDJSON: resync bad lines eagerly
+            line_mode = "\n" not in ts.buf[start:ts.pos]
+        if not ok:
+            yield MALFORMED
+        elif isinstance(obj, dict):
+            yield obj
+
+def _iter_records_from_file(path: Path) -> Iterable[Optional[Dict[str, Any]]]:
+    # Auto-detect: top-level array -> stream elements; otherwise object / NDJSON values.
+    # Yields each record dict, and MALFORMED for each malformed value skipped.
     try:
         with _open_text(path) as f:
-            txt = f.read()
-        try:
-            obj = json.loads(txt)
-            if isinstance(obj, dict):
-                yield obj
+            ts = _TextStream(f)
+            c = ts.skip_ws()
+            if c is None:
                 return
-            if isinstance(obj, list):
-                for it in obj:
-                    if isinstance(it, dict):
-                        yield it
-                return
-        except Exception:
-            pass
-        # NDJSON line-by-line
-        for ln in txt.splitlines():
-            ln = ln.strip()
-            if not ln:
-                continue
-            try:
-                o = json.loads(ln)
-                if isinstance(o, dict):
-                    yield o
-            except Exception:
-                continue
+            if c == "[":
+                yield from _iter_json_array(ts)
+            else:
+                yield from _iter_json_values(ts)
     except Exception:
         return
 
@@ -122,6 +284,8 @@ def map_dsld(obj: Dict[str, Any], only_on_market: bool = True) -> Optional[Dict[
         net_qty = n0.get("quantity")
         net_unit = n0.get("unit")
 
+    claims = [(c or {}).get("langualCodeDescription","") for c in (obj.get("claims") or []) if (c or {}).get("langualCodeDescription")]
+
     return {
         "source": "DSLD",
         "source_path": obj.get("_file",""),
@@ -139,8 +303,11 @@ def map_dsld(obj: Dict[str, Any], only_on_market: bool = True) -> Optional[Dict[
         "net_unit": net_unit,
         "ingredients": ", ".join(ing_names) if ing_names else "",
         "other_ingredients": ", ".join(other_ings) if other_ings else "",
-        "claims": "; ".join([(c or {}).get("langualCodeDescription","") for c in (obj.get("claims") or []) if (c or {}).get("langualCodeDescription")]) or "",
+        "claims": "; ".join(claims) or "",
         "statements": "; ".join([(s or {}).get("notes","") for s in (obj.get("statements") or []) if (s or {}).get("notes")]) or "",
+        "ingredients_items": ing_names,
+        "other_ingredients_items": other_ings,
+        "claims_items": claims,
     }
 
 def map_amazon(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -167,7 +334,8 @@ def map_amazon(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         serving_unit = " ".join(parts[1:]) if len(parts) > 1 else "count"
 
     # claims from about_this_item (list or str)
-    claims = "; ".join(obj.get("about_this_item") or []) if isinstance(obj.get("about_this_item"), list) else (obj.get("about_this_item") or "")
+    about = obj.get("about_this_item")
+    claims = "; ".join(about or []) if isinstance(about, list) else (about or "")
 
     rec = {
         "source": "Amazon",
@@ -188,6 +356,7 @@ def map_amazon(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         "other_ingredients": obj.get("other_ingredients") or "",
         "claims": claims,
         "statements": obj.get("warnings") or "",
+        "claims_items": about if isinstance(about, list) else None,
     }
 
     # keep record if it has at least a name (or ingredients) or ASIN
@@ -228,8 +397,9 @@ def map_knowde(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 def map_internal(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     if not isinstance(obj, dict):
         return None
-    # ingredients list → string
+    # ingredients list → string (the list itself is kept as the items)
     ings = obj.get("ingredients") or []
+    items = ings if isinstance(ings, list) else None
     if isinstance(ings, list):
         ings = ", ".join(ings)
 
@@ -252,6 +422,7 @@ def map_internal(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         "other_ingredients": "",
         "claims": obj.get("claims") or "",
         "statements": "",
+        "ingredients_items": items,
     }
     # internal 允许只有 (name 或 ingredients 或 link) 也入库
     if not any([rec["product_name"], rec["ingredients"], rec["link"]]):
@@ -262,59 +433,459 @@ def map_internal(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 MAPPERS = {"dsld": map_dsld, "amazon": map_amazon, "knowde": map_knowde, "internal": map_internal}
 
 # ---------------- main ingest ----------------
-def ingest_dir_to_parquet(src: str, in_dir: Path, out_path: Path, batch_size: int = 2000, only_on_market: bool = True):
+def _new_stats() -> Dict[str, int]:
+    return {"files_seen":0, "records_emitted":0, "files_with_records":0, "files_errors":0, "records_malformed":0}
+
+def _add_stats(total: Dict[str, int], part: Dict[str, int]) -> None:
+    for k, v in part.items():
+        total[k] = total.get(k, 0) + v
+
+def _row(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """Mapper record -> ROW_SCHEMA row: FIELDS coerced to strings, list items as the mapper built them."""
+    row: Dict[str, Any] = {k: _to_str(rec.get(k)) for k in FIELDS}
+    for col in ITEMS.values():
+        row[col] = rec.get(col) or None  # an empty list reads as no items, like an empty string
+    return row
+
+def _iter_file_rows(src: str, fp: Path, only_on_market: bool, stats: Dict[str, int],
+                    dosage: Optional[list] = None,
+                    cache: Optional[RecordCache] = None) -> Iterable[Dict[str, Optional[str]]]:
+    """Yield schema-coerced rows for one file, updating ``stats`` in place.
+
+    With a ``dosage`` list (DSLD), the dosage rows of each emitted record are appended to it.
+    With a ``cache``, records come from (or are added to) the record cache.
+    """
     mapper = MAPPERS[src]
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    writer: Optional[pq.ParquetWriter] = None
-    batch: List[dict] = []
-    wrote_any = False
-
-    stats = {"files_seen":0, "records_emitted":0, "files_with_records":0, "files_errors":0}
-
-    for fp in _iter_json_files(in_dir):
-        stats["files_seen"] += 1
-        had_rec = False
-        try:
-            for obj in _iter_records_from_file(fp):
-                if isinstance(obj, dict):
-                    obj["_file"] = str(fp.as_posix())
-                rec = mapper(obj, only_on_market) if src == "dsld" else mapper(obj)
-                if rec:
-                    # coerce to strings for schema
-                    safe = {k: _to_str(rec.get(k)) for k in FIELDS}
-                    batch.append(safe)
-                    stats["records_emitted"] += 1
-                    had_rec = True
-                if len(batch) >= batch_size:
-                    table = pa.Table.from_pylist(batch, schema=SCHEMA)
-                    if writer is None:
-                        writer = pq.ParquetWriter(out_path, table.schema, compression="snappy")
-                    writer.write_table(table)
-                    batch.clear()
-                    wrote_any = True
-            if had_rec:
-                stats["files_with_records"] += 1
-        except Exception:
-            stats["files_errors"] += 1
-            continue
-
+    stats["files_seen"] += 1
+    had_rec = False
+    try:
+        records = cache.records(fp, _iter_records_from_file) if cache is not None else _iter_records_from_file(fp)
+        for obj in records:
+            if obj is MALFORMED:
+                stats["records_malformed"] += 1
+                continue
+            if isinstance(obj, dict):
+                obj["_file"] = str(fp.as_posix())
+            rec = mapper(obj, only_on_market) if src == "dsld" else mapper(obj)
+            if rec:
+                # coerce to strings for schema
+                stats["records_emitted"] += 1
+                had_rec = True
+                row = _row(rec)
+                if dosage is not None:
+                    dosage.extend(dsld_dosage_rows(obj, row["source_record_id"], row["source_path"]))
+                yield row
+        if had_rec:
+            stats["files_with_records"] += 1
+    except Exception:
+        stats["files_errors"] += 1
+
+class _RowGroupWriter:
+    """ParquetWriter that cuts fixed ``batch_size`` row groups however the input batches are sliced.
+
+    Input is v1 rows (plus the items columns); they are upgraded per row group, after
+    slicing, so the serial, parallel and incremental paths produce identical files.
+    """
+    def __init__(self, out_path: Path, batch_size: int, version: int = CURRENT_VERSION):
+        self.out_path, self.batch_size, self.version = out_path, batch_size, version
+        self.schema = schema_for(version)
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.pending: List[pa.RecordBatch] = []
+        self.n_pending = 0
+
+    def _typed(self, table: pa.Table) -> pa.Table:
+        if self.version == 2 and schema_version(table.schema) != 2:
+            table = pa.Table.from_batches([upgrade_batch(table)], schema=self.schema)
+        elif self.version == 1 and table.num_columns > len(FIELDS):
+            table = pa.Table.from_arrays(table.select(FIELDS).columns, schema=self.schema)  # drop the items
+        return table
+
+    def _flush(self, table: pa.Table) -> None:
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.out_path, self.schema, compression="snappy")
+        self.writer.write_table(self._typed(table))
+
+    def _drain(self) -> None:
+        if self.n_pending:
+            self._flush(pa.Table.from_batches(self.pending, schema=SCHEMA))
+        self.pending, self.n_pending = [], 0
+
+    def write(self, data) -> None:
+        if data.num_rows == 0:
+            return
+        self.pending.extend(data.to_batches() if isinstance(data, pa.Table) else [data])
+        self.n_pending += data.num_rows
+        while self.n_pending >= self.batch_size:
+            tbl = pa.Table.from_batches(self.pending, schema=SCHEMA)
+            self._flush(tbl.slice(0, self.batch_size))
+            rest = tbl.slice(self.batch_size)
+            self.pending, self.n_pending = rest.to_batches(), rest.num_rows
+
+    def close(self) -> None:
+        self._drain()
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            pq.write_table(self.schema.empty_table(), self.out_path, compression="snappy")
+
+class _TableCollector(_RowGroupWriter):
+    """Same row grouping and upgrade as _RowGroupWriter, kept in memory instead of written."""
+    def __init__(self, batch_size: int, version: int = CURRENT_VERSION):
+        super().__init__(None, batch_size, version)
+        self.tables: List[pa.Table] = []
+
+    def _flush(self, table: pa.Table) -> None:
+        self.tables.append(self._typed(table))
+
+    def close(self) -> None:
+        self._drain()
+
+    def table(self) -> pa.Table:
+        return pa.concat_tables(self.tables) if self.tables else self.schema.empty_table()
+
+class _DatasetWriter(_RowGroupWriter):
+    """Same row grouping and upgrade as _RowGroupWriter, written as a partitioned dataset directory."""
+    def __init__(self, out_dir: Path, batch_size: int, version: int, partition_by: List[str], row_group_size: int):
+        super().__init__(out_dir, batch_size, version)
+        self.dataset = PartitionedWriter(out_dir, self.schema, partition_by, row_group_size)
+
+    def _flush(self, table: pa.Table) -> None:
+        self.dataset.write(self._typed(table))
+
+    def close(self) -> None:
+        self._drain()
+        self.dataset.close()
+
+def _iter_v1_batches(src: str, files: Iterable[Path], only_on_market: bool, batch_size: int,
+                     file_stats: Dict[str, Dict[str, int]], fast: bool = False,
+                     dosage: Optional[list] = None, cache: Optional[RecordCache] = None) -> Iterable[pa.RecordBatch]:
+    """Map ``files`` into v1 batches of ``batch_size`` rows (the last may be short); fills ``file_stats``.
+
+    ``fast`` uses src.preprocess.fast_ingest (one-shot parse, tuple extractors); the batches are identical.
+    ``dosage`` collects DSLD dosage rows; all rows of a batch's records are in it when the batch is yielded.
+    """
+    if fast:
+        from src.preprocess.fast_ingest import iter_file_tuples as iter_rows, tuples_to_batch as to_batch
+    else:
+        iter_rows, to_batch = _iter_file_rows, lambda rows: pa.RecordBatch.from_pylist(rows, schema=SCHEMA)
+    batch: list = []
+    for fp in files:
+        fstats = _new_stats()
+        for row in iter_rows(src, fp, only_on_market, fstats, dosage, cache):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield to_batch(batch)
+                batch = []
+        file_stats[fp.as_posix()] = fstats
     if batch:
-        table = pa.Table.from_pylist(batch, schema=SCHEMA)
-        if writer is None:
-            writer = pq.ParquetWriter(out_path, table.schema, compression="snappy")
-        writer.write_table(table)
-        wrote_any = True
-
-    if writer is not None:
-        writer.close()
+        yield to_batch(batch)
+
+def _dosage_shard(shard_path: Path) -> Path:
+    return shard_path.with_suffix(".dosage.arrow")
+
+def _ingest_shard(src: str, files: List[Path], only_on_market: bool, batch_size: int, shard_path: Path,
+                  fast: bool = False, dosage: bool = False, cache: Optional[RecordCache] = None) -> List[tuple]:
+    """Worker: map a contiguous run of files and spill Arrow record batches to an IPC shard.
+
+    With ``dosage`` the DSLD dosage rows go to a second shard next to it. Returns per-file
+    stats as ``[(path, stats), ...]`` in input order.
+    """
+    file_stats: Dict[str, Dict[str, int]] = {}
+    dose_rows: Optional[list] = [] if dosage else None
+    with ExitStack() as stack:
+        sink = stack.enter_context(pa.OSFile(str(shard_path), "wb"))
+        w = stack.enter_context(pa.ipc.new_file(sink, SCHEMA))
+        if dosage:
+            dose_sink = stack.enter_context(pa.OSFile(str(_dosage_shard(shard_path)), "wb"))
+            dose_w = stack.enter_context(pa.ipc.new_file(dose_sink, DOSAGE_ROW_SCHEMA))
+        for rb in _iter_v1_batches(src, files, only_on_market, batch_size, file_stats, fast, dose_rows, cache):
+            w.write_batch(rb)
+            if dose_rows:
+                dose_w.write_batch(rows_to_batch(dose_rows))
+                dose_rows.clear()
+    return list(file_stats.items())
+
+def _shard_files(files: List[Path], n_shards: int) -> List[List[Path]]:
+    # contiguous chunks so that concatenating shards in order keeps the serial row order
+    size = max(1, -(-len(files) // max(1, n_shards)))
+    return [files[i:i + size] for i in range(0, len(files), size)]
+
+def _iter_parallel_batches(src: str, files: List[Path], only_on_market: bool, batch_size: int,
+                           workers: int, tmp_dir: Path, file_stats: Dict[str, Dict[str, int]],
+                           fast: bool = False, dosage_writer: Optional[DosageWriter] = None,
+                           cache: Optional[RecordCache] = None) -> Iterable[pa.RecordBatch]:
+    shards = _shard_files(files, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futs = [ex.submit(_ingest_shard, src, chunk, only_on_market, batch_size, tmp_dir / f"shard_{i:05d}.arrow", fast,
+                          dosage_writer is not None, cache)
+                for i, chunk in enumerate(shards)]
+        # merge strictly in shard order -> deterministic output regardless of completion order
+        for i, fut in enumerate(futs):
+            file_stats.update(fut.result())
+            shard_path = tmp_dir / f"shard_{i:05d}.arrow"
+            with pa.memory_map(str(shard_path), "r") as src_map:
+                reader = pa.ipc.open_file(src_map)
+                for j in range(reader.num_record_batches):
+                    yield reader.get_batch(j)
+            shard_path.unlink()
+            if dosage_writer is not None:
+                with pa.memory_map(str(_dosage_shard(shard_path)), "r") as dose_map:
+                    dosage_writer.write(pa.ipc.open_file(dose_map).read_all())
+                _dosage_shard(shard_path).unlink()
+
+def _ingest_files(src: str, files: Iterable[Path], w: _RowGroupWriter, only_on_market: bool, batch_size: int,
+                  workers: int, tmp_parent: Optional[Path], fast: bool = False,
+                  dosage_writer: Optional[DosageWriter] = None,
+                  cache: Optional[RecordCache] = None) -> Dict[str, Dict[str, int]]:
+    """Map ``files`` into ``w`` (serially or on a process pool); return per-file stats keyed by posix path.
+
+    ``dosage_writer`` receives the DSLD dosage rows of the same records, in the same order.
+    ``cache`` (a RecordCache) is indexed over ``files`` here, before any worker starts.
+    """
+    file_stats: Dict[str, Dict[str, int]] = {}
+    if cache is not None:
+        files = list(files)
+        cache.index(files)
+    if workers > 1:
+        with tempfile.TemporaryDirectory(prefix=f".ingest_{src}_", dir=tmp_parent) as tmp:
+            for rb in _iter_parallel_batches(src, list(files), only_on_market, batch_size, workers, Path(tmp),
+                                             file_stats, fast, dosage_writer, cache):
+                w.write(rb)
+    else:
+        dose_rows: Optional[list] = [] if dosage_writer is not None else None
+        for rb in _iter_v1_batches(src, files, only_on_market, batch_size, file_stats, fast, dose_rows, cache):
+            w.write(rb)
+            if dose_rows:
+                dosage_writer.add_rows(dose_rows)
+                dose_rows.clear()
+    return file_stats
+
+# ---------------- incremental state ----------------
+# The incremental store is a directory of per-raw-file fragments owned by
+# aggregate_dir (Snakemake deletes rule outputs before a job runs, so the output
+# itself cannot be the base for the next run). A fragment holds the v1 rows of one
+# raw file (ROW_SCHEMA; DSLD dosage rows in a second file next to it) and is named
+# after the file's path and sha256, so an unchanged file keeps its fragment as is.
+# The output is assembled from the fragments in walk order through the writers of
+# a full build, so it is the same file a full build writes.
+STATE_VERSION = 2
+# modules whose code shapes the rows (mappers, fast path, schema upgrade, dosage), with their src imports
+ROW_MODULES = ["src.preprocess.aggregate_dir", "src.preprocess.fast_ingest"]
+
+def _state_paths(src: str, state_dir: Path):
+    return state_dir / f"{src}.state.json", state_dir / f"{src}.fragments"
+
+def _fragment_name(key: str, sha256: str) -> str:
+    return f"{hashlib.sha256(key.encode()).hexdigest()[:16]}-{sha256[:16]}.parquet"
+
+def _dosage_fragment(frag: Path) -> Path:
+    return frag.with_suffix(".dosage.parquet")
+
+def _row_code_version() -> str:
+    return hashlib.sha256(json.dumps(code_version(ROW_MODULES), sort_keys=True).encode()).hexdigest()
+
+def _load_state(state_json: Path, frag_dir: Path, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        st = json.loads(state_json.read_text(encoding="utf-8"))
+        if st.get("version") != STATE_VERSION or st.get("params") != params:
+            return None
+        for fpr in st["files"].values():
+            frag = frag_dir / fpr["fragment"]
+            if not frag.exists() or (params["dosage"] and not _dosage_fragment(frag).exists()):
+                return None
+        return st
+    except Exception:
+        return None
 
-    if not wrote_any:
-        empty = pa.table({k: pa.array([], type=pa.large_string()) for k in FIELDS})
-        pq.write_table(empty, out_path, compression="snappy")
+def _fingerprint(fp: Path, prev: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """size/mtime_ns, plus sha256 (reused from ``prev`` when size and mtime are unchanged)."""
+    stat = fp.stat()
+    fpr = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if prev and prev.get("size") == fpr["size"] and prev.get("mtime_ns") == fpr["mtime_ns"]:
+        fpr["sha256"] = prev["sha256"]
+    else:
+        fpr["sha256"] = sha256_of_file(fp)
+    return fpr
+
+def _ingest_fragment(src: str, fp: Path, only_on_market: bool, batch_size: int, frag: Path,
+                     fast: bool = False, dosage: bool = False, cache: Optional[RecordCache] = None) -> Dict[str, int]:
+    """Worker: map one raw file into its fragment (and dosage fragment); returns the file's stats.
+
+    Both are written under a temporary name and renamed, so a fragment that exists is complete.
+    """
+    file_stats: Dict[str, Dict[str, int]] = {}
+    dose_rows: Optional[list] = [] if dosage else None
+    tmp = frag.with_name(f".{frag.name}.tmp")
+    dose_tmp = _dosage_fragment(frag).with_name(f".{_dosage_fragment(frag).name}.tmp")
+    with ExitStack() as stack:
+        w = stack.enter_context(pq.ParquetWriter(tmp, SCHEMA, compression="snappy"))
+        if dosage:
+            dose_w = stack.enter_context(pq.ParquetWriter(dose_tmp, DOSAGE_ROW_SCHEMA, compression="snappy"))
+        for rb in _iter_v1_batches(src, [fp], only_on_market, batch_size, file_stats, fast, dose_rows, cache):
+            w.write_batch(rb)
+            if dose_rows:
+                dose_w.write_batch(rows_to_batch(dose_rows))
+                dose_rows.clear()
+    if dosage:
+        os.replace(dose_tmp, _dosage_fragment(frag))
+    os.replace(tmp, frag)
+    return file_stats[fp.as_posix()]
+
+def _output_writer(out_path: Path, batch_size: int, version: int, partition_by: Optional[List[str]],
+                   row_group_size: int) -> _RowGroupWriter:
+    if partition_by:
+        return _DatasetWriter(out_path, batch_size, version, partition_by, row_group_size)
+    remove(out_path)
+    return _RowGroupWriter(out_path, batch_size, version)
+
+def _ingest_incremental(src: str, in_dir: Path, out_path: Path, batch_size: int, only_on_market: bool,
+                        workers: int, state_dir: Path, version: int = CURRENT_VERSION,
+                        fast: bool = False, partition_by: Optional[List[str]] = None,
+                        row_group_size: int = DEFAULT_ROW_GROUP_SIZE, dosage_path: Optional[Path] = None,
+                        units_path: Optional[Path] = None, cache: Optional[RecordCache] = None) -> Dict[str, int]:
+    """Re-parse only new/changed files into fresh fragments; drop the fragments of changed/deleted files.
+
+    Fragments of unchanged files are not touched. ``out_path`` (and ``dosage_path``) are then
+    written from all fragments in walk order, with the row grouping and upgrade of a full build.
+    """
+    state_dir.mkdir(parents=True, exist_ok=True)
+    state_json, frag_dir = _state_paths(src, state_dir)
+    frag_dir.mkdir(exist_ok=True)
+    params = {"only_on_market": bool(only_on_market) if src == "dsld" else None, "fields": FIELDS,
+              "dosage": dosage_path is not None, "code": _row_code_version()}  # a mapper change -> full rebuild
+    state = _load_state(state_json, frag_dir, params)
+    prev_files: Dict[str, Dict[str, Any]] = state["files"] if state else {}
+
+    files = list(_iter_json_files(in_dir))
+    cur: Dict[str, Dict[str, Any]] = {fp.as_posix(): _fingerprint(fp, prev_files.get(fp.as_posix())) for fp in files}
+    for k, fpr in cur.items():
+        fpr["fragment"] = _fragment_name(k, fpr["sha256"])
+    changed = [fp for fp in files if fp.as_posix() not in prev_files
+               or prev_files[fp.as_posix()]["fragment"] != cur[fp.as_posix()]["fragment"]]
+    deleted = [k for k in prev_files if k not in cur]
+
+    if cache is not None:
+        cache.index(files)  # all of them, so that prune keeps the entries of unchanged files
+    new_stats: Dict[str, Dict[str, int]] = {}
+    args = [(fp, frag_dir / cur[fp.as_posix()]["fragment"]) for fp in changed]
+    if workers > 1 and len(changed) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futs = [(fp, ex.submit(_ingest_fragment, src, fp, only_on_market, batch_size, frag, fast,
+                                   params["dosage"], cache)) for fp, frag in args]
+            for fp, fut in futs:
+                new_stats[fp.as_posix()] = fut.result()
+    else:
+        for fp, frag in args:
+            new_stats[fp.as_posix()] = _ingest_fragment(src, fp, only_on_market, batch_size, frag, fast,
+                                                        params["dosage"], cache)
+
+    for k, fpr in cur.items():
+        fpr["stats"] = new_stats[k] if k in new_stats else prev_files[k]["stats"]
+    stats = _new_stats()
+    for fpr in cur.values():
+        _add_stats(stats, fpr["stats"])
+    stats.update({"incremental_files_parsed": len(changed), "incremental_files_deleted": len(deleted)})
+
+    tmp_json = state_json.with_suffix(".json.tmp")
+    tmp_json.write_text(json.dumps({"version": STATE_VERSION, "src": src, "params": params, "files": cur}),
+                        encoding="utf-8")
+    os.replace(tmp_json, state_json)
+    live = set()
+    for fpr in cur.values():
+        live |= {fpr["fragment"], _dosage_fragment(Path(fpr["fragment"])).name}
+    for p in frag_dir.iterdir():
+        if p.name not in live:
+            p.unlink()
+
+    w = _output_writer(out_path, batch_size, version, partition_by, row_group_size)
+    dw = _dosage_writer(dosage_path, units_path)
+    for fpr in cur.values():
+        frag = frag_dir / fpr["fragment"]
+        for rb in pq.ParquetFile(frag).iter_batches(batch_size=batch_size):
+            w.write(rb)
+        if dw is not None:
+            dw.write(pq.read_table(_dosage_fragment(frag)))
+    w.close()
+    if dw is not None:
+        dw.close()
+    if cache is not None:
+        cache.prune()
+    return stats
+
+def ingest_dir_to_parquet(src: str, in_dir: Path, out_path: Path, batch_size: int = 2000, only_on_market: bool = True,
+                          workers: int = 1, stats_path: Optional[Path] = None,
+                          incremental: bool = False, state_dir: Optional[Path] = None,
+                          schema_version: int = CURRENT_VERSION, fast: bool = False,
+                          partition_by: Optional[List[str]] = None,
+                          row_group_size: int = DEFAULT_ROW_GROUP_SIZE, dosage_path: Optional[Path] = None,
+                          units_path: Optional[Path] = None, record_cache: Optional[Path] = None) -> Dict[str, int]:
+    """Ingest into ``out_path``: one Parquet file, or a dataset directory when ``partition_by`` is given.
+
+    ``dosage_path`` (DSLD only) also writes the per-ingredient dosage table, mg via ``units_path``.
+    ``record_cache`` is the record cache root directory (see src.preprocess.record_cache).
+    """
+    _check_dosage(src, dosage_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    cache = RecordCache(record_cache, src) if record_cache else None
+
+    if incremental:
+        stats = _ingest_incremental(src, in_dir, out_path, batch_size, only_on_market, workers,
+                                    state_dir or out_path.parent / ".ingest_state", schema_version, fast,
+                                    partition_by, row_group_size, dosage_path, units_path, cache)
+    else:
+        w = _output_writer(out_path, batch_size, schema_version, partition_by, row_group_size)
+        dw = _dosage_writer(dosage_path, units_path)
+        stats = _new_stats()
+        for fstats in _ingest_files(src, _iter_json_files(in_dir), w, only_on_market, batch_size,
+                                    workers, out_path.parent, fast, dw, cache).values():
+            _add_stats(stats, fstats)
+        w.close()
+        if dw is not None:
+            dw.close()
+        if cache is not None:
+            cache.prune()
+
+    _write_stats(src, stats, stats_path)
+    return stats
+
+def ingest_dir_to_table(src: str, in_dir: Path, batch_size: int = 2000, only_on_market: bool = True,
+                        workers: int = 1, stats_path: Optional[Path] = None,
+                        schema_version: int = CURRENT_VERSION, fast: bool = False,
+                        dosage_path: Optional[Path] = None, units_path: Optional[Path] = None,
+                        record_cache: Optional[Path] = None) -> Tuple[pa.Table, Dict[str, int]]:
+    """Non-incremental ingestion into memory; rows and row grouping match ingest_dir_to_parquet.
+
+    The dosage table (``dosage_path``) and the record cache are still written to disk.
+    """
+    _check_dosage(src, dosage_path)
+    w = _TableCollector(batch_size, schema_version)
+    dw = _dosage_writer(dosage_path, units_path)
+    cache = RecordCache(record_cache, src) if record_cache else None
+    stats = _new_stats()
+    for fstats in _ingest_files(src, _iter_json_files(in_dir), w, only_on_market, batch_size,
+                                workers, None, fast, dw, cache).values():
+        _add_stats(stats, fstats)
+    w.close()
+    if dw is not None:
+        dw.close()
+    if cache is not None:
+        cache.prune()
+    _write_stats(src, stats, stats_path)
+    return w.table(), stats
+
+def _check_dosage(src: str, dosage_path: Optional[Path]) -> None:
+    if dosage_path is not None and src != "dsld":
+        raise ValueError("dosage rows come from DSLD ingredientRows; --dosage_out needs --src dsld")
+
+def _dosage_writer(dosage_path: Optional[Path], units_path: Optional[Path]) -> Optional[DosageWriter]:
+    if dosage_path is None:
+        return None
+    dosage_path.parent.mkdir(parents=True, exist_ok=True)
+    return DosageWriter(dosage_path, load_units(units_path))
 
+def _write_stats(src: str, stats: Dict[str, int], stats_path: Optional[Path]) -> None:
     # write simple stats to provenance
-    prov = Path("provenance") / f"ingest_stats_{src}.json"
+    prov = stats_path or Path("provenance") / f"ingest_stats_{src}.json"
     try:
         prov.parent.mkdir(parents=True, exist_ok=True)
         prov.write_text(json.dumps(stats, indent=2), encoding="utf-8")
@@ -328,15 +899,45 @@ def main():
     ap.add_argument("--out", dest="out_path", type=Path, required=True)
     ap.add_argument("--batch_size", type=int, default=2000)
     ap.add_argument("--only_on_market", action="store_true")
+    ap.add_argument("--workers", type=int, default=1, help="process pool size; 1 = serial")
+    ap.add_argument("--incremental", action="store_true", help="re-parse only new/changed files (see --state_dir)")
+    ap.add_argument("--state_dir", type=Path, default=None, help="incremental store + state (default: <out dir>/.ingest_state)")
+    ap.add_argument("--schema_version", type=int, choices=[1, 2], default=CURRENT_VERSION,
+                    help="2 = typed/dictionary-encoded columns (default), 1 = legacy all-string")
+    ap.add_argument("--fast", action="store_true",
+                    help="one-shot JSON parse (orjson if installed) + tuple extractors; same output")
+    ap.add_argument("--dosage_out", type=Path, default=None,
+                    help="DSLD: per-ingredient dosage Parquet (amount, unit, mg, depth) from the same pass")
+    ap.add_argument("--units", type=Path, default=Path("rules/units.csv"), help="unit -> mg factors for --dosage_out")
+    ap.add_argument("--record_cache", type=Path, default=None,
+                    help="parsed-record cache root (per source, keyed by raw file sha256); remaps skip the JSON parse")
+    add_partition_args(ap)
+    instrument.add_profile_arg(ap)
     args = ap.parse_args()
-
-    ingest_dir_to_parquet(
-        src=args.src,
-        in_dir=args.in_dir,
-        out_path=args.out_path,
-        batch_size=args.batch_size,
-        only_on_market=args.only_on_market
-    )
+    if args.dosage_out is not None and args.src != "dsld":
+        ap.error("--dosage_out needs --src dsld")
+    instrument.configure(args.profile)
+
+    with instrument.stage(f"aggregate_{args.src}", inputs=[args.in_dir], outputs=[args.out_path]) as rec:
+        stats = ingest_dir_to_parquet(
+            src=args.src,
+            in_dir=args.in_dir,
+            out_path=args.out_path,
+            batch_size=args.batch_size,
+            only_on_market=args.only_on_market,
+            workers=args.workers,
+            incremental=args.incremental,
+            state_dir=args.state_dir,
+            schema_version=args.schema_version,
+            fast=args.fast,
+            partition_by=args.partition_by,
+            row_group_size=args.row_group_size,
+            dosage_path=args.dosage_out,
+            units_path=args.units,
+            record_cache=args.record_cache,
+        )
+        rec.rows_out = stats["records_emitted"]
+        rec.extra["files"] = stats["files_seen"]
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,129 @@
+"""
+Ingredient-name and unit canonicalization shared by harmonize, the ingredient
+index and the UC views.
+
+- synonyms: rules/synonyms.csv (ingredient,alias) compiled into a dict keyed on
+  the normalized alias / canonical name
+- units:    rules/units.csv (unit,canonical,quantity_type,to_mg,notes) compiled
+  into a dict keyed on the normalized unit label, with fallbacks for DSLD-style
+  labels such as "Vegetarian Capsule(s)" or "Gram(s)"
+
+All lookups are pure functions of one string, so callers memoize them per
+distinct value.
+"""
+from __future__ import annotations
+import csv, re
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+_WS_RUN = re.compile(r"\s+")
+_PLURAL = re.compile(r"\((?:s|es|ies)\)$")
+
+# ---------------- synonyms ----------------
+def load_synonym_pairs(p: Optional[Path]) -> List[Tuple[str, str]]:
+    pairs: List[Tuple[str, str]] = []
+    if p is None or not Path(p).exists():
+        return pairs
+    with open(p, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            ing, alias = (row.get("ingredient") or "").strip(), (row.get("alias") or "").strip()
+            if ing and alias:
+                pairs.append((ing, alias))
+    return pairs
+
+def load_synonyms(p: Optional[Path]) -> Dict[str, List[str]]:
+    """rules/synonyms.csv -> {canonical ingredient (lower-cased): [alias, ...]}."""
+    syn: Dict[str, List[str]] = {}
+    for ing, alias in load_synonym_pairs(p):
+        syn.setdefault(ing.lower(), []).append(alias)
+    return syn
+
+def normalize_item(s: str) -> str:
+    return _WS_RUN.sub(" ", s.strip().lower()).strip(" .")
+
+def alias_map(synonyms: Dict[str, List[str]]) -> Dict[str, str]:
+    """{alias or canonical (normalized): canonical (normalized)}."""
+    amap = {}
+    for canon, aliases in synonyms.items():
+        c = normalize_item(canon)
+        amap[c] = c
+        for al in aliases:
+            amap.setdefault(normalize_item(al), c)
+    return amap
+
+def display_alias_map(pairs: List[Tuple[str, str]]) -> Dict[str, str]:
+    """{alias or canonical (normalized): canonical as spelled in synonyms.csv}."""
+    amap: Dict[str, str] = {}
+    for ing, alias in pairs:
+        amap.setdefault(normalize_item(ing), ing)
+        amap.setdefault(normalize_item(alias), ing)
+    return amap
+
+def split_items(text: str) -> List[str]:
+    """Split a joined ingredient string on , and ; outside parentheses/brackets."""
+    items, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch in "([{":
+            depth += 1
+        elif ch in ")]}":
+            depth = max(0, depth - 1)
+        elif ch in ",;" and depth == 0:
+            items.append(text[start:i])
+            start = i + 1
+    items.append(text[start:])
+    return [it for it in (x.strip() for x in items) if it]
+
+def canonical_items(text: str, amap: Dict[str, str]) -> List[str]:
+    out = []
+    for it in split_items(text):
+        n = normalize_item(it)
+        if n:
+            out.append(amap.get(n, n))
+    return out
+
+def canonical_ingredient(item: str, amap: Dict[str, str]) -> Optional[str]:
+    """One list item -> canonical name, keeping the label's spelling when unmapped (None if blank)."""
+    n = normalize_item(item)
+    return (amap.get(n) or _WS_RUN.sub(" ", item).strip(" .")) if n else None
+
+def canonical_ingredients(text: str, amap: Dict[str, str]) -> List[str]:
+    """Like ``canonical_items`` but keeps the label's spelling for unmapped items."""
+    return [c for c in (canonical_ingredient(it, amap) for it in split_items(text)) if c]
+
+# ---------------- units ----------------
+class UnitInfo(NamedTuple):
+    canonical: str
+    quantity_type: str
+    to_mg: Optional[float]
+
+def _unit_key(s: str) -> str:
+    return _WS_RUN.sub(" ", s.strip().lower())
+
+def load_units(p: Optional[Path]) -> Dict[str, UnitInfo]:
+    units: Dict[str, UnitInfo] = {}
+    if p is None or not Path(p).exists():
+        return units
+    with open(p, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            u = (row.get("unit") or "").strip()
+            if not u:
+                continue
+            to_mg = (row.get("to_mg") or "").strip()
+            units[_unit_key(u)] = UnitInfo((row.get("canonical") or u).strip(),
+                                           (row.get("quantity_type") or "").strip(),
+                                           float(to_mg) if to_mg else None)
+    return units
+
+def resolve_unit(label: str, units: Dict[str, UnitInfo]) -> Optional[UnitInfo]:
+    """Exact label, then without a plural suffix ("Gram(s)" -> "gram", "Tablets" -> "tablet"),
+    then the last word ("Vegetarian Capsule(s)" -> "capsule(s)")."""
+    k = _unit_key(label)
+    if not k:
+        return None
+    for cand in (k, _PLURAL.sub("", k), k[:-1] if k.endswith("s") else k):
+        if cand in units:
+            return units[cand]
+        if cand + "(s)" in units:
+            return units[cand + "(s)"]
+    last = k.rsplit(" ", 1)[-1]
+    return resolve_unit(last, units) if last != k else None
@@ -0,0 +1,153 @@
+"""
+Per-ingredient dosage rows from DSLD `ingredientRows`, one row per (product, ingredient).
+
+`map_dsld` keeps only the ingredient names; this long table keeps what the
+label declares for each row, walking `nestedRows` depth-first:
+
+  source_record_id   joins to the product row (same value as in dsld.parquet)
+  source_path        raw file the record came from
+  position           0-based row order within the product
+  depth              0 for ingredientRows, 1 for their nestedRows, ...
+  ingredient         label name
+  ingredient_group   DSLD ingredientGroup
+  dosage_value       quantity per serving as labelled (null when DSLD says "NP")
+  dosage_unit        unit as labelled ("mg", "mcg", "IU", "Gram(s)", "NP", ...)
+  dosage_mg          dosage_value in mg for mass units (rules/units.csv), else null
+  dose_count_unit    the serving the amount is per ("Capsule(s)", ...)
+
+aggregate_dir builds these rows in its ingest pass, from the same parsed
+record as the product row (`--dosage_out`, DSLD only). `DosageWriter` writes
+them in fixed-size row groups, encoded per row group, so the serial, parallel
+and fast paths produce identical files. Dose questions become column
+filters, for example K2 >= 100 mcg:
+
+  pq.read_table("data/interim/dsld_dosage.parquet",
+                filters=[("ingredient_group", "=", "Vitamin K"), ("dosage_mg", ">=", 0.1)])
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.preprocess.canonical import UnitInfo, resolve_unit
+
+_DICT = pa.dictionary(pa.int32(), pa.string())
+DOSAGE_SCHEMA = pa.schema([
+    ("source_record_id", pa.large_string()),
+    ("source_path", pa.large_string()),
+    ("position", pa.int32()),
+    ("depth", pa.int8()),
+    ("ingredient", pa.large_string()),
+    ("ingredient_group", _DICT),
+    ("dosage_value", pa.float64()),
+    ("dosage_unit", _DICT),
+    ("dosage_mg", pa.float64()),
+    ("dose_count_unit", _DICT),
+])
+# rows are collected with plain (non-dictionary) columns and no dosage_mg; DosageWriter encodes
+# and derives dosage_mg per row group, after slicing, so batch boundaries never show in the file
+ROW_SCHEMA = pa.schema([(f.name, pa.string() if pa.types.is_dictionary(f.type) else f.type)
+                        for f in DOSAGE_SCHEMA if f.name != "dosage_mg"])
+_NOT_PRESENT = "NP"
+
+def _amount(v: Any) -> Optional[float]:
+    if isinstance(v, bool) or v is None:
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+def _first_quantity(row: Dict[str, Any]) -> Dict[str, Any]:
+    q = row.get("quantity")
+    if isinstance(q, list):
+        q = q[0] if q else None
+    return q if isinstance(q, dict) else {}
+
+def dsld_dosage_rows(obj: Dict[str, Any], record_id: Optional[str], path: str) -> List[tuple]:
+    """Dosage row tuples (DOSAGE_SCHEMA order without dosage_mg) for one DSLD record."""
+    rows: List[tuple] = []
+
+    def walk(items, depth: int) -> None:
+        if not isinstance(items, list):
+            return
+        for row in items:
+            if not isinstance(row, dict):
+                continue
+            name = row.get("name")
+            if name:
+                q = _first_quantity(row)
+                unit = q.get("unit")
+                unit = str(unit) if unit else None
+                amount = None if unit == _NOT_PRESENT else _amount(q.get("quantity"))
+                group = row.get("ingredientGroup")
+                count_unit = q.get("servingSizeUnit")
+                rows.append((record_id, path, len(rows), depth, str(name), str(group) if group else None,
+                             amount, unit, str(count_unit) if count_unit else None))
+            walk(row.get("nestedRows"), depth + 1)
+
+    walk(obj.get("ingredientRows"), 0)
+    return rows
+
+def rows_to_batch(rows: List[tuple]) -> pa.RecordBatch:
+    """Row tuples -> a ROW_SCHEMA batch (what worker shards spill and DosageWriter.write takes)."""
+    cols = list(zip(*rows)) if rows else [()] * len(ROW_SCHEMA)
+    return pa.RecordBatch.from_arrays([pa.array(c, f.type) for c, f in zip(cols, ROW_SCHEMA)], schema=ROW_SCHEMA)
+
+class DosageWriter:
+    """ROW_SCHEMA batches -> DOSAGE_SCHEMA Parquet in ``row_group_size`` row groups, however they are sliced."""
+    def __init__(self, out_path: Path, units: Dict[str, UnitInfo], row_group_size: int = 65536):
+        self.out_path, self.units, self.row_group_size = out_path, units, row_group_size
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.pending: List[pa.RecordBatch] = []
+        self.n_pending = 0
+        self._factor: Dict[Optional[str], Optional[float]] = {}
+
+    def _mg_factor(self, unit: Optional[str]) -> Optional[float]:
+        f = self._factor.get(unit, self)
+        if f is self:
+            info = resolve_unit(unit, self.units) if unit else None
+            f = self._factor[unit] = info.to_mg if info and info.quantity_type == "mass" else None
+        return f
+
+    def _typed(self, table: pa.Table) -> pa.Table:
+        cols = {name: table.column(name).combine_chunks() for name in ROW_SCHEMA.names}
+        for f in DOSAGE_SCHEMA:
+            if pa.types.is_dictionary(f.type):
+                cols[f.name] = pc.dictionary_encode(cols[f.name])
+        unit = cols["dosage_unit"]
+        factors = pa.array([self._mg_factor(u) for u in unit.dictionary.to_pylist()], pa.float64())
+        cols["dosage_mg"] = pc.multiply(cols["dosage_value"], factors.take(unit.indices))
+        return pa.Table.from_arrays([cols[f.name] for f in DOSAGE_SCHEMA], schema=DOSAGE_SCHEMA)
+
+    def _flush(self, table: pa.Table) -> None:
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.out_path, DOSAGE_SCHEMA, compression="snappy")
+        self.writer.write_table(self._typed(table), row_group_size=self.row_group_size)
+
+    def add_rows(self, rows: List[tuple]) -> None:
+        if rows:
+            self.write(rows_to_batch(rows))
+
+    def write(self, data) -> None:
+        if data.num_rows == 0:
+            return
+        self.pending.extend(data.to_batches() if isinstance(data, pa.Table) else [data])
+        self.n_pending += data.num_rows
+        while self.n_pending >= self.row_group_size:
+            tbl = pa.Table.from_batches(self.pending, schema=ROW_SCHEMA)
+            self._flush(tbl.slice(0, self.row_group_size))
+            rest = tbl.slice(self.row_group_size)
+            self.pending, self.n_pending = rest.to_batches(), rest.num_rows
+
+    def close(self) -> None:
+        if self.n_pending:
+            self._flush(pa.Table.from_batches(self.pending, schema=ROW_SCHEMA))
+        self.pending, self.n_pending = [], 0
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            pq.write_table(DOSAGE_SCHEMA.empty_table(), self.out_path, compression="snappy")
@@ -0,0 +1,265 @@
+"""
+Fast ingestion path for aggregate_dir (--fast / params.fast_ingest).
+
+The default path streams each file through JSONDecoder.raw_decode. It then
+builds one dict per record in the mapper and a second, string-coerced dict
+in `_iter_file_rows`, and finally calls `pa.Table.from_pylist` on the row
+dicts. The fast path:
+
+- parses a whole file in one call with orjson when it is installed (stdlib
+  json otherwise): a top-level array, a single object, or NDJSON line by
+  line
+- extracts each source's fields with a per-source extractor that returns a
+  tuple in ROW_SCHEMA order (FIELDS, then the list items): no row dicts,
+  constants bound once per file
+- transposes the tuples into columns per batch and builds each Arrow array
+  once
+
+Output is identical to the mappers. Files the one-shot parse cannot take as
+is go through the streaming reader unchanged; that covers malformed JSON,
+NaN/Infinity, a BOM, non-UTF-8 text, files over _MAX_RECORD_CHARS, and
+integers past 64 bits (orjson would turn those into floats). The mapper
+functions stay the reference; `scripts.bench_ingest_fast` checks both paths
+against each other and reports records/sec per mapper.
+"""
+from __future__ import annotations
+import gzip, json
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import pyarrow as pa
+
+from src.preprocess.aggregate_dir import MALFORMED, SCHEMA, _MAX_RECORD_CHARS, _iter_records_from_file, _to_str
+from src.preprocess.dosage import dsld_dosage_rows
+from src.utils.schema import FIELDS
+
+try:
+    import orjson
+    _loads = orjson.loads
+    HAVE_ORJSON = True
+except ImportError:  # optional dependency: `uv sync --extra fast`
+    HAVE_ORJSON = False
+
+    def _loads(data: bytes):
+        return json.loads(data.decode("utf-8"))
+
+# 20+ digit runs (wider than uint64): orjson yields a float where json yields an int.
+# translate + substring search is ~10x faster than re.search(rb"\d{20}")
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+_WIDE_INT = b"0" * 20
+_BOM = b"\xef\xbb\xbf"
+
+def _read_bytes(path: Path) -> Optional[bytes]:
+    """File contents (decompressed), or None when larger than the streaming reader's record cap."""
+    opener = gzip.open if str(path).lower().endswith((".gz",)) else open
+    with opener(path, "rb") as f:
+        data = f.read(_MAX_RECORD_CHARS + 1)
+    return None if len(data) > _MAX_RECORD_CHARS else data
+
+def _parse_whole(data: bytes) -> Optional[List[Any]]:
+    """Top-level values of a file as the streaming reader would see them, or None to defer to it."""
+    if data.startswith(_BOM) or (HAVE_ORJSON and _WIDE_INT in data.translate(_DIGITS_TO_ZERO)):
+        return None
+    # orjson errors carry the whole document, so pick the layout first instead of trying both
+    if data.lstrip()[:1] == b"[":
+        try:
+            return _loads(data)
+        except ValueError:
+            return None
+    # NDJSON: every non-blank line holds exactly one value; else a single (pretty-printed) value
+    try:
+        return [_loads(ln) for ln in data.split(b"\n") if ln.strip()]
+    except ValueError:
+        pass
+    try:
+        return [_loads(data)]
+    except ValueError:
+        return None
+
+def iter_records(path: Path) -> Iterable[Optional[Dict[str, Any]]]:
+    """Same records (and MALFORMED markers) as aggregate_dir._iter_records_from_file."""
+    try:
+        data = _read_bytes(path)
+    except Exception:
+        data = None
+    values = _parse_whole(data) if data is not None else None
+    if values is None:
+        yield from _iter_records_from_file(path)
+        return
+    for v in values:
+        if isinstance(v, dict):
+            yield v
+
+# ---------------- extractors ----------------
+# Each mirrors its mapper in aggregate_dir statement for statement (the same
+# lookups in the same order, so odd records fail the same way) and returns the
+# uncoerced values in FIELDS order followed by the list items in ITEMS order
+# (ingredients, other_ingredients, claims), or None where the mapper returns None.
+_ON_MARKET_OFF = (1, True, "1", "true")
+
+def _extract_dsld(obj: Dict[str, Any], path: str, only_on_market: bool):
+    get = obj.get
+    off_market = get("offMarket")
+    if only_on_market and off_market in _ON_MARKET_OFF:
+        return None
+
+    ing_names: List[str] = []
+    for row in get("ingredientRows", []) or []:
+        row = row or {}
+        nm = row.get("name")
+        if nm: ing_names.append(str(nm))
+        for nested in row.get("nestedRows", []) or []:
+            nname = (nested or {}).get("name")
+            if nname: ing_names.append(str(nname))
+
+    other_ings: List[str] = []
+    for it in (get("otheringredients") or {}).get("ingredients") or []:
+        nm = (it or {}).get("name")
+        if nm: other_ings.append(str(nm))
+
+    serving_size = serving_unit = None
+    sv = get("servingSizes") or []
+    if sv:
+        s0 = sv[0] or {}
+        serving_size = s0.get("minQuantity") or s0.get("quantity")
+        serving_unit = s0.get("unit")
+
+    net_qty = net_unit = None
+    nc = get("netContents") or []
+    if nc:
+        n0 = nc[0] or {}
+        net_qty = n0.get("quantity")
+        net_unit = n0.get("unit")
+
+    claims = []
+    for c in get("claims") or []:
+        if (c or {}).get("langualCodeDescription"):
+            claims.append((c or {}).get("langualCodeDescription", ""))
+    statements = []
+    for s in get("statements") or []:
+        if (s or {}).get("notes"):
+            statements.append((s or {}).get("notes", ""))
+
+    return (
+        "DSLD", path, get("upcSku") or get("dsldId") or "",
+        get("fullName") or "", get("brandName") or "", get("manufacturerName") or "", "",
+        0 if off_market in _ON_MARKET_OFF else 1,
+        get("entryDate") or "", (get("physicalState") or {}).get("langualCodeDescription") or "",
+        serving_size, serving_unit, net_qty, net_unit,
+        ", ".join(ing_names) if ing_names else "",
+        ", ".join(other_ings) if other_ings else "",
+        "; ".join(claims) or "", "; ".join(statements) or "",
+        ing_names, other_ings, claims,
+    )
+
+def _extract_amazon(obj: Dict[str, Any], path: str, only_on_market: bool):
+    get = obj.get
+    asin = get("asin") or get("ASIN") or get("id") or ""
+    product_name = get("product_name") or get("title") or get("name") or ""
+    brand = get("brand") or get("byline") or get("brand_name") or ""
+    link = get("product_url") or get("url") or get("link") or get("page_url") or ""
+    ingredients = get("ingredients") or get("ingredient_text") or ""
+
+    serving_size = serving_unit = None
+    uc = get("unit_count") or get("count") or ""
+    if isinstance(uc, str) and uc.strip():
+        parts = uc.replace(",", " ").split()
+        try:
+            serving_size = float(parts[0])
+        except Exception:
+            serving_size = None
+        serving_unit = " ".join(parts[1:]) if len(parts) > 1 else "count"
+
+    about = get("about_this_item")
+    claims = "; ".join(about or []) if isinstance(about, list) else (about or "")
+
+    company = get("company_name") or get("manufacturer") or get("seller") or get("vendor") or ""
+    entry_date = get("updated_at") or get("crawl_ts") or get("timestamp") or get("date") or ""
+    form = get("item_form") or get("form") or ""
+    net_quantity = get("size") or get("unit_price") or ""
+    net_unit = get("count_unit") or ""
+    other = get("other_ingredients") or ""
+    statements = get("warnings") or ""
+    if not any([product_name, ingredients, asin]):
+        return None
+    return ("Amazon", path, asin, product_name, brand, company, link, 1, entry_date, form,
+            serving_size, serving_unit, net_quantity, net_unit, ingredients, other, claims, statements,
+            None, None, about if isinstance(about, list) else None)
+
+def _extract_knowde(obj: Dict[str, Any], path: str, only_on_market: bool):
+    get = obj.get
+    details = get("product_details") or get("details") or {}
+    rid = get("slug") or get("id") or ""
+    name = get("product_name") or get("title") or get("name") or ""
+    brand = get("brand") or get("brand_name") or ""
+    company = get("company_name") or get("supplier") or ""
+    link = get("link") or get("url") or get("page_url") or ""
+    entry_date = get("crawl_ts") or get("timestamp") or get("date") or ""
+    form = get("form") or ""
+    dget = details.get
+    ingredients = dget("Ingredient Name") or dget("Ingredient") or dget("Ingredients") or ""
+    claims = dget("Function") or ""
+    statements = dget("Certifications & Compliance") or dget("Certifications") or ""
+    if not any([name, ingredients, rid]):
+        return None
+    return ("Knowde", path, rid, name, brand, company, link, 1, entry_date, form,
+            None, None, None, None, ingredients, "", claims, statements, None, None, None)
+
+def _extract_internal(obj: Dict[str, Any], path: str, only_on_market: bool):
+    get = obj.get
+    ings = get("ingredients") or []
+    items = ings if isinstance(ings, list) else None
+    if isinstance(ings, list):
+        ings = ", ".join(ings)
+    rid = get("id") or get("slug") or ""
+    name = get("product_name") or get("title") or get("name") or ""
+    brand = get("brand") or ""
+    company = get("company_name") or get("domain") or ""
+    link = get("product_link") or get("url") or ""
+    entry_date = get("crawl_ts") or get("timestamp") or get("date") or ""
+    form = get("form") or get("product_type") or ""
+    claims = get("claims") or ""
+    if not any([name, ings or "", link]):
+        return None
+    return ("Internal", path, rid, name, brand, company, link, 1, entry_date, form,
+            None, None, None, None, ings or "", "", claims, "", items, None, None)
+
+EXTRACTORS: Dict[str, Callable] = {"dsld": _extract_dsld, "amazon": _extract_amazon,
+                                   "knowde": _extract_knowde, "internal": _extract_internal}
+
+def iter_file_tuples(src: str, fp: Path, only_on_market: bool, stats: Dict[str, int],
+                     dosage: Optional[list] = None, cache=None) -> Iterable[tuple]:
+    """`_iter_file_rows` without the row dicts: uncoerced tuples in ROW_SCHEMA order, same ``stats``, ``dosage``, ``cache``."""
+    extract = EXTRACTORS[src]
+    path = str(fp.as_posix())
+    on_market = only_on_market if src == "dsld" else False
+    stats["files_seen"] += 1
+    had_rec = False
+    try:
+        for obj in cache.records(fp, iter_records) if cache is not None else iter_records(fp):
+            if obj is MALFORMED:
+                stats["records_malformed"] += 1
+                continue
+            rec = extract(obj, path, on_market)
+            if rec:
+                stats["records_emitted"] += 1
+                had_rec = True
+                if dosage is not None:
+                    dosage.extend(dsld_dosage_rows(obj, _to_str(rec[2]), path))
+                yield rec
+        if had_rec:
+            stats["files_with_records"] += 1
+    except Exception:
+        stats["files_errors"] += 1
+
+def _column(values) -> pa.Array:
+    return pa.array([v if v is None or v.__class__ is str else _to_str(v) for v in values], pa.large_string())
+
+def _items(values) -> pa.Array:
+    return pa.array([v or None for v in values], pa.list_(pa.large_string()))
+
+def tuples_to_batch(rows: List[tuple]) -> pa.RecordBatch:
+    """ROW_SCHEMA batch, equal to RecordBatch.from_pylist of the coerced row dicts."""
+    cols = list(zip(*rows)) if rows else [()] * len(SCHEMA)
+    return pa.RecordBatch.from_arrays([_column(c) for c in cols[:len(FIELDS)]] +
+                                      [_items(c) for c in cols[len(FIELDS):]], schema=SCHEMA)
@@ -1,7 +1,177 @@
-import argparse
+"""
+Harmonize the four per-source Parquet files into one table.
+
+Record batches are streamed from each source (DSLD, Amazon, Knowde, Internal
+in that order) and written straight to the output, so memory stays flat as the
+sources grow. Per batch, each column to normalize is dictionary-encoded and
+the lookups run once per distinct value (memoized across the whole run), then
+are taken back out to rows with the dictionary indices.
+
+Inputs may be v1 (all-string) or v2 (typed) files; they are read through
+src.utils.schema so the output is always v2 plus the added columns:
+- ingredients_norm        ingredient list items resolved to canonical names (list<string>) by
+                          src.preprocess.ingredient_resolver: synonyms.csv + rules/ingredients.txt,
+                          qualifiers stripped, trigram/edit-distance fuzzy matching; unresolved
+                          items keep the label's spelling
+- serving_unit_canonical  canonical unit from rules/units.csv (label kept if unknown, null if missing)
+- serving_unit_type       mass / activity / count ("" if unknown)
+- serving_size_mg         serving_size converted to mg for mass units, else null
+- net_unit_canonical, net_unit_type, net_quantity_mg  same for the net contents
+
+With --partition_by the output is a hive-partitioned dataset directory
+(src.utils.dataset), e.g. by `source` and `entry_year`, in --row_group_size
+row groups; inputs may be files or dataset directories. With --unresolved the
+ingredient items that did not resolve are written as CSV (item, occurrences;
+most frequent first) for curation.
+
+`harmonize_tables` does the same for in-memory Arrow tables (src.pipeline).
+"""
+import argparse, csv
 from pathlib import Path
-import pyarrow.parquet as pq
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.preprocess.canonical import UnitInfo, load_units, resolve_unit
+from src.preprocess.ingredient_resolver import IngredientResolver
+from src.utils import instrument
+from src.utils.dataset import DEFAULT_ROW_GROUP_SIZE, PartitionedWriter, add_partition_args, remove
+from src.utils.schema import FIELDS_V2, SCHEMA_V2, iter_batches, schema_version, upgrade_batch
+
+_DICT = pa.dictionary(pa.int32(), pa.string())
+OUT_SCHEMA = SCHEMA_V2.append(pa.field("ingredients_norm", pa.list_(pa.large_string())))
+for _name, _type in (("serving_unit_canonical", _DICT), ("serving_unit_type", _DICT), ("serving_size_mg", pa.float64()),
+                     ("net_unit_canonical", _DICT), ("net_unit_type", _DICT), ("net_quantity_mg", pa.float64())):
+    OUT_SCHEMA = OUT_SCHEMA.append(pa.field(_name, _type))
+
+def _map_unique(col: pa.Array, fn: Callable, memo: Dict, type_=pa.large_string(),
+                counts: Optional[Dict] = None) -> pa.Array:
+    """Apply ``fn`` once per distinct value of ``col`` (memoized in ``memo``) and expand back to rows.
+
+    With ``counts``, the occurrences of each distinct value are added to it.
+    """
+    enc = col if pa.types.is_dictionary(col.type) else pc.dictionary_encode(col)
+    if isinstance(enc, pa.ChunkedArray):
+        enc = enc.combine_chunks()
+    values = enc.dictionary.to_pylist()
+    mapped = []
+    for v in values:
+        r = memo.get(v, memo)
+        if r is memo:
+            r = memo[v] = fn(v)
+        mapped.append(r)
+    if counts is not None:
+        idx = enc.indices.drop_null().to_numpy(zero_copy_only=False)
+        for v, n in zip(values, np.bincount(idx, minlength=len(values)).tolist()):
+            if n:
+                counts[v] = counts.get(v, 0) + n
+    return pa.array(mapped, type=type_).take(enc.indices)
+
+def _map_items(col: pa.ListArray, fn: Callable, memo: Dict, counts: Optional[Dict] = None) -> pa.ListArray:
+    """Map every list item through ``fn`` (memoized); items mapped to None are dropped, empty lists become null."""
+    mapped = _map_unique(col.values, fn, memo, counts=counts)
+    keep = mapped.is_valid().to_numpy(zero_copy_only=False)
+    kept = np.concatenate([[0], np.cumsum(keep, dtype=np.int64)])
+    offsets = kept[col.offsets.to_numpy()].astype(np.int32)
+    empty = np.diff(offsets) == 0
+    return pa.ListArray.from_arrays(pa.array(offsets), mapped.filter(pa.array(keep)),
+                                    type=pa.list_(pa.large_string()), mask=pa.array(empty))
+
+class Harmonizer:
+    def __init__(self, syn_path: Optional[Path], units_path: Optional[Path], vocab_path: Optional[Path] = None,
+                 track_unresolved: bool = False):
+        self.resolver = IngredientResolver.from_files(syn_path, vocab_path)
+        self.units = load_units(units_path)
+        self.item_counts: Optional[Dict[str, int]] = {} if track_unresolved else None
+        self._ing_memo: Dict = {}
+        self._canon_memo: Dict = {}
+        self._type_memo: Dict = {}
+        self._factor_memo: Dict = {}
+
+    def _unit(self, label: Optional[str]) -> Optional[UnitInfo]:
+        return resolve_unit(label, self.units) if label else None
+
+    def _ingredient(self, item: Optional[str]) -> Optional[str]:
+        return self.resolver.canonical(item) if item else None
+
+    def unresolved(self) -> List[tuple]:
+        """(item, occurrences) of the items that did not resolve, most frequent first."""
+        resolve = self.resolver.resolve
+        rows = [(item, n) for item, n in (self.item_counts or {}).items()
+                if self._ing_memo.get(item) is not None and resolve(item).canonical is None]
+        return sorted(rows, key=lambda r: (-r[1], r[0]))
+
+    def write_unresolved(self, out_csv: Path) -> None:
+        out_csv.parent.mkdir(parents=True, exist_ok=True)
+        with open(out_csv, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["item", "occurrences"])
+            w.writerows(self.unresolved())
+
+    def normalize(self, batch: pa.RecordBatch) -> pa.RecordBatch:
+        cols = {k: batch.column(k) for k in batch.schema.names}
+        cols["ingredients_norm"] = _map_items(cols["ingredients"], self._ingredient, self._ing_memo, self.item_counts)
+        for qty_col, unit_col, prefix, mg_col in (("serving_size", "serving_unit", "serving_unit", "serving_size_mg"),
+                                                 ("net_quantity", "net_unit", "net_unit", "net_quantity_mg")):
+            canon, qtype, factor = self._resolve_units(cols[unit_col])
+            cols[f"{prefix}_canonical"] = pc.dictionary_encode(canon.cast(pa.string()))
+            cols[f"{prefix}_type"] = pc.dictionary_encode(qtype.cast(pa.string()))
+            cols[mg_col] = pc.multiply(cols[qty_col], factor)
+        return pa.RecordBatch.from_arrays([cols[f.name] for f in OUT_SCHEMA], schema=OUT_SCHEMA)
+
+    def _resolve_units(self, unit: pa.Array):
+        def canon(u):
+            info = self._unit(u)
+            return info.canonical if info else (u or "")
+        def qtype(u):
+            info = self._unit(u)
+            return info.quantity_type if info else ""
+        def factor(u):
+            info = self._unit(u)
+            return info.to_mg if info and info.quantity_type == "mass" else None
+        return (_map_unique(unit, canon, self._canon_memo),
+                _map_unique(unit, qtype, self._type_memo),
+                _map_unique(unit, factor, self._factor_memo, type_=pa.float64()))
+
+def harmonize_tables(tables: List[pa.Table], syn_path: Optional[Path], units_path: Optional[Path],
+                     batch_size: int = 65536, vocab_path: Optional[Path] = None,
+                     unresolved_path: Optional[Path] = None) -> pa.Table:
+    h = Harmonizer(syn_path, units_path, vocab_path, track_unresolved=unresolved_path is not None)
+    out = []
+    for tbl in tables:
+        for rb in tbl.to_batches(max_chunksize=batch_size):
+            if schema_version(rb.schema) != 2:
+                rb = upgrade_batch(rb)
+            out.append(h.normalize(rb.select(FIELDS_V2)))
+    if unresolved_path is not None:
+        h.write_unresolved(unresolved_path)
+    return pa.Table.from_batches(out, schema=OUT_SCHEMA)
+
+def harmonize(inputs: List[str], out_path: Path, syn_path: Optional[Path], units_path: Optional[Path],
+              batch_size: int = 65536, partition_by: Optional[List[str]] = None,
+              row_group_size: int = DEFAULT_ROW_GROUP_SIZE, vocab_path: Optional[Path] = None,
+              unresolved_path: Optional[Path] = None) -> int:
+    h = Harmonizer(syn_path, units_path, vocab_path, track_unresolved=unresolved_path is not None)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    if partition_by:
+        writer = PartitionedWriter(out_path, OUT_SCHEMA, partition_by, row_group_size)
+    else:
+        remove(out_path)
+        writer = pq.ParquetWriter(out_path, OUT_SCHEMA, compression="snappy")
+    rows = 0
+    with writer as w:
+        for fp in inputs:
+            if not Path(fp).exists():
+                continue
+            for rb in iter_batches(fp, batch_size=batch_size, columns=FIELDS_V2):
+                w.write(h.normalize(rb))
+                rows += rb.num_rows
+    if unresolved_path is not None:
+        h.write_unresolved(unresolved_path)
+    return rows
 
 def main():
     ap = argparse.ArgumentParser()
@@ -11,22 +181,21 @@ def main():
     ap.add_argument("--internal", required=True)
     ap.add_argument("--syn", required=True)
     ap.add_argument("--units", required=True)
+    ap.add_argument("--vocab", default=None, help="rules/ingredients.txt: canonical ingredient names")
+    ap.add_argument("--unresolved", default=None, help="CSV of ingredient items that did not resolve")
     ap.add_argument("--out", required=True)
+    ap.add_argument("--batch_size", type=int, default=65536)
+    add_partition_args(ap)
+    instrument.add_profile_arg(ap)
     a = ap.parse_args()
+    instrument.configure(a.profile)
 
-    tables = []
-    for fp in [a.dsld, a.amazon, a.knowde, a.internal]:
-        if Path(fp).exists():
-            tables.append(pq.read_table(fp))
-    if tables:
-        out_tbl = pa.concat_tables(tables, promote=True)
-    else:
-        out_tbl = pa.table({k: [] for k in [
-            "source","source_path","source_record_id","product_name","brand","company_name","link","on_market","entry_date","form",
-            "serving_size","serving_unit","net_quantity","net_unit","ingredients","other_ingredients","claims","statements"
-        ]})
-    Path(a.out).parent.mkdir(parents=True, exist_ok=True)
-    pq.write_table(out_tbl, a.out, compression="snappy")
+    inputs = [a.dsld, a.amazon, a.knowde, a.internal]
+    with instrument.stage("harmonize", inputs=inputs, outputs=[a.out]) as rec:
+        rec.rows_in = rec.rows_out = harmonize(inputs, Path(a.out), Path(a.syn), Path(a.units), a.batch_size,
+                                              a.partition_by, a.row_group_size,
+                                              Path(a.vocab) if a.vocab else None,
+                                              Path(a.unresolved) if a.unresolved else None)
 
 if __name__ == "__main__":
     main()
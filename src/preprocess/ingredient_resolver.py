@@ -0,0 +1,232 @@
+"""
+Fuzzy ingredient-name canonicalization for harmonize.
+
+rules/synonyms.csv maps exact aliases only, while labels say "Vitamin D3 (as
+cholecalciferol)", "MK-7 (menaquinone-7)" or "Reishi mushroom extract
+(fruiting body)". `IngredientResolver` maps such an item to a canonical
+ingredient of a vocabulary: the canonical names and aliases of synonyms.csv
+plus rules/ingredients.txt (one canonical name per line).
+
+Per item:
+1. parenthetical / bracketed qualifiers are split off the head ("Vitamin D3"
+   + ["cholecalciferol"]; a leading "as", "from", "providing" ... is dropped)
+2. each part is keyed: accents, (R)/(TM) marks and punctuation dropped, hyphens
+   joined ("MK-7" -> "mk7"), doses such as "500 mg" or "10%" removed; a second
+   key also strips form qualifiers (extract, powder, organic, mushroom,
+   fruiting body, root, ...)
+3. exact lookup of the head's keys, then of each qualifier's
+4. fuzzy lookup of the same keys: candidates come from a trigram index over
+   the vocabulary keys (q-gram count filter), then a Levenshtein distance
+   bounded by 1 (keys under 10 characters) or 2 picks the closest. Digits must
+   agree, so "Vitamin D2" never becomes "Vitamin D3". Keys under 5 characters
+   are exact-only, and a tie between two ingredients stays unresolved
+5. token spans of each part, longest first ("zinc picolinate" -> "Zinc"),
+   exact then fuzzy
+
+Unresolved items keep the label's spelling; harmonize can write them with
+their occurrence counts (--unresolved) so they can be curated into
+ingredients.txt or synonyms.csv. Results are memoized per distinct raw string
+and per key, so the cost follows the number of distinct strings, not rows.
+
+  uv run python -m src.preprocess.ingredient_resolver --syn rules/synonyms.csv --vocab rules/ingredients.txt \
+      "Vitamin D3 (as cholecalciferol)" "Reishi mushroom extract (fruiting body)"
+"""
+from __future__ import annotations
+import argparse, re, sys, unicodedata
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from src.preprocess.canonical import load_synonym_pairs, normalize_item
+
+MIN_FUZZY_LEN = 5
+_PAD = "$$"
+
+_GROUP = re.compile(r"[(\[]([^()\[\]]*)[)\]]")
+_LEAD = re.compile(r"^\s*(?:as|from|providing|provides|source of|derived from|containing|contains|"
+                   r"supplying|std\.? to|standardi[sz]ed to(?: contain)?)\b[\s:]*", re.I)
+_MARKS = re.compile(r"\((?:r|tm|c)\)|[®™©*†‡]", re.I)
+_DOSE = re.compile(r"\b\d+(?:[.,]\d+)?\s*(?:%|mg\b|mcg\b|ug\b|g\b|iu\b|cfu\b|billion\b|million\b)")
+_JOIN = re.compile(r"(?<=[0-9a-z])['\-.](?=[0-9a-z])")
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+_FORMS = re.compile(r"\b(?:fruiting body|fruit body|aerial parts?|extracts?|powder(?:ed)?|concentrate|organic|"
+                    r"standardi[sz]ed|freeze dried|dried|raw|whole|natural|pure|isolate|roots?|leaf|leaves|"
+                    r"seeds?|bark|rhizome|herb|mushrooms?|mycelium|mycelia|granules)\b")
+_WS_RUN = re.compile(r"\s+")
+
+class Resolution(NamedTuple):
+    canonical: Optional[str]
+    method: str  # exact / fuzzy / span / unresolved
+
+UNRESOLVED = Resolution(None, "unresolved")
+
+def ingredient_key(text: str) -> str:
+    """Match key: ascii lower-case words, punctuation and doses dropped, "MK-7" -> "mk7"."""
+    s = unicodedata.normalize("NFKD", _MARKS.sub(" ", text)).encode("ascii", "ignore").decode("ascii").lower()
+    s = _JOIN.sub("", _DOSE.sub(" ", s))
+    return _NON_WORD.sub(" ", s).strip()
+
+def strip_forms(key: str) -> str:
+    """``key`` without form qualifiers (extract, powder, root, ...); ``key`` itself if nothing is left."""
+    stripped = _WS_RUN.sub(" ", _FORMS.sub(" ", key)).strip()
+    return stripped or key
+
+def split_qualifiers(item: str) -> Tuple[str, List[str]]:
+    """"Vitamin D3 (as cholecalciferol)" -> ("Vitamin D3", ["cholecalciferol"]); nested groups innermost first."""
+    quals: List[str] = []
+    head = item
+    while True:
+        found = _GROUP.findall(head)
+        if not found:
+            break
+        for q in found:
+            for part in re.split(r"[,;]", q):
+                part = _LEAD.sub("", part).strip()
+                if part:
+                    quals.append(part)
+        head = _GROUP.sub(" ", head)
+    return head.replace("(", " ").replace(")", " ").strip(), quals
+
+def _trigrams(key: str) -> set:
+    s = f"{_PAD}{key}$"
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+def _digits(key: str) -> str:
+    return "".join(ch for ch in key if ch.isdigit())
+
+def bounded_levenshtein(a: str, b: str, bound: int) -> Optional[int]:
+    """Edit distance of ``a`` and ``b`` if it is at most ``bound``, else None."""
+    if abs(len(a) - len(b)) > bound:
+        return None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        lo = bound + 1
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if cur[j] < lo:
+                lo = cur[j]
+        if min(lo, cur[0]) > bound:
+            return None
+        prev = cur
+    return prev[-1] if prev[-1] <= bound else None
+
+def load_vocabulary(p: Optional[Path]) -> List[str]:
+    """rules/ingredients.txt: one canonical ingredient per line, # comments."""
+    if p is None or not Path(p).exists():
+        return []
+    lines = (ln.strip() for ln in Path(p).read_text(encoding="utf-8").splitlines())
+    return [ln for ln in lines if ln and not ln.startswith("#")]
+
+class IngredientResolver:
+    """Raw ingredient item -> `Resolution`; see the module docstring."""
+
+    def __init__(self, pairs: Sequence[Tuple[str, str]] = (), vocabulary: Iterable[str] = ()):
+        self.exact: Dict[str, str] = {}
+        # canonical spellings first so a canonical's own keys never point at another entry
+        names = [(ing, ing) for ing, _ in pairs] + [(v, v) for v in vocabulary] + [(al, ing) for ing, al in pairs]
+        for name, canon in names:
+            key = ingredient_key(name)
+            if key:
+                self.exact.setdefault(key, canon)
+                self.exact.setdefault(strip_forms(key), canon)
+        self.keys = list(self.exact)
+        self.key_digits = [_digits(k) for k in self.keys]
+        self.postings: Dict[str, List[int]] = {}
+        for kid, key in enumerate(self.keys):
+            for g in _trigrams(key):
+                self.postings.setdefault(g, []).append(kid)
+        self.max_span = max((k.count(" ") + 1 for k in self.keys), default=1)
+        self._memo: Dict[str, Resolution] = {}
+        self._fuzzy_memo: Dict[str, Optional[str]] = {}
+
+    @classmethod
+    def from_files(cls, syn_path: Optional[Path], vocab_path: Optional[Path] = None) -> "IngredientResolver":
+        return cls(load_synonym_pairs(syn_path), load_vocabulary(vocab_path))
+
+    def fuzzy(self, key: str) -> Optional[str]:
+        """Closest vocabulary entry within the edit bound, None when none or ambiguous."""
+        hit = self._fuzzy_memo.get(key, self)
+        if hit is not self:
+            return hit
+        hit = None
+        if len(key) >= MIN_FUZZY_LEN and self.keys:
+            bound = 1 if len(key) < 10 else 2
+            grams = _trigrams(key)
+            shared: Dict[int, int] = {}
+            for g in grams:
+                for kid in self.postings.get(g, ()):
+                    shared[kid] = shared.get(kid, 0) + 1
+            need, digits = len(grams) - 3 * bound, _digits(key)
+            best, best_canon = bound + 1, None
+            for kid, n in shared.items():
+                if n < need or self.key_digits[kid] != digits:
+                    continue
+                d = bounded_levenshtein(key, self.keys[kid], bound)
+                if d is None or d > best:
+                    continue
+                canon = self.exact[self.keys[kid]]
+                if d < best:
+                    best, best_canon = d, canon
+                elif canon != best_canon:
+                    best_canon = None  # equally close to two ingredients
+            hit = best_canon
+        self._fuzzy_memo[key] = hit
+        return hit
+
+    def _spans(self, key: str):
+        tokens = key.split()
+        for width in range(min(len(tokens) - 1, self.max_span), 0, -1):
+            for i in range(len(tokens) - width + 1):
+                yield " ".join(tokens[i:i + width])
+
+    def resolve(self, item: Optional[str]) -> Resolution:
+        if not item:
+            return UNRESOLVED
+        res = self._memo.get(item)
+        if res is None:
+            res = self._memo[item] = self._resolve(item)
+        return res
+
+    def _resolve(self, item: str) -> Resolution:
+        head, quals = split_qualifiers(_MARKS.sub(" ", item))
+        parts = []
+        for text in [head] + quals:
+            key = ingredient_key(text)
+            if key:
+                parts.append((key, strip_forms(key)))
+        exact = self.exact
+        for key, stripped in parts:
+            canon = exact.get(key) or exact.get(stripped)
+            if canon:
+                return Resolution(canon, "exact")
+        for key, stripped in parts:
+            canon = self.fuzzy(stripped) or (self.fuzzy(key) if key != stripped else None)
+            if canon:
+                return Resolution(canon, "fuzzy")
+        for _, stripped in parts:
+            spans = list(self._spans(stripped))
+            canon = next((exact[s] for s in spans if s in exact), None) or next(
+                (c for c in map(self.fuzzy, spans) if c), None)
+            if canon:
+                return Resolution(canon, "span")
+        return UNRESOLVED
+
+    def canonical(self, item: Optional[str]) -> Optional[str]:
+        """Canonical name, or the label's spelling (whitespace collapsed) when unresolved; None if blank."""
+        if not item or not normalize_item(item):
+            return None
+        return self.resolve(item).canonical or _WS_RUN.sub(" ", item).strip(" .")
+
+def main():
+    ap = argparse.ArgumentParser(description="Resolve raw ingredient strings (arguments, or stdin lines).")
+    ap.add_argument("items", nargs="*")
+    ap.add_argument("--syn", type=Path, default=Path("rules/synonyms.csv"))
+    ap.add_argument("--vocab", type=Path, default=Path("rules/ingredients.txt"))
+    a = ap.parse_args()
+    resolver = IngredientResolver.from_files(a.syn, a.vocab)
+    for item in a.items or (ln.rstrip("\n") for ln in sys.stdin):
+        res = resolver.resolve(item)
+        print(f"{item}\t{res.canonical or ''}\t{res.method}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Parsed raw records, cached per raw file, for aggregate_dir (--record_cache).
+
+Parsing the raw JSON (gzip, then the JSON decoder) is most of an ingest run,
+and a mapper or FIELDS change re-parses every file under data/raw. With a
+record cache each raw file is parsed once: the records it yields are written
+to `<cache dir>/<src>/<sha256 of the raw file>.arrow`, an Arrow IPC file with
+one large_binary column holding each record marshal-serialized. Later runs
+memory-map that file and unmarshal the records in file order, so mappers see
+the same dicts as from the JSON, without decompressing or tokenizing it.
+
+Entries are keyed by content, not path: an edited raw file gets a new entry,
+and a renamed one keeps its entry. Digests come from a `HashCache` in the
+cache directory (the manifest's cache format), so unchanged files are not
+re-hashed. A miss is filled while the file is being mapped; an entry is only
+committed once the raw reader is exhausted. Entries written by another
+Python version (marshal format) or by an older raw reader (READER_VERSION)
+are treated as misses. After each run (full or --incremental), entries no raw
+file points at any more are deleted.
+
+  uv run python -m src.preprocess.aggregate_dir --src amazon --in_dir data/raw/amazon_dataset \
+      --out data/interim/amazon.parquet --record_cache data/cache/records
+"""
+from __future__ import annotations
+import marshal, os, sys, uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc
+
+from src.utils.provenance import HashCache, hash_files
+
+READER_VERSION = 2  # bump when aggregate_dir's raw reader changes what it yields for the same file
+FORMAT = f"marshal-{marshal.version}-py{sys.version_info[0]}.{sys.version_info[1]}-reader{READER_VERSION}"
+SCHEMA = pa.schema([("record", pa.large_binary())], metadata={"format": FORMAT})
+BATCH_RECORDS = 1024
+
+class RecordCache:
+    """Per-source record cache under ``root/src``; ``index`` the files before asking for their records."""
+
+    def __init__(self, root: Path, src: str):
+        self.dir = Path(root) / src
+        self.hashes: Dict[str, str] = {}
+
+    def index(self, files: List[Path], workers: Optional[int] = None) -> None:
+        """Digest ``files`` (HashCache hits are not re-read); unreadable files stay uncached."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        digests = HashCache(self.dir / "hashes.json")
+        for key, res in hash_files(files, digests, workers=workers).items():
+            if not isinstance(res, Exception):
+                self.hashes[key] = res[1]
+        digests.save()
+
+    def entry(self, fp: Path) -> Optional[Path]:
+        sha = self.hashes.get(fp.as_posix())
+        return self.dir / f"{sha}.arrow" if sha else None
+
+    def records(self, fp: Path, read: Callable[[Path], Iterable[Dict[str, Any]]]) -> Iterable[Dict[str, Any]]:
+        """The records ``read(fp)`` yields, from the cache entry when there is one."""
+        entry = self.entry(fp)
+        if entry is None:
+            return read(fp)
+        if entry.exists():
+            try:
+                with pa.memory_map(str(entry), "r") as src:
+                    ok = pa.ipc.open_file(src).schema.metadata.get(b"format") == FORMAT.encode()
+            except (OSError, pa.ArrowInvalid):
+                ok = False
+            if ok:
+                return _load(entry)
+        return _fill(entry, read(fp))
+
+    def prune(self) -> int:
+        """Delete entries no indexed file points at; returns how many."""
+        live = {f"{sha}.arrow" for sha in self.hashes.values()}
+        n = 0
+        for p in self.dir.glob("*.arrow"):
+            if p.name not in live:
+                p.unlink()
+                n += 1
+        return n
+
+def _load(entry: Path) -> Iterable[Dict[str, Any]]:
+    loads = marshal.loads
+    with pa.memory_map(str(entry), "r") as src:
+        reader = pa.ipc.open_file(src)
+        for i in range(reader.num_record_batches):
+            col = reader.get_batch(i).column(0)
+            _, offsets, data = col.buffers()
+            offs = np.frombuffer(offsets, dtype=np.int64)[col.offset:col.offset + len(col) + 1].tolist()
+            view = memoryview(data) if data is not None else memoryview(b"")
+            for a, b in zip(offs, offs[1:]):
+                yield loads(view[a:b])
+
+def _fill(entry: Path, records: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+    tmp = entry.with_name(f".{entry.stem}.{uuid.uuid4().hex}.tmp")  # workers may fill the same entry
+    done = False
+    try:
+        with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, SCHEMA) as w:
+            buf: List[bytes] = []
+            for obj in records:
+                buf.append(marshal.dumps(obj))
+                if len(buf) >= BATCH_RECORDS:
+                    w.write_batch(pa.record_batch([pa.array(buf, pa.large_binary())], schema=SCHEMA))
+                    buf.clear()
+                yield obj
+            if buf:
+                w.write_batch(pa.record_batch([pa.array(buf, pa.large_binary())], schema=SCHEMA))
+        done = True
+        os.replace(tmp, entry)
+    finally:
+        if not done:
+            tmp.unlink(missing_ok=True)
@@ -0,0 +1,245 @@
+"""
+Hive-partitioned Parquet datasets for the per-source and harmonized outputs.
+
+With `--partition_by source entry_year` (params.partition_by) a stage writes
+a directory instead of one file:
+
+  data/interim/harmonized.parquet/
+    _dataset.json                      partition_by, row_group_size, rows and files per partition
+    source=DSLD/entry_year=2023/part-00000.parquet
+    source=Amazon/entry_year=2025/part-00000.parquet
+    source=Knowde/entry_year=__HIVE_DEFAULT_PARTITION__/part-00000.parquet
+
+`source` is the column itself (kept out of the files, hive style);
+`entry_year` is derived from the first four characters of `entry_date`
+(null when they are not a year). Rows are buffered per partition and
+written in `row_group_size` row groups with column statistics, so readers
+can skip partitions by path and row groups by min/max.
+
+`open_dataset` opens either layout (a single file or a dataset directory)
+as a `pyarrow.dataset.Dataset`; src.utils.schema's readers build on it and
+take a `filter` expression that is pushed down to both. Rows of a dataset
+come back grouped by partition: partitions in the order they were first
+written (from `_dataset.json`), rows in write order within each.
+`where_filter` turns CLI conditions such as `source=DSLD on_market=true
+entry_year>=2020` into that expression.
+"""
+from __future__ import annotations
+import argparse, itertools, json, os, re, shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import quote
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+PARTITION_KEYS = ["source", "entry_year"]
+PARTITION_TYPES = {"source": pa.string(), "entry_year": pa.int16()}
+DERIVED_KEYS = {"entry_year"}  # partition keys that are not stored columns
+DATASET_META = "_dataset.json"  # "_" prefix: skipped by pyarrow's file discovery
+DEFAULT_ROW_GROUP_SIZE = 65536
+HIVE_NULL = "__HIVE_DEFAULT_PARTITION__"
+
+def add_partition_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--partition_by", nargs="+", default=None, choices=PARTITION_KEYS,
+                    help="write a hive-partitioned dataset directory at --out instead of one file")
+    ap.add_argument("--row_group_size", type=int, default=DEFAULT_ROW_GROUP_SIZE,
+                    help="rows per row group of the partitioned dataset")
+
+def remove(path: Path) -> None:
+    """Delete a file or dataset directory (the output layout may change between runs)."""
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+# ---------------- writing ----------------
+def _text(col) -> pa.Array:
+    if isinstance(col, pa.ChunkedArray):
+        col = col.combine_chunks()
+    if pa.types.is_dictionary(col.type):
+        col = col.cast(col.type.value_type)
+    return col.cast(pa.large_string())
+
+def partition_values(tbl: pa.Table, key: str) -> pa.Array:
+    """Partition value per row as text (null -> the hive default partition)."""
+    if key == "entry_year":
+        year = pc.utf8_slice_codeunits(_text(tbl.column("entry_date")), 0, 4)
+        return pc.if_else(pc.match_substring_regex(year, r"^\d{4}$"), year, pa.scalar(None, pa.large_string()))
+    return _text(tbl.column(key))
+
+def _segments(values: pa.Array, key: str) -> pa.Array:
+    """`key=value` path segment per row, quoted once per distinct value."""
+    enc = pc.dictionary_encode(values)
+    segs = [f"{key}={quote(v, safe='') if v else HIVE_NULL}" for v in enc.dictionary.to_pylist()]
+    return pa.array(segs, pa.large_string()).take(enc.indices).fill_null(f"{key}={HIVE_NULL}")
+
+class _Partition:
+    def __init__(self, rel: str):
+        self.rel = rel
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.pending: List[pa.Table] = []
+        self.n_pending = 0
+        self.rows = 0
+
+class PartitionedWriter:
+    """Hive-partitioned Parquet output; one file per partition, `row_group_size` row groups.
+
+    Written into a hidden `.<name>.tmp` sibling and swapped in on `close`, so readers never see
+    a half-written dataset and stale partitions of an earlier run disappear.
+    """
+    def __init__(self, base_dir: Path, schema: pa.Schema, partition_by: Sequence[str],
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE, compression: str = "snappy"):
+        unknown = [k for k in partition_by if k not in PARTITION_KEYS]
+        if unknown:
+            raise ValueError(f"unknown partition keys: {unknown}")
+        self.base_dir, self.partition_by = Path(base_dir), list(partition_by)
+        self.row_group_size, self.compression = row_group_size, compression
+        self.schema = schema
+        # partition columns live in the directory names, not in the files
+        self.file_schema = pa.schema([f for f in schema if f.name not in self.partition_by], metadata=schema.metadata)
+        self.tmp_dir = self.base_dir.with_name(f".{self.base_dir.name}.tmp")
+        remove(self.tmp_dir)
+        self.tmp_dir.mkdir(parents=True)
+        self.parts: Dict[str, _Partition] = {}  # first-written order
+
+    def _write_rows(self, part: _Partition, tbl: pa.Table) -> None:
+        if part.writer is None:
+            (self.tmp_dir / part.rel).mkdir(parents=True, exist_ok=True)
+            part.writer = pq.ParquetWriter(self.tmp_dir / part.rel / "part-00000.parquet", self.file_schema,
+                                           compression=self.compression, write_statistics=True)
+        part.writer.write_table(tbl, row_group_size=self.row_group_size)
+        part.rows += tbl.num_rows
+
+    def _add(self, rel: str, tbl: pa.Table) -> None:
+        part = self.parts.get(rel)
+        if part is None:
+            part = self.parts[rel] = _Partition(rel)
+        part.pending.append(tbl)
+        part.n_pending += tbl.num_rows
+        if part.n_pending >= self.row_group_size:
+            pending = pa.concat_tables(part.pending)
+            full = pending.num_rows - pending.num_rows % self.row_group_size
+            self._write_rows(part, pending.slice(0, full))
+            rest = pending.slice(full)
+            part.pending, part.n_pending = ([rest] if rest.num_rows else []), rest.num_rows
+
+    def write(self, data) -> None:
+        tbl = data if isinstance(data, pa.Table) else pa.Table.from_batches([data])
+        if tbl.num_rows == 0:
+            return
+        segs = [_segments(partition_values(tbl, k), k) for k in self.partition_by]
+        rel = segs[0] if len(segs) == 1 else pc.binary_join_element_wise(*segs, pa.scalar("/", pa.large_string()))
+        enc = pc.dictionary_encode(rel)
+        body = tbl.select(self.file_schema.names)
+        codes = enc.indices.to_numpy(zero_copy_only=False)
+        if len(enc.dictionary) == 1:
+            self._add(enc.dictionary[0].as_py(), body)
+            return
+        # stable sort keeps write order within each partition; codes follow first appearance
+        order = np.argsort(codes, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(enc.dictionary)))])
+        for code, rel_path in enumerate(enc.dictionary.to_pylist()):
+            self._add(rel_path, body.take(pa.array(order[bounds[code]:bounds[code + 1]])))
+
+    def close(self) -> None:
+        for part in self.parts.values():
+            if part.n_pending:
+                self._write_rows(part, pa.concat_tables(part.pending))
+            part.pending, part.n_pending = [], 0
+            part.writer.close()
+        parts = [{"path": p.rel, "rows": p.rows, "files": ["part-00000.parquet"]} for p in self.parts.values()]
+        if not parts:  # keep the schema readable for an empty output
+            pq.write_table(self.file_schema.empty_table(), self.tmp_dir / "part-00000.parquet",
+                           compression=self.compression)
+            parts = [{"path": "", "rows": 0, "files": ["part-00000.parquet"]}]
+        (self.tmp_dir / DATASET_META).write_text(json.dumps({
+            "version": 1, "partition_by": self.partition_by, "row_group_size": self.row_group_size,
+            "rows": sum(p["rows"] for p in parts), "partitions": parts,
+        }, indent=2), encoding="utf-8")
+        remove(self.base_dir)
+        os.replace(self.tmp_dir, self.base_dir)
+
+    def abort(self) -> None:
+        for part in self.parts.values():
+            if part.writer is not None:
+                part.writer.close()
+        remove(self.tmp_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_partitioned(data, base_dir: Path, partition_by: Sequence[str],
+                      row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> None:
+    """Write a table (or an iterable of tables / record batches sharing one schema) as a dataset."""
+    if isinstance(data, pa.Table):
+        schema, chunks = data.schema, [data]
+    else:
+        rest = iter(data)
+        first = next(rest, None)
+        if first is None:
+            raise ValueError("write_partitioned needs a table or at least one batch")
+        schema, chunks = first.schema, itertools.chain([first], rest)
+    with PartitionedWriter(base_dir, schema, partition_by, row_group_size) as w:
+        for chunk in chunks:
+            w.write(chunk)
+
+# ---------------- reading ----------------
+def read_meta(path: Path) -> Optional[dict]:
+    meta = Path(path) / DATASET_META
+    return json.loads(meta.read_text(encoding="utf-8")) if meta.is_file() else None
+
+def open_dataset(path) -> "ds.Dataset":
+    """A Parquet file, or a dataset directory (partitions in `_dataset.json` order when present)."""
+    import pyarrow.dataset as ds  # ~0.3 s to import; writers and the light CLIs never need it
+    path = Path(path)
+    if not path.is_dir():
+        return ds.dataset(path, format="parquet")
+    meta = read_meta(path)
+    if meta is None:  # a hive directory written by another tool
+        return ds.dataset(path, format="parquet", partitioning="hive")
+    files = [(path / p["path"] / f).as_posix() for p in meta["partitions"] for f in p["files"]]
+    partitioning = ds.partitioning(pa.schema([(k, PARTITION_TYPES[k]) for k in meta["partition_by"]]),
+                                   flavor="hive")
+    return ds.dataset(files, format="parquet", partitioning=partitioning, partition_base_dir=path.as_posix())
+
+def stored_columns(dataset: "ds.Dataset") -> List[str]:
+    """Columns a reader returns by default: derived partition keys are filter-only."""
+    return [n for n in dataset.schema.names if n not in DERIVED_KEYS]
+
+_CONDITION = re.compile(r"^(\w+)(!=|>=|<=|=|>|<)(.*)$")
+
+def where_filter(conditions: Optional[Sequence[str]], schema: pa.Schema) -> Optional["ds.Expression"]:
+    """`col=value`, `col=v1,v2`, `col!=value`, `col>=value` ... ANDed; values cast to the column type."""
+    import pyarrow.dataset as ds
+    expr = None
+    for cond in conditions or []:
+        m = _CONDITION.match(cond.strip())
+        if not m or m.group(1) not in schema.names:
+            raise ValueError(f"bad condition {cond!r} (columns: {', '.join(schema.names)})")
+        name, op, raw = m.groups()
+        type_ = schema.field(name).type
+        if pa.types.is_dictionary(type_):
+            type_ = type_.value_type
+        values = [pa.scalar(v, pa.string()).cast(type_) for v in (raw.split(",") if op == "=" else [raw])]
+        field = ds.field(name)
+        if op == "=":
+            e = field == values[0] if len(values) == 1 else field.isin(pa.array([v.as_py() for v in values], type_))
+        else:
+            e = {"!=": field != values[0], ">=": field >= values[0], "<=": field <= values[0],
+                 ">": field > values[0], "<": field < values[0]}[op]
+        expr = e if expr is None else expr & e
+    return expr
+
+def add_where_arg(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--where", nargs="+", default=None, metavar="COND",
+                    help="read only matching rows, e.g. source=DSLD on_market=true entry_year>=2020 "
+                         "(pushed down to partitions and row-group statistics)")
@@ -0,0 +1,205 @@
+"""
+Per-stage performance records: provenance/runs/stage_metrics.jsonl.
+
+Stages wrap their work in `stage(name)` and fill in what they know:
+
+    with instrument.stage("harmonize", inputs=paths, outputs=[out]) as rec:
+        rec.rows_in = harmonize(...)
+
+On exit one JSON line is appended to the history with wall and CPU time
+(this process, plus reaped worker processes), peak RSS, rows in/out, bytes
+read/written (sizes of the declared input/output files; without them, the
+process's read/write syscall byte counts from /proc/self/io) and
+records/sec. Stages of one run share `run_id` (env INGREDIENTS_RUN_ID, set by
+the Snakefile and src.pipeline; otherwise one id per process), so a run can
+be lined up against earlier ones. The Snakefile and src.pipeline put the
+history next to the configured `runmeta_path` (env INGREDIENTS_METRICS).
+
+CPU time, peak RSS and the /proc/self/io fallback are process-wide, so for
+stages that share a process (src.pipeline runs some concurrently) they
+overlap and peak RSS is cumulative. Set INGREDIENTS_PROFILE=<dir> (or pass
+--profile to a stage CLI) to also dump a cProfile `<run_id>_<stage>.prof`
+per stage; profiles cover the calling thread only.
+
+CLI:
+  uv run python -m src.utils.instrument compare --threshold 0.2
+"""
+from __future__ import annotations
+import argparse, cProfile, json, os, statistics, sys, threading, time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HISTORY_PATH = Path("provenance/runs/stage_metrics.jsonl")
+RUN_ID_ENV = "INGREDIENTS_RUN_ID"
+METRICS_ENV = "INGREDIENTS_METRICS"
+PROFILE_ENV = "INGREDIENTS_PROFILE"
+_profiling = threading.local()  # one cProfile per thread: nested stages are covered by the outer one
+
+def new_run_id() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + f"-{os.getpid()}"
+
+def run_id() -> str:
+    if not os.environ.get(RUN_ID_ENV):
+        os.environ[RUN_ID_ENV] = new_run_id()  # inherited by worker processes
+    return os.environ[RUN_ID_ENV]
+
+def add_profile_arg(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--profile", type=Path, default=None, help=f"cProfile dump dir (or env {PROFILE_ENV})")
+
+def configure(profile_dir: Optional[Path] = None, history: Optional[Path] = None) -> None:
+    if profile_dir:
+        os.environ[PROFILE_ENV] = str(profile_dir)
+    if history:
+        os.environ[METRICS_ENV] = str(history)
+
+def _cpu() -> tuple[float, float]:
+    if resource is None:
+        return time.process_time(), 0.0
+    own, kids = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, kids.ru_utime + kids.ru_stime
+
+def _peak_rss_mb(who) -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1 << 20) if sys.platform == "darwin" else rss / 1024, 1)  # bytes on macOS, KiB on Linux
+
+def _proc_io() -> Optional[Dict[str, int]]:
+    try:
+        with open("/proc/self/io", encoding="ascii") as f:
+            return {k: int(v) for k, v in (ln.split(":") for ln in f)}
+    except (OSError, ValueError):
+        return None
+
+def _size(paths: Iterable) -> int:
+    total = 0
+    for p in paths:
+        p = Path(p)
+        if p.is_dir():
+            total += sum(f.stat().st_size for f in p.rglob("*") if f.is_file())
+        elif p.exists():
+            total += p.stat().st_size
+    return total
+
+class StageRecord:
+    """Counters a stage fills in while it runs; `inputs`/`outputs` are sized at exit."""
+    def __init__(self, name: str, inputs: Iterable = (), outputs: Iterable = ()):
+        self.name = name
+        self.inputs, self.outputs = list(inputs), list(outputs)
+        self.rows_in: Optional[int] = None
+        self.rows_out: Optional[int] = None
+        self.bytes_read: Optional[int] = None
+        self.bytes_written: Optional[int] = None
+        self.extra: Dict[str, object] = {}
+
+@contextmanager
+def stage(name: str, inputs: Iterable = (), outputs: Iterable = (),
+          history: Optional[Path] = None, profile: bool = True) -> Iterator[StageRecord]:
+    rec = StageRecord(name, inputs, outputs)
+    rid = run_id()
+    history = history or Path(os.environ.get(METRICS_ENV) or HISTORY_PATH)
+    profile_dir = os.environ.get(PROFILE_ENV)
+    prof = cProfile.Profile() if profile and profile_dir and not getattr(_profiling, "on", False) else None
+    started = datetime.now(timezone.utc).isoformat()
+    io0, (cpu0, kids0) = _proc_io(), _cpu()
+    t0 = time.perf_counter()
+    if prof:
+        _profiling.on = True
+        prof.enable()
+    try:
+        yield rec
+    finally:
+        if prof:
+            prof.disable()
+            _profiling.on = False
+        wall = time.perf_counter() - t0
+        cpu1, kids1 = _cpu()
+        io1 = _proc_io()
+        if rec.bytes_read is None:
+            rec.bytes_read = _size(rec.inputs) if rec.inputs else (io1["rchar"] - io0["rchar"] if io0 and io1 else None)
+        if rec.bytes_written is None:
+            rec.bytes_written = _size(rec.outputs) if rec.outputs else (io1["wchar"] - io0["wchar"] if io0 and io1 else None)
+        rows = rec.rows_in if rec.rows_in is not None else rec.rows_out
+        entry = {
+            "run_id": rid, "stage": name, "started_utc": started,
+            "wall_s": round(wall, 4), "cpu_s": round(cpu1 - cpu0, 4), "cpu_children_s": round(kids1 - kids0, 4),
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+            "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            "rows_in": rec.rows_in, "rows_out": rec.rows_out,
+            "bytes_read": rec.bytes_read, "bytes_written": rec.bytes_written,
+            "records_per_s": round(rows / wall, 1) if rows is not None and wall > 0 else None,
+            **({"extra": rec.extra} if rec.extra else {}),
+        }
+        if prof:
+            Path(profile_dir).mkdir(parents=True, exist_ok=True)
+            entry["profile"] = (Path(profile_dir) / f"{rid}_{name}.prof").as_posix()
+            prof.dump_stats(entry["profile"])
+        print(f"[{name}] {entry['wall_s']:.2f}s wall, {entry['cpu_s']:.2f}s cpu, "
+              f"{entry['records_per_s'] or '-'} rec/s", file=sys.stderr)
+        try:
+            history.parent.mkdir(parents=True, exist_ok=True)
+            with history.open("a", encoding="utf-8") as f:  # one short append per stage
+                f.write(json.dumps(entry) + "\n")
+        except Exception:
+            pass
+
+# ---------------- history ----------------
+def load_history(path: Path = HISTORY_PATH) -> List[dict]:
+    if not path.exists():
+        return []
+    out = []
+    for ln in path.read_text(encoding="utf-8").splitlines():
+        try:
+            out.append(json.loads(ln))
+        except ValueError:
+            continue
+    return out
+
+def compare(history: List[dict], rid: Optional[str] = None, baseline_runs: int = 5,
+            threshold: float = 0.2, min_delta_s: float = 0.05) -> List[dict]:
+    """Per stage: wall time of run `rid` (default: latest) vs. the median of up to N earlier runs.
+
+    A regression is slower by more than `threshold` (share) and by more than `min_delta_s`
+    seconds, so millisecond stages do not flag on timer noise.
+    """
+    runs = list(dict.fromkeys(e["run_id"] for e in history))
+    if not runs:
+        return []
+    rid = rid or runs[-1]
+    earlier = runs[:runs.index(rid)][-baseline_runs:] if rid in runs else runs[-baseline_runs:]
+    rows = []
+    for e in (e for e in history if e["run_id"] == rid):
+        base = [b["wall_s"] for b in history if b["run_id"] in earlier and b["stage"] == e["stage"]]
+        median = statistics.median(base) if base else None
+        change = (e["wall_s"] - median) / median if median else None
+        rows.append({"stage": e["stage"], "wall_s": e["wall_s"], "baseline_wall_s": median,
+                     "change": round(change, 3) if change is not None else None,
+                     "regression": change is not None and change > threshold and e["wall_s"] - median > min_delta_s})
+    return rows
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ap_c = sub.add_parser("compare", help="Compare a run's stage wall times against earlier runs")
+    ap_c.add_argument("--history", type=Path, default=None, help=f"default: env {METRICS_ENV} or {HISTORY_PATH}")
+    ap_c.add_argument("--run_id", default=None, help="default: latest run")
+    ap_c.add_argument("--baseline_runs", type=int, default=5)
+    ap_c.add_argument("--threshold", type=float, default=0.2, help="flag stages slower than baseline by this share")
+    ap_c.add_argument("--min_delta", type=float, default=0.05, help="...and by at least this many seconds")
+    a = ap.parse_args()
+
+    history = a.history or Path(os.environ.get(METRICS_ENV) or HISTORY_PATH)
+    rows = compare(load_history(history), a.run_id, a.baseline_runs, a.threshold, a.min_delta)
+    for r in rows:
+        print(json.dumps(r))
+    sys.exit(1 if any(r["regression"] for r in rows) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -4,19 +4,141 @@ Provenance helpers for manifests, checksums, and run metadata.
 CLI:
   uv run python -m src.utils.provenance manifest --dir data/raw --out provenance/source_manifest.csv
   uv run python -m src.utils.provenance checksums --out provenance/checksums.txt reports/quality_report.csv data/curated/uc1_products.csv data/curated/uc2_companies.csv
-  uv run python -m src.utils.provenance runmeta --config workflow/config.yaml --out provenance/runs/run_meta.json
+  uv run python -m src.utils.provenance runmeta --config workflow/config.yaml --out provenance/runs/run_meta.json [--stage_cache .stage_cache]
+
+Digests are cached in provenance/.hash_cache.json keyed on (path, size,
+mtime_ns, inode), so unchanged files are not re-read; misses are hashed on a
+thread pool. Global flags (before the subcommand): --cache PATH, --no-cache,
+--workers N. `manifest --fast-digest` adds a crc32 column.
 """
 from __future__ import annotations
-import argparse, csv, hashlib, json, os, platform, subprocess, sys
+import argparse, csv, hashlib, json, mmap, os, platform, subprocess, sys, uuid, zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
-def sha256_of_file(p: Path, chunk_size: int = 1024 * 1024) -> str:
+# Files at or above _MMAP_MIN are hashed through mmap in _SLICE views (hashlib and
+# zlib release the GIL on large buffers, so the thread pool scales); smaller files
+# are read in one call.
+_MMAP_MIN = 8 * 1024 * 1024
+_SLICE = 16 * 1024 * 1024
+HASH_CACHE_PATH = Path("provenance/.hash_cache.json")
+
+def _digest_file(p: Path, fast: bool = False) -> tuple[str, str]:
+    """Return (sha256 hex, crc32 hex or "") for a file."""
     h = hashlib.sha256()
+    crc = 0
     with p.open("rb") as f:
-        for chunk in iter(lambda: f.read(chunk_size), b""):
-            h.update(chunk)
-    return h.hexdigest()
+        size = os.fstat(f.fileno()).st_size
+        if size >= _MMAP_MIN:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for off in range(0, len(mm), _SLICE):
+                        chunk = view[off:off + _SLICE]
+                        h.update(chunk)
+                        if fast:
+                            crc = zlib.crc32(chunk, crc)
+                        chunk.release()
+                finally:
+                    view.release()
+        else:
+            data = f.read()
+            h.update(data)
+            if fast:
+                crc = zlib.crc32(data)
+    return h.hexdigest(), (f"{crc:08x}" if fast else "")
+
+def sha256_of_file(p: Path) -> str:
+    return _digest_file(p)[0]
+
+class HashCache:
+    """Persistent digest cache keyed on (path, size, mtime_ns, inode).
+
+    Stored as JSON ``{path: [size, mtime_ns, inode, sha256, crc32]}``; a stat
+    mismatch on any of the key fields means the file is re-hashed.
+    """
+    def __init__(self, path: Path | None = HASH_CACHE_PATH):
+        self.path = path
+        self.entries: dict[str, list] = {}
+        self.dirty = False
+        if path is not None and path.exists():
+            try:
+                self.entries = json.loads(path.read_text(encoding="utf-8"))
+            except Exception:
+                self.entries = {}
+
+    @staticmethod
+    def _key(st: os.stat_result) -> list:
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def get(self, path: str, st: os.stat_result, fast: bool = False) -> tuple[str, str] | None:
+        e = self.entries.get(path)
+        if e is None or e[:3] != self._key(st) or (fast and not e[4]):
+            return None
+        return e[3], (e[4] if fast else "")
+
+    def put(self, path: str, st: os.stat_result, sha: str, crc: str) -> None:
+        old = self.entries.get(path)
+        if not crc and old and old[:4] == self._key(st) + [sha]:
+            crc = old[4]  # keep a previously computed crc32
+        self.entries[path] = self._key(st) + [sha, crc]
+        self.dirty = True
+
+    def save(self) -> None:
+        if self.path is None or not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}.tmp")  # concurrent rules share a cache
+        try:
+            tmp.write_text(json.dumps(self.entries, separators=(",", ":")), encoding="utf-8")
+            os.replace(tmp, self.path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self.dirty = False
+
+def hash_files(paths: list[str | Path], cache: HashCache | None = None, fast: bool = False,
+               workers: int | None = None) -> dict[str, tuple[os.stat_result, str, str] | Exception]:
+    """Digest ``paths``; cache hits are served from ``cache``, misses hashed on a thread pool.
+
+    Returns ``{posix path: (stat, sha256, crc32)}`` or the exception raised for that path.
+    """
+    out: dict[str, tuple[os.stat_result, str, str] | Exception] = {}
+    todo: list[tuple[str, os.stat_result]] = []
+    for p in paths:
+        key = p if isinstance(p, str) else p.as_posix()
+        try:
+            st = os.stat(key)
+        except Exception as ex:
+            out[key] = ex
+            continue
+        hit = cache.get(key, st, fast) if cache is not None else None
+        if hit is not None:
+            out[key] = (st, *hit)
+        else:
+            todo.append((key, st))
+
+    if todo:
+        n = max(1, workers or min(32, (os.cpu_count() or 1) * 2))
+        # batch small files per task so per-future overhead does not dominate
+        step = max(1, min(64, len(todo) // (n * 4)))
+        chunks = [todo[i:i + step] for i in range(0, len(todo), step)]
+        with ThreadPoolExecutor(max_workers=n) as ex:
+            for chunk, res in zip(chunks, ex.map(lambda c: [_try_digest(key, fast) for key, _ in c], chunks)):
+                for (key, st), d in zip(chunk, res):
+                    if isinstance(d, Exception):
+                        out[key] = d
+                        continue
+                    out[key] = (st, *d)
+                    if cache is not None:
+                        cache.put(key, st, *d)
+    return out
+
+def _try_digest(key: str, fast: bool) -> tuple[str, str] | Exception:
+    try:
+        return _digest_file(Path(key), fast)
+    except Exception as ex:
+        return ex
 
 def git_commit() -> str:
     try:
@@ -27,46 +149,61 @@ def git_commit() -> str:
 def iso_now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
-def write_manifest(dir_path: Path, out_csv: Path) -> None:
-    rows = []
+def write_manifest(dir_path: Path, out_csv: Path, cache: HashCache | None = None,
+                   fast_digest: bool = False, workers: int | None = None) -> None:
+    # plain posix strings instead of Path objects: this loop runs once per raw file
+    paths: list[str] = []
     for root, _, files in os.walk(dir_path):
-        for name in sorted(files):
-            p = Path(root) / name
-            try:
-                stat = p.stat()
-                rows.append({
-                    "path": str(p.as_posix()),
-                    "size_bytes": stat.st_size,
-                    "sha256": sha256_of_file(p),
-                    "mtime_iso": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).isoformat(),
-                })
-            except Exception as ex:
-                rows.append({
-                    "path": str(p.as_posix()),
-                    "size_bytes": "",
-                    "sha256": "",
-                    "mtime_iso": "",
-                    "error": repr(ex)
-                })
+        rp = Path(root).as_posix()
+        prefix = "" if rp == "." else rp.rstrip("/") + "/"
+        paths.extend(prefix + name for name in sorted(files))
+    digests = hash_files(paths, cache, fast_digest, workers)
+
+    rows = []
+    for p in paths:
+        d = digests[p]
+        if isinstance(d, Exception):
+            row = [p, "", ""] + ([""] if fast_digest else []) + ["", repr(d)]
+        else:
+            stat, sha, crc = d
+            mtime = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).isoformat()
+            row = [p, stat.st_size, sha] + ([crc] if fast_digest else []) + [mtime, ""]
+        rows.append(row)
     out_csv.parent.mkdir(parents=True, exist_ok=True)
+    fieldnames = ["path", "size_bytes", "sha256"] + (["crc32"] if fast_digest else []) + ["mtime_iso", "error"]
     with out_csv.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["path", "size_bytes", "sha256", "mtime_iso", "error"])
-        w.writeheader()
-        for r in rows:
-            if "error" not in r: r["error"] = ""
-            w.writerow(r)
+        w = csv.writer(f)
+        w.writerow(fieldnames)
+        w.writerows(rows)
+    if cache is not None:
+        cache.save()
 
-def write_checksums(files: list[str], out_txt: Path) -> None:
+def write_checksums(files: list[str], out_txt: Path, cache: HashCache | None = None,
+                    workers: int | None = None) -> None:
+    paths = [Path(fp) for fp in files]
+    digests = hash_files([p for p in paths if p.exists() and p.is_file()], cache, workers=workers)
     out_txt.parent.mkdir(parents=True, exist_ok=True)
     with out_txt.open("w", encoding="utf-8") as f:
-        for fp in files:
-            p = Path(fp)
-            if p.exists() and p.is_file():
-                f.write(f"{sha256_of_file(p)}  {p.as_posix()}\n")
+        for p in paths:
+            d = digests.get(p.as_posix())
+            if d is not None and not isinstance(d, Exception):
+                f.write(f"{d[1]}  {p.as_posix()}\n")
             else:
                 f.write(f"MISS                     {p.as_posix()}\n")
+    if cache is not None:
+        cache.save()
+
+def read_checksums(txt: Path) -> dict[str, str]:
+    """`write_checksums` output -> {posix path: sha256}; MISS lines are skipped."""
+    out: dict[str, str] = {}
+    for ln in txt.read_text(encoding="utf-8").splitlines():
+        digest, _, path = ln.partition("  ")
+        if digest and digest != "MISS" and path:
+            out[path.strip()] = digest
+    return out
 
-def write_runmeta(config_path: Path, out_json: Path) -> None:
+def write_runmeta(config_path: Path, out_json: Path, stage_cache: dict | None = None) -> None:
+    """Run metadata JSON; ``stage_cache`` is the run's src.utils.stage_cache summary (hits/misses)."""
     meta = {
         "timestamp_utc": iso_now(),
         "git_commit": git_commit(),
@@ -74,22 +211,29 @@ def write_runmeta(config_path: Path, out_json: Path) -> None:
         "platform": platform.platform(),
         "argv": sys.argv,
         "config_path": str(config_path),
+        "run_id": os.environ.get("INGREDIENTS_RUN_ID", ""),  # key into runs/stage_metrics.jsonl
     }
     try:
         meta["config_sha256"] = sha256_of_file(config_path)
     except Exception:
         meta["config_sha256"] = ""
+    if stage_cache is not None:
+        meta["stage_cache"] = stage_cache
     out_json.parent.mkdir(parents=True, exist_ok=True)
     with out_json.open("w", encoding="utf-8") as f:
         json.dump(meta, f, indent=2)
 
 def main():
     ap = argparse.ArgumentParser()
+    ap.add_argument("--cache", type=Path, default=HASH_CACHE_PATH, help="hash cache file (manifest/checksums)")
+    ap.add_argument("--no-cache", dest="no_cache", action="store_true")
+    ap.add_argument("--workers", type=int, default=None, help="hashing threads (default: 2 x CPUs, max 32)")
     sub = ap.add_subparsers(dest="cmd", required=True)
 
     ap_m = sub.add_parser("manifest", help="Write CSV manifest for a directory")
     ap_m.add_argument("--dir", required=True, type=Path)
     ap_m.add_argument("--out", required=True, type=Path)
+    ap_m.add_argument("--fast-digest", dest="fast_digest", action="store_true", help="add a crc32 column next to sha256")
 
     ap_c = sub.add_parser("checksums", help="Write checksums for listed files")
     ap_c.add_argument("--out", required=True, type=Path)
@@ -98,14 +242,20 @@ def main():
     ap_r = sub.add_parser("runmeta", help="Write run metadata JSON")
     ap_r.add_argument("--config", required=True, type=Path)
     ap_r.add_argument("--out", required=True, type=Path)
+    ap_r.add_argument("--stage_cache", type=Path, default=None, help="stage cache dir: add this run's hits/misses")
 
     args = ap.parse_args()
+    cache = None if args.no_cache else HashCache(args.cache)
     if args.cmd == "manifest":
-        write_manifest(args.dir, args.out)
+        write_manifest(args.dir, args.out, cache, args.fast_digest, args.workers)
     elif args.cmd == "checksums":
-        write_checksums(args.files, args.out)
+        write_checksums(args.files, args.out, cache, args.workers)
     elif args.cmd == "runmeta":
-        write_runmeta(args.config, args.out)
+        summary = None
+        if args.stage_cache:
+            from src.utils.stage_cache import StageCache  # imports this module
+            summary = StageCache(args.stage_cache).summary()
+        write_runmeta(args.config, args.out, summary)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,298 @@
+"""
+Record schemas for the per-source / harmonized / integrated Parquet files.
+
+- v1: every field `large_string` (lists comma-joined, numbers as text)
+- v2: typed -- float64 quantities, bool `on_market`, dictionary-encoded
+  low-cardinality categoricals, list<string> for `ingredients`,
+  `other_ingredients` and `claims`; the label text of each quantity is kept
+  next to it (`serving_size_text`, `net_quantity_text`), so a value that is
+  not a number ("1-2", "$34.95 per count") is not lost, and an empty
+  `net_unit` takes the unit after the number ("120 Count (Pack of 1)" -> "Count")
+
+Writers tag the Arrow schema with `ingredients_curation.schema_version`.
+`read_table` / `iter_batches` are the compatibility readers: they accept
+either version (files without the tag are sniffed), a single file or a
+partitioned dataset directory (src.utils.dataset), read only the requested
+columns, push an optional `filter` down to partitions and row groups, and
+always yield v2; `table_batches` does the same for an in-memory table.
+Ingest rows (`ROW_SCHEMA`) carry v1 text plus, for list-valued source fields
+(DSLD ingredient rows, claims, Amazon about_this_item), the mapper's items;
+the upgrade takes those as they are and splits only text (v1 files and
+free-text sources) with `split_items`.
+`to_pandas` flattens a v2 table for pandas consumers (dictionaries decoded,
+lists joined with ", ").
+"""
+from __future__ import annotations
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.preprocess.canonical import split_items
+from src.utils.dataset import open_dataset, stored_columns
+
+FIELDS = [
+    "source","source_path","source_record_id",
+    "product_name","brand","company_name","link","on_market","entry_date","form",
+    "serving_size","serving_unit","net_quantity","net_unit",
+    "ingredients","other_ingredients","claims","statements"
+]
+VERSION_KEY = b"ingredients_curation.schema_version"
+CURRENT_VERSION = 2
+
+_DICT = pa.dictionary(pa.int32(), pa.string())  # the type Parquet round-trips dictionaries to
+_LIST = pa.list_(pa.large_string())
+CATEGORICAL = ["source", "brand", "company_name", "form", "serving_unit", "net_unit"]
+NUMERIC = ["serving_size", "net_quantity"]
+BOOLEAN = ["on_market"]
+LISTS = ["ingredients", "other_ingredients", "claims"]
+# v2 keeps the text each quantity was parsed from (v1's column as is)
+TEXT = {k: f"{k}_text" for k in NUMERIC}
+FIELDS_V2 = FIELDS + list(TEXT.values())
+_QUANTITY = {v: k for k, v in TEXT.items()}
+
+def _v2_type(name: str) -> pa.DataType:
+    if name in CATEGORICAL:
+        return _DICT
+    if name in NUMERIC:
+        return pa.float64()
+    if name in BOOLEAN:
+        return pa.bool_()
+    if name in LISTS:
+        return _LIST
+    return pa.large_string()
+
+SCHEMA_V1 = pa.schema([(k, pa.large_string()) for k in FIELDS], metadata={VERSION_KEY: b"1"})
+SCHEMA_V2 = pa.schema([(k, _v2_type(k)) for k in FIELDS_V2], metadata={VERSION_KEY: b"2"})
+# ingest rows: v1 text, plus the items of a list column where the source had a list (null otherwise)
+ITEMS = {k: f"{k}_items" for k in LISTS}
+ROW_SCHEMA = pa.schema(list(SCHEMA_V1) + [(ITEMS[k], _LIST) for k in LISTS], metadata=SCHEMA_V1.metadata)
+
+def schema_for(version: int) -> pa.Schema:
+    return SCHEMA_V2 if version == 2 else SCHEMA_V1
+
+def schema_version(schema: pa.Schema) -> int:
+    tag = (schema.metadata or {}).get(VERSION_KEY)
+    if tag:
+        return int(tag)
+    # untagged files predate v2: sniff a typed column
+    for name in NUMERIC + LISTS:
+        if name in schema.names and not pa.types.is_large_string(schema.field(name).type) \
+                and not pa.types.is_string(schema.field(name).type):
+            return 2
+    return 1
+
+# ---------------- v1 -> v2 ----------------
+# "120 Count (Pack of 1)" -> 120; "2-4" or "$34.95 per count" stay unparsed (null, text kept)
+_LEADING_NUMBER = re.compile(r"^\s*(\d[\d,]*(?:\.\d+)?)(?:\s|$)")
+_PARENS = re.compile(r"\([^)]*\)")
+
+def to_float(v: Optional[str]) -> Optional[float]:
+    if v is None:
+        return None
+    try:
+        return float(str(v).replace(",", "").strip())
+    except ValueError:
+        m = _LEADING_NUMBER.match(str(v))
+        return float(m.group(1).replace(",", "")) if m else None
+
+def unit_after_number(v: Optional[str]) -> Optional[str]:
+    """The unit a quantity label carries after its number: "120 Count (Pack of 1)" -> "Count"."""
+    m = _LEADING_NUMBER.match(v) if v else None
+    unit = _PARENS.sub("", v[m.end():]).strip() if m else ""
+    return unit or None
+
+def _per_unique(col: pa.Array, fn, type_: pa.DataType) -> pa.Array:
+    enc = col if pa.types.is_dictionary(col.type) else pc.dictionary_encode(col)
+    mapped = pa.array([fn(v) for v in enc.dictionary.to_pylist()], type=type_)
+    return mapped.take(enc.indices)
+
+def _split_or_null(v: Optional[str]):
+    items = split_items(v) if v else []
+    return items or None
+
+def _upgrade_column(name: str, col: pa.Array) -> pa.Array:
+    if isinstance(col, pa.ChunkedArray):
+        col = col.combine_chunks()
+    target = _v2_type(name)
+    if col.type == target:
+        return col
+    if pa.types.is_null(col.type):
+        return pa.nulls(len(col), target)
+    if not pa.types.is_large_string(col.type):
+        col = col.cast(pa.large_string())
+    if name in CATEGORICAL:
+        return pc.dictionary_encode(col.cast(pa.string()))
+    if name in NUMERIC:
+        return _per_unique(col, to_float, pa.float64())
+    if name in BOOLEAN:
+        return _per_unique(col, lambda v: None if v in (None, "") else v.strip().lower() in ("1", "true", "yes"),
+                           pa.bool_())
+    if name in LISTS:
+        return _per_unique(col, _split_or_null, _LIST)
+    return col
+
+def _is_text(col: pa.Array) -> bool:
+    return pa.types.is_large_string(col.type) or pa.types.is_string(col.type)
+
+def _quantity_text(name: str, batch: pa.RecordBatch) -> pa.Array:
+    """`*_text` of a batch without one: v1's text column as is, else (v2 files from before it) the number."""
+    qty = batch.column(_QUANTITY[name]) if _QUANTITY[name] in batch.schema.names else None
+    if qty is None or pa.types.is_null(qty.type):
+        return pa.nulls(batch.num_rows, pa.large_string())
+    if _is_text(qty):
+        return qty.cast(pa.large_string())
+    return _per_unique(qty, lambda v: format_number(v) or None, pa.large_string())
+
+def _upgrade_net_unit(batch: pa.RecordBatch) -> pa.Array:
+    unit = _upgrade_column("net_unit", batch.column("net_unit"))
+    qty = batch.column("net_quantity") if "net_quantity" in batch.schema.names else None
+    if qty is None or not _is_text(qty):
+        return unit
+    # v1 text: an empty unit takes the one written after the number
+    empty = pc.fill_null(pc.equal(pc.utf8_trim_whitespace(unit.cast(pa.large_string())), ""), True)
+    if not pc.any(empty).as_py():
+        return unit
+    after = _per_unique(qty.cast(pa.large_string()), unit_after_number, pa.large_string())
+    merged = pc.if_else(pc.and_(empty, pc.is_valid(after)), after, unit.cast(pa.large_string()))
+    return pc.dictionary_encode(merged.cast(pa.string()))
+
+def _upgrade_field(name: str, batch: pa.RecordBatch) -> pa.Array:
+    if name in _QUANTITY and name not in batch.schema.names:
+        return _quantity_text(name, batch)
+    if name not in batch.schema.names:
+        return pa.nulls(batch.num_rows, _v2_type(name))
+    col = batch.column(name)
+    if name == "net_unit" and col.type != _v2_type(name):
+        return _upgrade_net_unit(batch)
+    items = ITEMS.get(name)
+    if items not in batch.schema.names or batch.column(items).null_count == batch.num_rows:
+        return _upgrade_column(name, col)
+    # ingest rows: the mapper's list as is; split_items only where the source gave text
+    listed = pc.is_valid(batch.column(items))
+    text = pc.if_else(listed, pa.scalar(None, col.type), col)
+    return pc.if_else(listed, batch.column(items), _upgrade_column(name, text))
+
+def upgrade_batch(batch, extra: Optional[pa.Schema] = None) -> pa.RecordBatch:
+    """Any-version batch (or table, or ROW_SCHEMA ingest rows) -> v2 RecordBatch.
+
+    Columns outside the v2 fields are kept as-is when listed in ``extra`` and dropped otherwise.
+    """
+    if isinstance(batch, pa.Table):
+        batch = batch.combine_chunks().to_batches()[0] if batch.num_rows else \
+            pa.RecordBatch.from_pylist([], schema=batch.schema)
+    names = batch.schema.names
+    arrays = [_upgrade_field(k, batch) for k in FIELDS_V2]
+    schema = SCHEMA_V2
+    if extra is not None:
+        for f in extra:
+            if f.name in FIELDS_V2:
+                continue
+            arrays.append(batch.column(f.name) if f.name in names else pa.nulls(batch.num_rows, f.type))
+            schema = schema.append(f)
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+# ---------------- compatibility readers ----------------
+def _extra_fields(schema: pa.Schema) -> pa.Schema:
+    return pa.schema([f for f in schema if f.name not in FIELDS_V2])
+
+def _coalesce(batches: Iterable[pa.RecordBatch], batch_size: int) -> Iterable[pa.RecordBatch]:
+    """Re-slice scanner output (one batch per row group at most) into ``batch_size`` batches."""
+    pending: List[pa.RecordBatch] = []
+    n = 0
+    for rb in batches:
+        if not rb.num_rows:
+            continue
+        pending.append(rb)
+        n += rb.num_rows
+        if n >= batch_size:
+            tbl = pa.Table.from_batches(pending).combine_chunks()
+            full = n - n % batch_size
+            yield from tbl.slice(0, full).to_batches(max_chunksize=batch_size)
+            pending, n = tbl.slice(full).to_batches(), n - full
+    if n:
+        yield from pa.Table.from_batches(pending).combine_chunks().to_batches()
+
+# columns the upgrade of a pre-v2 file derives from another one
+_DERIVED_FROM = {**{v: k for k, v in TEXT.items()}, "net_unit": "net_quantity"}
+
+def _projection(dataset, columns: Optional[List[str]]) -> List[str]:
+    names = dataset.schema.names
+    if not columns:
+        return stored_columns(dataset)  # missing FIELDS -> nulls
+    if not (_is_v2(dataset.schema) and all(k in names for k in TEXT.values())):
+        columns = list(dict.fromkeys(c for col in columns for c in (col, _DERIVED_FROM.get(col)) if c))
+    return [c for c in columns if c in names]
+
+def iter_batches(path, batch_size: int = 65536, columns: Optional[List[str]] = None,
+                 filter=None) -> Iterable[pa.RecordBatch]:
+    """Stream any-version Parquet (a file or a dataset directory) as v2 batches (v2 fields first, then any extra columns).
+
+    Only ``columns`` are read; ``filter`` (a pyarrow.dataset expression over the stored
+    columns and partition keys) skips partitions and row groups by their statistics.
+    """
+    dataset = open_dataset(path)
+    extra = _extra_fields(dataset.schema)
+    scan = dataset.to_batches(columns=_projection(dataset, columns), filter=filter, batch_size=batch_size)
+    for rb in _coalesce(scan, batch_size):
+        out = upgrade_batch(rb, extra)
+        yield out.select(columns) if columns else out
+
+def table_batches(tbl: pa.Table, batch_size: int = 65536, columns: Optional[List[str]] = None) -> Iterable[pa.RecordBatch]:
+    """`iter_batches` for an in-memory table of either version."""
+    extra = _extra_fields(tbl.schema)
+    for rb in tbl.to_batches(max_chunksize=batch_size):
+        out = rb if schema_version(rb.schema) == 2 and all(k in rb.schema.names for k in FIELDS_V2) \
+            else upgrade_batch(rb, extra)
+        yield out.select(columns) if columns else out
+
+def _is_v2(schema: pa.Schema) -> bool:
+    return schema_version(schema) == 2 and all(schema.field(k).type == _v2_type(k) for k in FIELDS_V2 if k in schema.names)
+
+def read_table(path, columns: Optional[List[str]] = None, filter=None) -> pa.Table:
+    """Read any-version Parquet (a file or a dataset directory) as a v2 table; see `iter_batches`."""
+    dataset = open_dataset(path)
+    tbl = dataset.to_table(columns=_projection(dataset, columns), filter=filter)
+    if _is_v2(tbl.schema) and (tbl.column_names[:len(FIELDS_V2)] == FIELDS_V2 if not columns
+                               else tbl.column_names == columns):
+        return tbl
+    extra = _extra_fields(tbl.schema)
+    batches = [upgrade_batch(rb, extra) for rb in tbl.to_batches()]
+    if not batches:
+        batches = [upgrade_batch(pa.RecordBatch.from_pylist([], schema=tbl.schema), extra)]
+    out = pa.Table.from_batches(batches)
+    return out.select(columns) if columns else out
+
+def flatten(tbl: pa.Table, sep: str = ", ") -> pa.Table:
+    """Decode dictionaries and join list<string> columns so pandas sees plain scalars."""
+    cols, fields = [], []
+    for f, col in zip(tbl.schema, tbl.columns):
+        if pa.types.is_dictionary(f.type):
+            col = col.cast(f.type.value_type)
+        elif pa.types.is_list(f.type) or pa.types.is_large_list(f.type):
+            col = pc.binary_join(col, pa.scalar(sep, pa.large_string()))
+        cols.append(col)
+        fields.append(pa.field(f.name, col.type))
+    return pa.Table.from_arrays(cols, schema=pa.schema(fields))
+
+def to_pandas(tbl: pa.Table):
+    import pandas as pd
+    flat = flatten(tbl)
+    try:
+        return flat.to_pandas(strings_to_categorical=False)
+    except Exception:
+        return pd.DataFrame(flat.to_pylist())
+
+def format_number(v) -> str:
+    """Render a typed quantity as text, integral values without ".0" ("2", "0.7").
+
+    Only for numbers without their label text (`*_text`), e.g. v2 files written before it.
+    """
+    if v is None or (isinstance(v, float) and np.isnan(v)) or v == "":
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
@@ -0,0 +1,310 @@
+"""
+Content-addressed cache of stage outputs for the Snakefile rules.
+
+Snakemake decides by mtime, so a `git checkout`, a touched rules/*.csv or a
+re-run on fresh copies recomputes everything from harmonize down even when
+every input is byte-identical. `run` wraps a rule's command:
+
+  uv run python -m src.utils.stage_cache run --stage harmonize --in <inputs> --out <outputs> \
+      -- python -m src.preprocess.harmonize ...
+
+and keys the stage on
+- the sha256 of every input file (directories: every file below them), via a
+  HashCache in the cache directory so unchanged files are not re-read
+- the stage's code version: sha256 of the module named by `-m` (or --code)
+  and every `src.*` module it imports, transitively
+- the command line, which carries the params (batch size, flags, paths),
+  without the parallelism flags in PARALLEL_FLAGS (`--workers N`): stages
+  write the same outputs at any worker count, so `-j` or merge_workers
+  does not miss the cache
+
+On a hit the outputs are copied back from `<dir>/entries/<key>/` (fresh
+mtimes, so downstream rules see them as new) and the command is skipped; on
+a miss the command runs and its outputs are stored. --out also takes files a
+stage writes besides its declared outputs (provenance/merge_stats.json).
+The cache is bounded by --max_gb: after a store, least recently used entries
+are deleted until the total fits. Each hit or miss is appended to
+`<dir>/events.jsonl` under the run id (src.utils.instrument), and
+`provenance runmeta --stage_cache <dir>` adds the run's hit/miss counts to
+run_meta.json.
+
+  uv run python -m src.utils.stage_cache stats --dir .stage_cache
+  uv run python -m src.utils.stage_cache clear --dir .stage_cache
+"""
+from __future__ import annotations
+import argparse, ast, hashlib, json, os, shutil, subprocess, sys, time, uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from src.utils import instrument
+from src.utils.provenance import HashCache, hash_files, iso_now
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+CACHE_DIR = Path(".stage_cache")
+DEFAULT_MAX_GB = 5.0
+KEY_VERSION = 1
+PARALLEL_FLAGS = ("--workers",)  # options that only set parallelism; left out of the key
+MAX_EVENTS = 10000  # events.jsonl is trimmed to this many lines on eviction
+
+# ---------------- keys ----------------
+def _module_file(name: str) -> Optional[Path]:
+    # resolved by path, not importlib: finding "pkg.mod.attr" would import pkg.mod
+    base = REPO_ROOT.joinpath(*name.split("."))
+    for path in (base.with_suffix(".py"), base / "__init__.py"):
+        if path.is_file():
+            return path
+    return None
+
+def _imports(path: Path) -> Iterable[str]:
+    for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"))):
+        if isinstance(node, ast.Import):
+            yield from (a.name for a in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            yield node.module
+            yield from (f"{node.module}.{a.name}" for a in node.names)  # submodules; attributes resolve to None
+
+def code_version(modules: Iterable[str], package: str = "src") -> Dict[str, str]:
+    """{module: sha256 of its source} for ``modules`` and the ``package`` modules they import, transitively."""
+    out: Dict[str, str] = {}
+    todo = list(modules)
+    while todo:
+        name = todo.pop()
+        if name in out or not (name == package or name.startswith(package + ".")):
+            continue
+        path = _module_file(name)
+        if path is None:
+            continue
+        out[name] = hashlib.sha256(path.read_bytes()).hexdigest()
+        todo.extend(_imports(path))
+    return dict(sorted(out.items()))
+
+def _files(paths: Iterable[Path]) -> List[str]:
+    files: List[str] = []
+    for p in paths:
+        if p.is_dir():
+            files.extend(sorted((Path(r) / f).as_posix() for r, _, fs in os.walk(p) for f in fs))
+        else:
+            files.append(p.as_posix())
+    return files
+
+def _remove(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum((Path(r) / f).stat().st_size for r, _, fs in os.walk(path) for f in fs)
+    return path.stat().st_size
+
+def key_command(cmd: List[str]) -> List[str]:
+    """``cmd`` without PARALLEL_FLAGS and their values (``--workers 4`` or ``--workers=4``)."""
+    out, skip = [], False
+    for c in cmd:
+        if skip:
+            skip = False
+        elif c in PARALLEL_FLAGS:
+            skip = True
+        elif not c.startswith(tuple(f + "=" for f in PARALLEL_FLAGS)):
+            out.append(c)
+    return out
+
+def module_of(cmd: List[str]) -> Optional[str]:
+    """The module a ``python -m <module> ...`` command runs."""
+    return cmd[cmd.index("-m") + 1] if "-m" in cmd[:-1] else None
+
+class StageCache:
+    """Entries under ``root/entries/<key>/``; see the module docstring."""
+
+    def __init__(self, root: Path = CACHE_DIR, max_bytes: int = int(DEFAULT_MAX_GB * 1e9)):
+        self.root, self.max_bytes = Path(root), max_bytes
+        self.entries = self.root / "entries"
+
+    def key(self, stage: str, inputs: Iterable[Path], cmd: List[str], code: Iterable[str] = ()) -> str:
+        files = _files(inputs)
+        digests = HashCache(self.root / "hashes.json")
+        hashed = hash_files(files, digests)
+        digests.save()
+        missing = [f for f in files if isinstance(hashed[f], Exception)]
+        if missing:
+            raise FileNotFoundError(f"stage {stage}: unreadable inputs {missing[:3]}")
+        doc = {"version": KEY_VERSION, "stage": stage, "cmd": key_command(cmd), "code": code_version(code),
+               "inputs": {f: hashed[f][1] for f in files}}
+        return hashlib.sha256(json.dumps(doc, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def restore(self, key: str, outputs: List[Path]) -> Optional[dict]:
+        """Copy the entry's outputs into place; the entry's metadata, or None on a miss."""
+        entry = self.entries / key
+        try:
+            meta = json.loads((entry / "meta.json").read_text(encoding="utf-8"))
+            if meta["outputs"] != [p.as_posix() for p in outputs]:
+                return None
+            for i, p in enumerate(outputs):
+                src = entry / str(i)
+                if not src.exists():
+                    continue  # the stage did not write this one
+                _remove(p)
+                p.parent.mkdir(parents=True, exist_ok=True)
+                if src.is_dir():  # copyfile, not copy2: restored outputs get fresh mtimes
+                    shutil.copytree(src, p, copy_function=shutil.copyfile)
+                else:
+                    shutil.copyfile(src, p)
+            os.utime(entry / "meta.json")  # last used, for eviction
+            return meta
+        except (OSError, ValueError, KeyError):
+            return None  # no entry, or evicted while copying: recompute
+
+    def store(self, key: str, stage: str, outputs: List[Path], seconds: Optional[float] = None) -> int:
+        """Copy ``outputs`` into a new entry (skipped when it alone exceeds the bound); returns its bytes.
+
+        ``seconds`` is what computing them took, i.e. what a hit saves.
+        """
+        total = sum(_size(p) for p in outputs if p.exists())
+        if total > self.max_bytes:
+            return 0
+        self.entries.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f"tmp-{uuid.uuid4().hex}"
+        tmp.mkdir()
+        try:
+            for i, p in enumerate(outputs):
+                if p.is_dir():
+                    shutil.copytree(p, tmp / str(i))
+                elif p.exists():
+                    shutil.copy2(p, tmp / str(i))
+            (tmp / "meta.json").write_text(json.dumps({
+                "stage": stage, "outputs": [p.as_posix() for p in outputs], "bytes": total, "seconds": seconds,
+                "created_utc": iso_now(),
+            }, indent=2), encoding="utf-8")
+            os.rename(tmp, self.entries / key)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # a concurrent run stored the same key
+        self.evict()
+        return total
+
+    def _list(self) -> List[tuple]:
+        out = []
+        for entry in self.entries.glob("*") if self.entries.exists() else ():
+            try:
+                meta_path = entry / "meta.json"
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+                out.append((meta_path.stat().st_mtime, entry, meta))
+            except (OSError, ValueError):
+                continue
+        return sorted(out, key=lambda e: e[0])
+
+    def evict(self) -> int:
+        """Delete least recently used entries until the total is within ``max_bytes``; returns how many."""
+        listed = self._list()
+        total, n = sum(meta["bytes"] for _, _, meta in listed), 0
+        for _, entry, meta in listed:
+            if total <= self.max_bytes:
+                break
+            trash = self.root / f"tmp-{uuid.uuid4().hex}"
+            try:
+                os.rename(entry, trash)  # gone at once for concurrent restores
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= meta["bytes"]
+            n += 1
+        self._trim_events()
+        return n
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    # ---------------- events ----------------
+    def log(self, **event) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with (self.root / "events.jsonl").open("a", encoding="utf-8") as f:  # one short append per stage
+            f.write(json.dumps({"run_id": instrument.run_id(), "time_utc": iso_now(), **event}) + "\n")
+
+    def _trim_events(self) -> None:
+        path = self.root / "events.jsonl"
+        try:
+            lines = path.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            return
+        if len(lines) > MAX_EVENTS:
+            tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            tmp.write_text("\n".join(lines[-MAX_EVENTS:]) + "\n", encoding="utf-8")
+            os.replace(tmp, path)
+
+    def summary(self, run_id: Optional[str] = None) -> dict:
+        """Hit/miss counts of run ``run_id`` (default: the current one) and the cache size."""
+        rid = run_id or instrument.run_id()
+        events = []
+        try:
+            for ln in (self.root / "events.jsonl").read_text(encoding="utf-8").splitlines():
+                e = json.loads(ln)
+                if e.get("run_id") == rid:
+                    events.append(e)
+        except (OSError, ValueError):
+            pass
+        listed = self._list()
+        return {
+            "dir": self.root.as_posix(), "hits": sum(e["result"] == "hit" for e in events),
+            "misses": sum(e["result"] == "miss" for e in events),
+            "seconds_saved": round(sum(e.get("saved_s") or 0 for e in events if e["result"] == "hit"), 3),
+            "stages": {e["stage"]: e["result"] for e in events},
+            "entries": len(listed), "bytes": sum(meta["bytes"] for _, _, meta in listed),
+        }
+
+def run_stage(cache: StageCache, stage: str, inputs: List[Path], outputs: List[Path], cmd: List[str],
+              code: Iterable[str] = ()) -> int:
+    """Restore ``outputs`` on a key hit, else run ``cmd`` and store them; returns the exit code."""
+    t0 = time.perf_counter()
+    cmd_exec = [sys.executable if c == "python" else c for c in cmd]
+    try:
+        key = cache.key(stage, inputs, cmd, list(code) or [m for m in [module_of(cmd)] if m])
+    except OSError as ex:
+        print(f"[{stage}] stage cache off: {ex}", file=sys.stderr)
+        return subprocess.call(cmd_exec)
+    hit = cache.restore(key, outputs)
+    if hit is not None:
+        cache.log(stage=stage, result="hit", key=key, bytes=hit["bytes"],
+                  seconds=round(time.perf_counter() - t0, 3), saved_s=hit.get("seconds"))
+        print(f"[{stage}] stage cache hit {key[:12]}", file=sys.stderr)
+        return 0
+    t1 = time.perf_counter()
+    rc = subprocess.call(cmd_exec)
+    if rc != 0:
+        return rc
+    seconds = round(time.perf_counter() - t1, 3)
+    stored = cache.store(key, stage, outputs, seconds)
+    cache.log(stage=stage, result="miss", key=key, bytes=stored, seconds=seconds)
+    return 0
+
+def main():
+    ap = argparse.ArgumentParser(description="Content-addressed stage output cache.")
+    ap.add_argument("--dir", type=Path, default=CACHE_DIR)
+    ap.add_argument("--max_gb", type=float, default=DEFAULT_MAX_GB)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ap_r = sub.add_parser("run", help="restore a stage's outputs or run it: run [options] -- python -m ...")
+    ap_r.add_argument("--stage", required=True)
+    ap_r.add_argument("--in", dest="inputs", nargs="*", type=Path, default=[])
+    ap_r.add_argument("--out", dest="outputs", nargs="+", type=Path, required=True)
+    ap_r.add_argument("--code", nargs="*", default=[], help="modules whose code versions the stage (default: the -m module)")
+    ap_r.add_argument("command", nargs=argparse.REMAINDER)
+    sub.add_parser("stats", help="cache size and the latest run's hits/misses")
+    sub.add_parser("clear", help="delete the cache")
+    a = ap.parse_args()
+    cache = StageCache(a.dir, int(a.max_gb * 1e9))
+    if a.cmd == "run":
+        cmd = a.command[1:] if a.command[:1] == ["--"] else a.command
+        if not cmd:
+            ap.error("run needs a command after --")
+        sys.exit(run_stage(cache, a.stage, a.inputs, a.outputs, cmd, a.code))
+    elif a.cmd == "stats":
+        events = []
+        try:
+            events = [json.loads(ln) for ln in (cache.root / "events.jsonl").read_text(encoding="utf-8").splitlines()]
+        except (OSError, ValueError):
+            pass
+        print(json.dumps(cache.summary(events[-1]["run_id"] if events else None), indent=2))
+    elif a.cmd == "clear":
+        cache.clear()
+
+if __name__ == "__main__":
+    main()
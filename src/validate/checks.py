@@ -1,88 +1,385 @@
+"""
+Quality report for integrated.parquet (reports/quality_report.csv).
+
+The input (a Parquet file or a partitioned dataset directory, see
+src.utils.dataset) is scanned with pyarrow.dataset in record batches
+(`--batch_size` rows at a time), reading only the columns the selected
+checks name, so peak memory is bounded by the batch size plus the checks'
+running state, not by the size of the input. `--where` restricts the report
+to matching rows; conditions on partition keys skip whole partitions and
+the rest are checked against row-group statistics before any data is read
+(near-duplicate counts still cover the whole --near_dups file).
+
+Each batch is wrapped in a `CheckContext`, which caches per-column work
+(decoded columns, non-empty masks) so a column is scanned at most once per
+batch however many checks use it.
+
+Checks are mergeable accumulators registered with `@check("name")`: a
+`Check` subclass is built from the dataset schema, names the columns it
+reads, folds every batch into its state in `update`, and returns a list of
+{"metric", "value"} rows from `result`. The report lists them in registration order. Add a metric by
+registering a class here (or in a module imported before `run_checks`).
+
+CLI:
+  uv run python -m src.validate.checks --in data/interim/integrated.parquet --schema metadata/dataset.schema.json --out reports/quality_report.csv
+  uv run python -m src.validate.checks --in data/interim/integrated.parquet --schema metadata/dataset.schema.json --out reports/quality_dsld.csv --where source=DSLD
+"""
 import argparse, json, csv
 from pathlib import Path
+from typing import Callable, Dict, List, Optional, Type, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
-import pandas as pd
 
-def read_df(parquet_path: str) -> pd.DataFrame:
-    tbl = pq.read_table(parquet_path)
-    try:
-        # Prefer the fast path; avoid extension string dtype conversion issues
-        return tbl.to_pandas(strings_to_categorical=False)
-    except Exception:
-        # Fallback: convert via pure Python lists (slower but robust)
-        return pd.DataFrame(tbl.to_pylist())
+from src.utils import instrument
+from src.utils.dataset import add_where_arg, open_dataset, stored_columns, where_filter
+from src.utils.schema import FIELDS_V2, TEXT, iter_batches, table_batches, upgrade_batch
+from src.validate.record_schema import compile_schema
 
-def nonempty_ratio(series: pd.Series) -> float:
-    if series is None or series.size == 0:
-        return 0.0
-    s = series.astype(str).fillna("").str.strip()
-    return float((s != "").mean())
+# ---------------- per-batch state ----------------
+class CheckContext:
+    """One batch of the input; `names` are the columns of the whole file, `offset` the batch's first row."""
+    def __init__(self, tbl: pa.Table, names: List[str], offset: int = 0,
+                 near_dups: Union[Path, pa.Table, None] = None):
+        self.tbl = tbl
+        self.n = tbl.num_rows
+        self.names = names
+        self.offset = offset
+        self.near_dups = near_dups
+        self._cache: Dict[tuple, object] = {}
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--in", dest="inp", required=True)
-    ap.add_argument("--schema", required=True)
-    ap.add_argument("--out", dest="out", required=True)
-    a = ap.parse_args()
+    def _cached(self, key: tuple, fn: Callable):
+        if key not in self._cache:
+            self._cache[key] = fn()
+        return self._cache[key]
 
-    df = read_df(a.inp).fillna("")
+    def has(self, name: str) -> bool:
+        return name in self.names
 
-    # Ensure expected columns exist (avoid KeyErrors)
-    for col in ["source","product_name","brand","ingredients","serving_size","serving_unit"]:
-        if col not in df.columns:
-            df[col] = ""
+    def column(self, name: str) -> pa.ChunkedArray:
+        """Column with dictionaries decoded; missing columns read as all-null strings."""
+        def load():
+            if name not in self.tbl.column_names:
+                return pa.chunked_array([pa.nulls(self.n, pa.large_string())])
+            col = self.tbl.column(name)
+            return col.cast(col.type.value_type) if pa.types.is_dictionary(col.type) else col
+        return self._cached(("col", name), load)
 
-    # Load schema to check requireds (best-effort)
-    required = []
-    try:
-        sch = json.loads(Path(a.schema).read_text(encoding="utf-8"))
-        required = list(sch.get("required", []))
-    except Exception:
+    def text(self, name: str) -> pa.ChunkedArray:
+        """Column as trimmed text, nulls as "" and lists ", "-joined (what the CSV views show)."""
+        def load():
+            col = self.column(name)
+            if pa.types.is_list(col.type) or pa.types.is_large_list(col.type):
+                col = pc.binary_join(col, pa.scalar(", ", col.type.value_type))
+            elif not (pa.types.is_string(col.type) or pa.types.is_large_string(col.type)):
+                return pc.fill_null(col.cast(pa.large_string()), "")
+            return pc.utf8_trim_whitespace(pc.fill_null(col, ""))
+        return self._cached(("text", name), load)
+
+    def nonempty(self, name: str) -> np.ndarray:
+        """Boolean mask: value present and not blank (empty lists count as blank)."""
+        def load():
+            col = self.column(name)
+            if pa.types.is_string(col.type) or pa.types.is_large_string(col.type) \
+                    or pa.types.is_list(col.type) or pa.types.is_large_list(col.type):
+                mask = pc.not_equal(self.text(name), "")
+            else:
+                mask = pc.is_valid(col)
+            return pc.fill_null(mask, False).to_numpy(zero_copy_only=False)
+        return self._cached(("nonempty", name), load)
+
+    def nonempty_ratio(self, name: str) -> float:
+        return float(self.nonempty(name).mean()) if self.n else 0.0
+
+# ---------------- registry ----------------
+class Check:
+    """Mergeable accumulator: `update` sees every batch once, `result` emits the metric rows."""
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.required = list(schema.get("required", []))
+
+    def columns(self, names: List[str]) -> List[str]:
+        """Columns to read, given the column names of the file."""
+        return []
+
+    def update(self, ctx: CheckContext) -> None:
         pass
 
-    metrics = []
-    metrics.append({"metric": "records_total", "value": int(len(df))})
-
-    # Per-source counts
-    if "source" in df.columns:
-        vc = df["source"].astype(str).value_counts(dropna=False)
-        for src, cnt in vc.items():
-            metrics.append({"metric": f"records_source_{src}", "value": int(cnt)})
-
-    # Required fields non-empty ratio
-    for col in required:
-        if col in df.columns:
-            metrics.append({"metric": f"required_nonempty_ratio::{col}",
-                            "value": round(nonempty_ratio(df[col]), 4)})
-
-    # Parse-success proxies
-    for col in ["ingredients", "serving_size", "serving_unit"]:
-        if col in df.columns:
-            metrics.append({"metric": f"parse_nonempty_ratio::{col}",
-                            "value": round(nonempty_ratio(df[col]), 4)})
-
-    # Cross-source consistency for (product_name,brand) on 'ingredients'
-    needed = {"product_name","brand","ingredients","source"}
-    if needed.issubset(df.columns):
-        g = df.groupby(["product_name","brand"], dropna=False)
-        multi = g.filter(lambda x: x["source"].astype(str).nunique() > 1)
-        if len(multi):
-            def consistent(sub):
-                vals = sub["ingredients"].astype(str).fillna("").str.strip().unique()
-                return int(len(vals) == 1)
-            rate = multi.groupby(["product_name","brand"]).apply(consistent).mean()
-            metrics.append({"metric":"cross_source_consistency_rate_on_ingredients",
-                            "value": round(float(rate), 4)})
+    def result(self, ctx: CheckContext) -> List[dict]:
+        return []
+
+CHECKS: Dict[str, Type[Check]] = {}
+
+def check(name: str):
+    def register(cls: Type[Check]):
+        CHECKS[name] = cls
+        return cls
+    return register
+
+def run_checks(source: Union[Path, pa.Table], schema: Optional[dict] = None,
+               near_dups: Union[Path, pa.Table, None] = None, names: Optional[List[str]] = None,
+               batch_size: int = 65536, filter=None) -> List[dict]:
+    """`source` is integrated.parquet (or a dataset directory) or the same data as an in-memory table (src.pipeline).
+
+    `filter` is a pyarrow.dataset expression; only matching rows are checked.
+    """
+    checks = [cls(schema or {}) for name, cls in CHECKS.items() if names is None or name in names]
+    if isinstance(source, pa.Table) and filter is not None:
+        source = source.filter(filter)
+    if isinstance(source, pa.Table):
+        file_schema = source.schema
+    else:
+        dataset = open_dataset(source)
+        file_schema = pa.schema([dataset.schema.field(n) for n in stored_columns(dataset)])
+    file_names = list(dict.fromkeys(FIELDS_V2 + file_schema.names))  # the v2 reader fills in missing fields
+    wanted = dict.fromkeys(c for chk in checks for c in chk.columns(file_names) if c in file_names)
+    columns = list(wanted) or ["source"]  # at least one column so batches carry row counts
+
+    batches = table_batches(source, batch_size, columns) if isinstance(source, pa.Table) \
+        else iter_batches(source, batch_size=batch_size, columns=columns, filter=filter)
+    ctx, offset = None, 0
+    for rb in batches:
+        ctx = CheckContext(pa.Table.from_batches([rb]), file_names, offset, near_dups)
+        for chk in checks:
+            chk.update(ctx)
+        offset += rb.num_rows
+    if ctx is None:  # empty file: give `result` a zero-row context
+        empty = upgrade_batch(pa.RecordBatch.from_pylist([], schema=file_schema)).select(columns)
+        ctx = CheckContext(pa.Table.from_batches([empty]), file_names, 0, near_dups)
+
+    metrics: List[dict] = []
+    for chk in checks:
+        metrics.extend(chk.result(ctx))
+    return metrics
+
+class _NonemptyRatios(Check):
+    """Running non-empty counts for the columns in `targets` (set per class, or per schema in `__init__`).
+
+    `read` maps a target to the column its count is taken from.
+    """
+    prefix = ""
+    targets: List[str] = []
+    read: Dict[str, str] = {}
+
+    def __init__(self, schema: dict):
+        super().__init__(schema)
+        self.rows = 0
+        self.hits: Dict[str, int] = {}
+
+    def columns(self, names: List[str]) -> List[str]:
+        return [self.read.get(col, col) for col in self.targets]
+
+    def update(self, ctx: CheckContext) -> None:
+        self.rows += ctx.n
+        for col in self.targets:
+            if ctx.has(col):
+                self.hits[col] = self.hits.get(col, 0) + int(ctx.nonempty(self.read.get(col, col)).sum())
+
+    def result(self, ctx: CheckContext) -> List[dict]:
+        return [{"metric": f"{self.prefix}::{col}",
+                 "value": round(self.hits.get(col, 0) / self.rows, 4) if self.rows else 0.0}
+                for col in self.targets if ctx.has(col)]
+
+# ---------------- checks ----------------
+@check("records")
+class RecordsTotal(Check):
+    def __init__(self, schema: dict):
+        super().__init__(schema)
+        self.rows = 0
+
+    def update(self, ctx: CheckContext) -> None:
+        self.rows += ctx.n
+
+    def result(self, ctx: CheckContext) -> List[dict]:
+        return [{"metric": "records_total", "value": self.rows}]
+
+@check("sources")
+class RecordsPerSource(Check):
+    def __init__(self, schema: dict):
+        super().__init__(schema)
+        self.counts: Dict[str, int] = {}  # insertion order = first-seen order across batches
+
+    def columns(self, names: List[str]) -> List[str]:
+        return ["source"]
+
+    def update(self, ctx: CheckContext) -> None:
+        if not ctx.has("source") or not ctx.n:
+            return
+        vc = pc.value_counts(ctx.text("source")).flatten()
+        for value, cnt in zip(vc[0].to_pylist(), vc[1].to_pylist()):
+            self.counts[value] = self.counts.get(value, 0) + cnt
+
+    def result(self, ctx: CheckContext) -> List[dict]:
+        values = list(self.counts)
+        counts = np.array([self.counts[v] for v in values], dtype=np.int64)
+        # most frequent first; ties keep first-seen order (as pandas value_counts)
+        order = np.argsort(-counts, kind="stable")
+        return [{"metric": f"records_source_{values[i]}", "value": int(counts[i])} for i in order]
+
+@check("required")
+class RequiredNonempty(_NonemptyRatios):
+    prefix = "required_nonempty_ratio"
+
+    def __init__(self, schema: dict):
+        super().__init__(schema)
+        self.targets = self.required
+
+@check("parse")
+class ParseNonempty(_NonemptyRatios):
+    prefix = "parse_nonempty_ratio"
+    targets = ["ingredients", "serving_size", "serving_unit"]
+    read = TEXT  # a serving size that is not a number ("1-2") was still parsed from the label
+
+@check("cross_source_consistency")
+class CrossSourceConsistency(Check):
+    """Among (product_name, brand) groups seen in 2+ sources, share whose ingredients agree.
+
+    Per-key state is kept as two Arrow tables: the distinct (key, source)
+    pairs, and the min/max ingredient text per key (a key is consistent iff
+    min == max). Batch partials are appended and re-grouped once they
+    outgrow the compacted state, so merging stays amortized linear and
+    memory follows the number of distinct keys, not rows.
+    """
+    keys = ["product_name", "brand"]
+
+    def __init__(self, schema: dict):
+        super().__init__(schema)
+        self.pairs: List[pa.Table] = []
+        self.ings: List[pa.Table] = []
+        self.pending = 0
+        self.compacted = 0
+
+    def columns(self, names: List[str]) -> List[str]:
+        return self.keys + ["source", "ingredients"]
+
+    def _compact(self) -> None:
+        if len(self.pairs) > 1:
+            self.pairs = [pa.concat_tables(self.pairs).group_by(["k0", "k1", "src"]).aggregate([])]
+            ing = pa.concat_tables(self.ings).group_by(["k0", "k1"]).aggregate([("ing_min", "min"), ("ing_max", "max")])
+            self.ings = [pa.table({"k0": ing.column("k0"), "k1": ing.column("k1"),
+                                   "ing_min": ing.column("ing_min_min"), "ing_max": ing.column("ing_max_max")})]
+        self.compacted = self.ings[0].num_rows if self.ings else 0
+        self.pending = 0
+
+    def update(self, ctx: CheckContext) -> None:
+        if not ctx.n:
+            return
+        # same text normalization the pandas version used: nulls as "", whitespace-trimmed ingredients
+        g = pa.table({"k0": pc.fill_null(ctx.column(self.keys[0]), ""), "k1": pc.fill_null(ctx.column(self.keys[1]), ""),
+                      "src": ctx.text("source"), "ing": ctx.text("ingredients")})
+        g = g.cast(pa.schema([(name, pa.large_string()) for name in g.column_names]))  # one type across batches
+        self.pairs.append(g.group_by(["k0", "k1", "src"]).aggregate([]))
+        ing = g.group_by(["k0", "k1"]).aggregate([("ing", "min"), ("ing", "max")])
+        self.ings.append(ing.select(["k0", "k1", "ing_min", "ing_max"]))
+        self.pending += ing.num_rows
+        if self.pending > max(self.compacted, 65536):
+            self._compact()
+
+    def result(self, ctx: CheckContext) -> List[dict]:
+        self._compact()
+        n_multi = 0
+        if self.pairs:
+            srcs = self.pairs[0].group_by(["k0", "k1"]).aggregate([("src", "count")])
+            multi = srcs.filter(pc.greater(srcs.column("src_count"), 1))
+            n_multi = multi.num_rows
+        if not n_multi:
+            return [{"metric": "cross_source_consistency_rate_on_ingredients", "value": "N/A"}]
+        joined = multi.join(self.ings[0], keys=["k0", "k1"], join_type="inner")
+        consistent = pc.sum(pc.equal(joined.column("ing_min"), joined.column("ing_max"))).as_py() or 0
+        return [{"metric": "cross_source_consistency_rate_on_ingredients", "value": round(float(consistent / n_multi), 4)}]
+
+@check("schema")
+class SchemaConformance(Check):
+    """Per-record JSON Schema validation: violation counts and sample row ids per field."""
+    samples = 5
+
+    def __init__(self, schema: dict):
+        super().__init__(schema)
+        self.validator = compile_schema(schema) if schema else None
+        self.rows = 0
+        self.invalid_rows = 0
+        self.counts: Dict[str, int] = {}
+        self.sample_rows: Dict[str, List[int]] = {}
+
+    def columns(self, names: List[str]) -> List[str]:
+        return self.validator.fields(names) if self.validator else []
+
+    def update(self, ctx: CheckContext) -> None:
+        if self.validator is None:
+            return
+        self.rows += ctx.n
+        masks = self.validator.violations(ctx.tbl, ctx.names)
+        any_bad = np.zeros(ctx.n, dtype=bool)
+        for field, bad in masks.items():
+            any_bad |= bad
+            self.counts[field] = self.counts.get(field, 0) + int(bad.sum())
+            taken = self.sample_rows.setdefault(field, [])
+            if len(taken) < self.samples:
+                taken.extend(int(i) + ctx.offset for i in np.flatnonzero(bad)[:self.samples - len(taken)])
+        self.invalid_rows += int(any_bad.sum())
+
+    def result(self, ctx: CheckContext) -> List[dict]:
+        if self.validator is None:
+            return []
+        out = [{"metric": "schema_valid_ratio",
+                "value": round(1 - self.invalid_rows / self.rows, 4) if self.rows else 0.0}]
+        for field, cnt in self.counts.items():
+            out.append({"metric": f"schema_violations::{field}", "value": cnt})
+            if cnt:
+                out.append({"metric": f"schema_violation_rows::{field}",
+                            "value": ";".join(map(str, self.sample_rows[field]))})
+        return out
+
+@check("near_duplicates")
+class NearDuplicates(Check):
+    # MinHash/LSH near-duplicate clusters (computed by src.validate.near_duplicates)
+    def result(self, ctx: CheckContext) -> List[dict]:
+        if isinstance(ctx.near_dups, pa.Table):
+            nd = ctx.near_dups.column("dup_cluster_id")
+        elif ctx.near_dups and Path(ctx.near_dups).exists():
+            nd = pq.read_table(ctx.near_dups, columns=["dup_cluster_id"]).column(0)
         else:
-            metrics.append({"metric":"cross_source_consistency_rate_on_ingredients",
-                            "value": "N/A"})
+            return []
+        return [{"metric": "near_duplicate_clusters", "value": int(len(pc.unique(nd)))},
+                {"metric": "near_duplicate_records", "value": int(len(nd))}]
 
-    Path(a.out).parent.mkdir(parents=True, exist_ok=True)
-    with open(a.out, "w", newline="", encoding="utf-8") as f:
+def write_report(metrics: List[dict], out_path: Path) -> None:
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=["metric","value"])
         w.writeheader()
         for m in metrics:
             w.writerow(m)
 
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True)
+    ap.add_argument("--schema", required=True)
+    ap.add_argument("--out", dest="out", required=True)
+    ap.add_argument("--near_dups", default=None, help="duplicate-cluster Parquet from src.validate.near_duplicates")
+    ap.add_argument("--checks", nargs="+", default=None, choices=list(CHECKS), help="subset of checks (default: all)")
+    ap.add_argument("--batch_size", type=int, default=65536, help="rows per streamed record batch")
+    add_where_arg(ap)
+    instrument.add_profile_arg(ap)
+    a = ap.parse_args()
+    instrument.configure(a.profile)
+
+    # Load schema for requireds and per-record validation (best-effort)
+    schema = {}
+    try:
+        schema = json.loads(Path(a.schema).read_text(encoding="utf-8"))
+    except Exception:
+        pass
+
+    with instrument.stage("validate_curated", inputs=[a.inp] + ([a.near_dups] if a.near_dups else []),
+                          outputs=[a.out]) as rec:
+        where = where_filter(a.where, open_dataset(a.inp).schema)
+        metrics = run_checks(Path(a.inp), schema, Path(a.near_dups) if a.near_dups else None,
+                             a.checks, a.batch_size, where)
+        write_report(metrics, Path(a.out))
+        rec.rows_in = next((int(m["value"]) for m in metrics if m["metric"] == "records_total"), None)
+
 if __name__ == "__main__":
     main()
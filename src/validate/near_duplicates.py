@@ -0,0 +1,240 @@
+"""
+Near-duplicate detection over integrated.parquet with MinHash + LSH banding.
+
+Each record is shingled into its `product_name` tokens (prefixed "n:") and
+`ingredients` tokens ("i:"): lower-cased letter/digit runs, split with Arrow
+kernels. Records with the same name and ingredients share one document, so
+exact re-crawls cost nothing extra.
+Per document:
+- signature: --num_perm multiply-shift hashes of the crc32 token ids, min per
+  document; computed in batches as (tokens x perms) NumPy arrays reduced with
+  np.minimum.reduceat
+- LSH: the signature is cut into --bands bands; documents whose band rows are
+  identical land in the same bucket and become candidate pairs (sub-quadratic)
+- verification: estimated Jaccard (share of equal signature slots) >= --threshold
+Verified pairs are merged into connected components with vectorized label
+propagation.
+
+Output (--out): one row per record in a duplicate cluster of 2+ records, with
+`dup_cluster_id`, `row` (position in the input), identifying fields, and
+`similarity` (estimated Jaccard to the cluster's first record). The cluster
+count is picked up by src.validate.checks (--near_dups).
+
+CLI:
+  uv run python -m src.validate.near_duplicates --in data/interim/integrated.parquet --out data/interim/near_duplicates.parquet
+"""
+from __future__ import annotations
+import argparse, json, zlib
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.utils.schema import read_table
+
+ID_COLS = ["curated_id", "cluster_id", "source", "source_record_id", "product_name", "brand", "entry_date"]
+_MAX_CELLS = 1 << 24  # tokens x perms per signature batch (~128 MiB of uint64)
+
+# ---------------- shingles ----------------
+_SPLIT = r"[^\pL\pN]+"  # letters/digits runs, as the matcher's tokenizer
+
+def _token_lists(col: pa.Array) -> pa.ListArray:
+    return pc.split_pattern_regex(pc.utf8_lower(pc.fill_null(col, "")), _SPLIT)
+
+def _hashed(tokens: pa.Array, prefix: str) -> np.ndarray:
+    # crc32 once per distinct token, expanded back with the dictionary indices
+    enc = pc.dictionary_encode(tokens)
+    hs = np.fromiter((zlib.crc32((prefix + t).encode("utf-8")) for t in enc.dictionary.to_pylist()),
+                     dtype=np.uint64, count=len(enc.dictionary))
+    return hs[enc.indices.to_numpy(zero_copy_only=False)]
+
+def shingle_docs(names: pa.Array, ingredients: pa.Array) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """-> (document id per row, token hashes of all documents, per-document offsets into them).
+
+    Rows with identical name and ingredients share a document; each document's
+    hashes are sorted and unique."""
+    if pa.types.is_list(ingredients.type) or pa.types.is_large_list(ingredients.type):
+        ingredients = pc.binary_join(ingredients, pa.scalar(", ", ingredients.type.value_type))
+    names, ingredients = names.cast(pa.large_string()), ingredients.cast(pa.large_string())
+    key = pc.binary_join_element_wise(pc.fill_null(names, ""), pc.fill_null(ingredients, ""),
+                                      pa.scalar("\x1f", pa.large_string()))
+    enc = pc.dictionary_encode(key)
+    row_doc = enc.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    _, rep = np.unique(row_doc, return_index=True)
+    rep = pa.array(rep)
+    parts_doc, parts_hash = [], []
+    for col, prefix in ((names, "n:"), (ingredients, "i:")):
+        lists = _token_lists(col.take(rep))
+        flat = pc.list_flatten(lists)
+        parent = pc.list_parent_indices(lists).to_numpy()
+        nonempty = pc.not_equal(flat, "").to_numpy(zero_copy_only=False)
+        parts_doc.append(parent[nonempty])
+        parts_hash.append(_hashed(flat.filter(pa.array(nonempty)), prefix))
+    # one uint64 sort both groups by document and dedupes hashes within it
+    code = np.unique((np.concatenate(parts_doc).astype(np.uint64) << np.uint64(32)) | np.concatenate(parts_hash))
+    doc, hs = (code >> np.uint64(32)).astype(np.int64), code & np.uint64(0xFFFFFFFF)
+    offsets = np.zeros(len(rep) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(doc, minlength=len(rep)), out=offsets[1:])
+    return row_doc, hs, offsets
+
+# ---------------- MinHash ----------------
+def minhash(hashes: np.ndarray, offsets: np.ndarray, num_perm: int = 128, seed: int = 1) -> np.ndarray:
+    """(n_docs, num_perm) uint32 signatures; empty documents get all-max rows."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    n_docs = len(offsets) - 1
+    sig = np.full((n_docs, num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+    lengths = np.diff(offsets)
+    batch_tokens = max(1, _MAX_CELLS // num_perm)
+    start = 0
+    while start < n_docs:
+        # documents [start, stop) hold about batch_tokens tokens (at least one document)
+        stop = max(start + 1, int(np.searchsorted(offsets, offsets[start] + batch_tokens, side="right")) - 1)
+        stop = min(stop, n_docs)
+        idx = np.nonzero(lengths[start:stop])[0] + start
+        if len(idx):
+            toks = hashes[offsets[start]:offsets[stop]]
+            # multiply-shift hashing (uint64 wrap-around is intended), laid out perms x tokens
+            # so reduceat runs along contiguous rows; in-place ops avoid temporaries
+            with np.errstate(over="ignore"):
+                h = a[:, None] * toks[None, :]
+                h += b[:, None]
+                h >>= np.uint64(32)
+            sig[idx] = np.minimum.reduceat(h, offsets[idx] - offsets[start], axis=1).T
+        start = stop
+    return sig
+
+# ---------------- LSH ----------------
+def _bucket_pairs(docs: np.ndarray, bucket: np.ndarray, max_bucket: int) -> np.ndarray:
+    """All pairs within each bucket (star-linked to the first member above max_bucket);
+    ``docs`` must be sorted by ``bucket``."""
+    n = len(docs)
+    counts = np.bincount(bucket)
+    size = counts[bucket]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    out = []
+    big = np.nonzero(size > max_bucket)[0]
+    big = big[big != starts[bucket[big]]]
+    if len(big):
+        out.append(np.stack([docs[starts[bucket[big]]], docs[big]], axis=1))
+    # offset d pairs every member with the one d places later in the same bucket
+    idx = np.nonzero((size > 1) & (size <= max_bucket))[0]
+    d = 1
+    while len(idx):
+        nxt = idx + d
+        ok = nxt < n
+        ok[ok] = bucket[nxt[ok]] == bucket[idx[ok]]
+        idx, nxt = idx[ok], nxt[ok]
+        if len(idx):
+            out.append(np.stack([docs[idx], docs[nxt]], axis=1))
+        d += 1
+    return np.concatenate(out) if out else np.empty((0, 2), dtype=np.int64)
+
+def lsh_candidates(sig: np.ndarray, bands: int, max_bucket: int = 200) -> np.ndarray:
+    """Candidate (i, j) document pairs, i < j, sharing at least one band bucket."""
+    n, k = sig.shape
+    r = k // bands
+    docs = np.nonzero(sig[:, 0] != np.iinfo(np.uint32).max)[0]
+    pairs = []
+    for band in range(bands):
+        # band rows -> one uint64 bucket key; a rare collision only adds a candidate that verification drops
+        key = np.zeros(len(docs), dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for c in range(band * r, (band + 1) * r):
+                key = key * np.uint64(0x100000001B3) + sig[docs, c]
+        _, inv = np.unique(key, return_inverse=True)
+        order = np.argsort(inv, kind="stable")
+        pairs.append(_bucket_pairs(docs[order], inv[order], max_bucket))
+    p = np.concatenate(pairs).astype(np.int64) if pairs else np.empty((0, 2), dtype=np.int64)
+    lo, hi = np.minimum(p[:, 0], p[:, 1]), np.maximum(p[:, 0], p[:, 1])
+    code = np.unique(lo * n + hi)
+    return np.stack([code // n, code % n], axis=1)
+
+def estimated_jaccard(sig: np.ndarray, pairs: np.ndarray, batch: int = 1 << 16) -> np.ndarray:
+    out = np.empty(len(pairs), dtype=np.float64)
+    for s in range(0, len(pairs), batch):
+        p = pairs[s:s + batch]
+        out[s:s + batch] = (sig[p[:, 0]] == sig[p[:, 1]]).mean(axis=1)
+    return out
+
+def components(n: int, pairs: np.ndarray) -> np.ndarray:
+    """Connected-component label (smallest member) per node, by min-label propagation."""
+    labels = np.arange(n)
+    if not len(pairs):
+        return labels
+    i, j = pairs[:, 0], pairs[:, 1]
+    while True:
+        prev = labels.copy()
+        m = np.minimum(labels[i], labels[j])
+        np.minimum.at(labels, i, m)
+        np.minimum.at(labels, j, m)
+        labels = labels[labels]  # pointer jumping
+        if np.array_equal(labels, prev):
+            return labels
+
+# ---------------- driver ----------------
+def find_near_duplicates(tbl: pa.Table, num_perm: int = 128, bands: int = 16, threshold: float = 0.8,
+                         seed: int = 1) -> Tuple[pa.Table, Dict[str, int]]:
+    names = tbl.column("product_name").combine_chunks()
+    ings = tbl.column("ingredients").combine_chunks() if "ingredients" in tbl.column_names \
+        else pa.nulls(tbl.num_rows, pa.large_string())
+    if pa.types.is_dictionary(names.type):
+        names = names.dictionary_decode()
+    row_doc, hashes, offsets = shingle_docs(names, ings)
+    sig = minhash(hashes, offsets, num_perm, seed)
+    cand = lsh_candidates(sig, bands)
+    sim = estimated_jaccard(sig, cand)
+    keep = cand[sim >= threshold]
+    doc_label = components(len(offsets) - 1, keep)
+
+    # rows -> clusters of 2+ rows (exact re-crawls share a document and count too)
+    row_label = doc_label[row_doc]
+    _, inv, counts = np.unique(row_label, return_inverse=True, return_counts=True)
+    rows = np.nonzero(counts[inv] > 1)[0]
+    rows = rows[np.lexsort((rows, row_label[rows]))]
+    labels = row_label[rows]
+    first = np.concatenate([[True], labels[1:] != labels[:-1]]) if len(rows) else np.empty(0, bool)
+    cluster_no = np.cumsum(first) - 1
+    rep_doc = row_doc[rows[first]][cluster_no] if len(rows) else np.empty(0, np.int64)
+    similarity = (sig[row_doc[rows]] == sig[rep_doc]).mean(axis=1) if len(rows) else np.empty(0)
+
+    cols = {"dup_cluster_id": pa.array(cluster_no, pa.int64()), "row": pa.array(rows, pa.int64())}
+    for c in ID_COLS:
+        if c in tbl.column_names:
+            cols[c] = tbl.column(c).take(pa.array(rows, pa.int64()))
+    cols["similarity"] = pa.array(np.round(similarity, 4), pa.float64())
+    stats = {"records": tbl.num_rows, "documents": len(offsets) - 1, "candidate_pairs": int(len(cand)),
+             "verified_pairs": int(len(keep)), "clusters": int(first.sum()), "records_in_clusters": int(len(rows))}
+    return pa.table(cols), stats
+
+def write_stats(stats: Dict[str, int], stats_path: Path = Path("provenance") / "near_duplicates.json") -> None:
+    try:
+        stats_path.parent.mkdir(parents=True, exist_ok=True)
+        stats_path.write_text(json.dumps(stats, indent=2), encoding="utf-8")
+    except Exception:
+        pass
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True, type=Path)
+    ap.add_argument("--out", required=True, type=Path, help="duplicate-cluster Parquet")
+    ap.add_argument("--num_perm", type=int, default=128)
+    ap.add_argument("--bands", type=int, default=16, help="LSH bands; num_perm must be divisible by it")
+    ap.add_argument("--threshold", type=float, default=0.8, help="min estimated Jaccard for a duplicate pair")
+    ap.add_argument("--stats", type=Path, default=Path("provenance") / "near_duplicates.json")
+    a = ap.parse_args()
+    if a.num_perm % a.bands:
+        ap.error("--num_perm must be divisible by --bands")
+
+    cols = [c for c in ID_COLS + ["ingredients"] if c in pq.read_schema(a.inp).names]
+    clusters, stats = find_near_duplicates(read_table(a.inp, columns=cols), a.num_perm, a.bands, a.threshold)
+    a.out.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(clusters, a.out, compression="snappy")
+    write_stats(stats, a.stats)
+
+if __name__ == "__main__":
+    main()
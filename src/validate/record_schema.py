@@ -0,0 +1,165 @@
+"""
+JSON Schema validation of curated records, applied column-wise to Arrow batches.
+
+`compile_schema` turns metadata/dataset.schema.json into one check per
+property, once per run. Each record is the row as JSON (v2 types: list
+columns are arrays, float64 quantities are numbers, bool `on_market` is a
+boolean), and the checks run as whole-column kernels:
+
+- `type` is decided from the Arrow type of the column plus its null mask
+  (integral floats count as "integer", as in JSON Schema);
+- `items` recurses on the flattened list values and maps failures back to
+  their rows;
+- any other keyword falls back to the compiled jsonschema validator, run
+  once per distinct value rather than once per record.
+
+`required` fails every row of a column the file does not have, and with
+`additionalProperties: false` every row of a column the schema does not
+list. Root keywords beyond those are checked per record as "<record>".
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from jsonschema.validators import validator_for
+
+RECORD = "<record>"
+_ANNOTATIONS = {"title", "description", "$comment", "default", "examples", "deprecated", "readOnly", "writeOnly"}
+_VECTORIZED = _ANNOTATIONS | {"type", "items"}
+_ROOT_HANDLED = _ANNOTATIONS | {"$schema", "$id", "type", "properties", "required", "additionalProperties"}
+
+def _json_type(t: pa.DataType) -> Optional[str]:
+    """JSON type every non-null value of this Arrow type maps to (None: decide per value)."""
+    if pa.types.is_dictionary(t):
+        return _json_type(t.value_type)
+    if pa.types.is_string(t) or pa.types.is_large_string(t):
+        return "string"
+    if pa.types.is_boolean(t):
+        return "boolean"
+    if pa.types.is_integer(t):
+        return "integer"
+    if pa.types.is_floating(t) or pa.types.is_decimal(t):
+        return "number"
+    if pa.types.is_list(t) or pa.types.is_large_list(t):
+        return "array"
+    if pa.types.is_struct(t) or pa.types.is_map(t):
+        return "object"
+    if pa.types.is_null(t):
+        return "null"
+    return None
+
+def _to_numpy(mask) -> np.ndarray:
+    return pc.fill_null(mask, True).to_numpy(zero_copy_only=False).astype(bool, copy=False)
+
+class _PropertyCheck:
+    """Compiled subschema for one column; `bad(arr)` is the per-row violation mask."""
+    def __init__(self, sub, validator):
+        self.sub = sub if isinstance(sub, dict) else {}
+        self.reject_all = sub is False
+        self.validator = validator.evolve(schema=sub) if isinstance(sub, dict) else None
+        types = self.sub.get("type")
+        self.types = None if types is None else set([types] if isinstance(types, str) else types)
+        self.vectorized = set(self.sub) <= _VECTORIZED
+        items = self.sub.get("items")
+        self.items = _PropertyCheck(items, validator) if items is not None and self.vectorized else None
+
+    def bad(self, arr: pa.Array) -> np.ndarray:
+        if self.reject_all:
+            return np.ones(len(arr), dtype=bool)
+        if not self.vectorized or _json_type(arr.type) is None:
+            return self._bad_per_value(arr)
+        if pa.types.is_dictionary(arr.type):
+            arr = arr.cast(arr.type.value_type)
+        bad = np.zeros(len(arr), dtype=bool)
+        if self.types is not None:
+            bad |= self._bad_type(arr)
+        if self.items is not None and (pa.types.is_list(arr.type) or pa.types.is_large_list(arr.type)):
+            flat = pc.list_flatten(arr)
+            if len(flat):
+                rows = pc.list_parent_indices(arr).to_numpy()
+                bad[np.unique(rows[self.items.bad(flat)])] = True
+        return bad
+
+    def _bad_type(self, arr: pa.Array) -> np.ndarray:
+        null = arr.is_null().to_numpy(zero_copy_only=False)
+        bad = null & ("null" not in self.types)
+        t = _json_type(arr.type)
+        if t in self.types or (t == "integer" and "number" in self.types) or t == "null":
+            return bad
+        if t == "number" and "integer" in self.types:
+            return bad | (~null & _to_numpy(pc.invert(pc.equal(pc.floor(arr), arr))))
+        return bad | ~null
+
+    def _bad_per_value(self, arr: pa.Array) -> np.ndarray:
+        """jsonschema fallback, once per distinct value (lists: once per distinct tuple)."""
+        if pa.types.is_list(arr.type) or pa.types.is_large_list(arr.type) or _json_type(arr.type) is None:
+            memo: Dict[object, bool] = {}
+            out = np.zeros(len(arr), dtype=bool)
+            for i, v in enumerate(arr.to_pylist()):
+                key = tuple(v) if isinstance(v, list) else repr(v)
+                if key not in memo:
+                    memo[key] = not self.validator.is_valid(v)
+                out[i] = memo[key]
+            return out
+        enc = arr if pa.types.is_dictionary(arr.type) else pc.dictionary_encode(arr)
+        dict_bad = np.array([not self.validator.is_valid(v) for v in enc.dictionary.to_pylist()], dtype=bool)
+        indices = enc.indices
+        out = np.zeros(len(arr), dtype=bool)
+        valid = indices.is_valid().to_numpy(zero_copy_only=False)
+        if len(dict_bad):
+            out[valid] = dict_bad[pc.drop_null(indices).to_numpy()]
+        out[~valid] = not self.validator.is_valid(None)
+        return out
+
+class RecordValidator:
+    """`compile_schema` result: `violations(tbl, names)` -> {field: per-row violation mask}."""
+    def __init__(self, schema: dict):
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        self.validator = cls(schema)
+        self.properties = {name: _PropertyCheck(sub, self.validator)
+                           for name, sub in schema.get("properties", {}).items()}
+        self.required = list(schema.get("required", []))
+        self.additional = schema.get("additionalProperties", True)
+        self.additional_check = _PropertyCheck(self.additional, self.validator) \
+            if isinstance(self.additional, dict) else None
+        root = {k: v for k, v in schema.items() if k not in _ROOT_HANDLED}
+        self.record_validator = self.validator.evolve(schema={**root, "$defs": schema.get("$defs", {})}) \
+            if root else None
+
+    def fields(self, names: List[str]) -> List[str]:
+        """Columns of a file with these column names that the schema constrains."""
+        if self.record_validator is not None or self.additional is not True:
+            return list(names)
+        return [n for n in names if n in self.properties]
+
+    def violations(self, tbl: pa.Table, names: List[str]) -> Dict[str, np.ndarray]:
+        """Per-field boolean masks; `names` are the columns the whole file has."""
+        n = tbl.num_rows
+        out: Dict[str, np.ndarray] = {}
+        for name in self.required:
+            if name not in names:
+                out[name] = np.ones(n, dtype=bool)
+        for name in names:
+            if name not in tbl.column_names:
+                continue
+            col = tbl.column(name).combine_chunks()
+            if name in self.properties:
+                bad = self.properties[name].bad(col)
+            elif self.additional is False:
+                bad = np.ones(n, dtype=bool)
+            elif self.additional_check is not None:
+                bad = self.additional_check.bad(col)
+            else:
+                continue
+            out[name] = out[name] | bad if name in out else bad
+        if self.record_validator is not None:
+            out[RECORD] = np.array([not self.record_validator.is_valid(r)
+                                    for r in tbl.select([c for c in names if c in tbl.column_names]).to_pylist()],
+                                   dtype=bool)
+        return out
+
+def compile_schema(schema: dict) -> RecordValidator:
+    return RecordValidator(schema)
@@ -1,82 +1,120 @@
-import argparse, csv
+import argparse, itertools, sys
 from pathlib import Path
+import numpy as np
+import pyarrow as pa
 import pyarrow.parquet as pq
 import pandas as pd
 
-def read_df(parquet_path: str) -> pd.DataFrame:
-    tbl = pq.read_table(parquet_path)
-    try:
-        return tbl.to_pandas(strings_to_categorical=False)
-    except Exception:
-        return pd.DataFrame(tbl.to_pylist())
+from src.integrate.ingredient_index import IngredientIndex
+from src.preprocess.canonical import load_synonyms
+from src.utils import instrument
+from src.utils.dataset import add_where_arg, open_dataset, where_filter
+from src.utils.schema import TEXT, format_number, read_table, to_pandas
+from src.views.matcher import TargetMatcher
+
+UC1_COLS = ["ingredient","product_name","brand","company_name","form",
+            "serving_size","serving_unit","link","source"]
+UC2_COLS = ["ingredient","company_name","brand_count","product_count"]
+READ_COLS = ["ingredients"] + UC1_COLS[1:] + [TEXT["serving_size"]]  # all build_views looks at
+
+def read_df(parquet_path: str, columns: list[str] | None = READ_COLS, filter=None) -> pd.DataFrame:
+    # v1 or v2 files (or a dataset directory); typed columns come back flattened (lists ", "-joined,
+    # dictionaries decoded). Only `columns` are read; `filter` is pushed down to partitions/row groups.
+    return to_pandas(read_table(parquet_path, columns, filter))
 
 def load_targets(p: Path) -> list[str]:
     lines = [ln.strip() for ln in p.read_text(encoding="utf-8").splitlines()]
     return [t for t in lines if t and not t.startswith("#")]
 
+def build_uc1(df: pd.DataFrame, targets: list[str], hits: list, rows: np.ndarray | None = None) -> pd.DataFrame:
+    """Explode per-row target hits into one UC-1 row per (target, product), target-major.
+
+    `hits[i]` belongs to row i of `df`, or to row `rows[i]` when a subset of rows (ascending) is given.
+    """
+    lengths = np.fromiter((len(h) for h in hits), dtype=np.int64, count=len(hits))
+    ids = np.arange(len(hits), dtype=np.int64) if rows is None else np.asarray(rows, dtype=np.int64)
+    rows = np.repeat(ids, lengths)
+    tids = np.fromiter(itertools.chain.from_iterable(hits), dtype=np.int64, count=int(lengths.sum()))
+    order = np.lexsort((rows, tids))
+    uc1 = df.iloc[rows[order]][UC1_COLS[1:]].reset_index(drop=True)
+    uc1.insert(0, "ingredient", np.asarray(targets, dtype=object)[tids[order]])
+    return uc1
+
+def build_uc2(uc1: pd.DataFrame) -> pd.DataFrame:
+    if not len(uc1):
+        return pd.DataFrame(columns=UC2_COLS)
+    return uc1.groupby(["ingredient","company_name"], dropna=False).agg(
+        brand_count=("brand", "nunique"),
+        product_count=("product_name","nunique")
+    ).reset_index()
+
+def write_view(frame: pd.DataFrame, csv_path: str, parquet_path: str | None = None) -> None:
+    # csv.DictWriter defaults (excel dialect, \r\n) so the files stay byte-identical
+    Path(csv_path).parent.mkdir(parents=True, exist_ok=True)
+    frame.to_csv(csv_path, index=False, lineterminator="\r\n", encoding="utf-8")
+    if parquet_path:
+        Path(parquet_path).parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), parquet_path, compression="snappy")
+
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Flattened curated rows (see `read_df`) -> the text frame UC-1 rows are cut from."""
+    df = df.fillna("")
+    if TEXT["serving_size"] not in df.columns and "serving_size" in df.columns:  # a frame without the label text
+        df[TEXT["serving_size"]] = df["serving_size"].map(format_number)
+    # Ensure expected columns
+    for col in READ_COLS:
+        if col not in df.columns:
+            df[col] = ""
+    df["serving_size"] = df[TEXT["serving_size"]]  # as the label gives it ("60.0", "1-2"), not the float
+    return df
+
+def build_views(df: pd.DataFrame, targets: list[str], syn_path: Path | None = None,
+                index: IngredientIndex | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Flattened curated rows (see `read_df`) -> (UC-1, UC-2). `index` must be built over the same rows."""
+    df = prepare_frame(df)
+
+    # one automaton scan per distinct ingredient string instead of one str.contains per target
+    matcher = TargetMatcher(targets, load_synonyms(syn_path) if syn_path else None)
+    texts = df["ingredients"].astype(str).tolist()
+    if index is not None:
+        # index lookups narrow the scan to candidate rows; the automaton confirms them
+        hits = matcher.match_rows(texts, index.candidate_rows(matcher).tolist())
+    else:
+        hits = matcher.match_many(texts)
+
+    uc1 = build_uc1(df, targets, hits)
+    return uc1, build_uc2(uc1)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--in", dest="inp", required=True)
     ap.add_argument("--targets", required=True)
+    ap.add_argument("--syn", default=None, help="rules/synonyms.csv; aliases also match their target")
     ap.add_argument("--uc1", required=True)
     ap.add_argument("--uc2", required=True)
+    ap.add_argument("--index", default=None, help="ingredient index dir (src.integrate.ingredient_index)")
+    ap.add_argument("--uc1_parquet", default=None, help="optional Parquet copy of UC-1")
+    ap.add_argument("--uc2_parquet", default=None, help="optional Parquet copy of UC-2")
+    add_where_arg(ap)
+    instrument.add_profile_arg(ap)
     a = ap.parse_args()
+    instrument.configure(a.profile)
 
-    targets = load_targets(Path(a.targets))
-    df = read_df(a.inp).fillna("")
+    outputs = [p for p in (a.uc1, a.uc2, a.uc1_parquet, a.uc2_parquet) if p]
+    with instrument.stage("export_views", inputs=[a.inp], outputs=outputs) as rec:
+        df = read_df(a.inp, filter=where_filter(a.where, open_dataset(a.inp).schema))
+        # the index is keyed to row positions of one Parquet file: not usable for a dataset directory or --where
+        index = IngredientIndex(Path(a.index)) if a.index and (Path(a.index) / "meta.json").exists() \
+            and Path(a.inp).is_file() and not a.where else None
+        if index is not None and not (index.meta.get("rows") == len(df) and index.matches_source(Path(a.inp))):
+            index = None
+        if a.index and index is None:
+            print(f"[export] index {a.index} missing, stale or not applicable; scanning all rows", file=sys.stderr)
 
-    # Ensure expected columns
-    for col in ["ingredients","product_name","brand","company_name","form","serving_size","serving_unit","link","source"]:
-        if col not in df.columns:
-            df[col] = ""
-
-    df["_ingredients_lc"] = df["ingredients"].astype(str).str.lower()
-
-    uc1_rows = []
-    for t in targets:
-        t_lc = t.lower()
-        hit = df[df["_ingredients_lc"].str.contains(t_lc, na=False)]
-        for _, r in hit.iterrows():
-            uc1_rows.append({
-                "ingredient": t,
-                "product_name": r["product_name"],
-                "brand": r["brand"],
-                "company_name": r["company_name"],
-                "form": r["form"],
-                "serving_size": r["serving_size"],
-                "serving_unit": r["serving_unit"],
-                "link": r["link"],
-                "source": r["source"],
-            })
-
-    Path(a.uc1).parent.mkdir(parents=True, exist_ok=True)
-    with open(a.uc1, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=[
-            "ingredient","product_name","brand","company_name","form",
-            "serving_size","serving_unit","link","source"
-        ])
-        w.writeheader()
-        w.writerows(uc1_rows)
-
-    if uc1_rows:
-        df1 = pd.DataFrame(uc1_rows)
-        grp = df1.groupby(["ingredient","company_name"], dropna=False).agg(
-            brand_count=("brand", "nunique"),
-            product_count=("product_name","nunique")
-        ).reset_index()
-    else:
-        grp = pd.DataFrame(columns=["ingredient","company_name","brand_count","product_count"])
-
-    with open(a.uc2, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["ingredient","company_name","brand_count","product_count"])
-        w.writeheader()
-        for _, row in grp.iterrows():
-            w.writerow({
-                "ingredient": row["ingredient"],
-                "company_name": row["company_name"],
-                "brand_count": int(row["brand_count"]) if row["brand_count"] != "" else 0,
-                "product_count": int(row["product_count"]) if row["product_count"] != "" else 0,
-            })
+        uc1, uc2 = build_views(df, load_targets(Path(a.targets)), Path(a.syn) if a.syn else None, index)
+        write_view(uc1, a.uc1, a.uc1_parquet)
+        write_view(uc2, a.uc2, a.uc2_parquet)
+        rec.rows_in, rec.rows_out = len(df), len(uc1)
 
 if __name__ == "__main__":
     main()
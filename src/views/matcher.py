@@ -0,0 +1,95 @@
+"""
+Multi-target ingredient matcher for the UC-1/UC-2 views.
+
+Targets (and their aliases from rules/synonyms.csv) are compiled once into a
+token-level Aho–Corasick automaton. Each ingredient string is lower-cased,
+split into alphanumeric tokens and scanned in a single pass, so cost is
+linear in the text length regardless of how many targets there are. Matching
+on whole tokens gives word-boundary semantics: "Zinc" matches "zinc citrate"
+but not "zincate", and "Caprylic/Capric Triglyceride" is a literal phrase, not
+a regex.
+"""
+from __future__ import annotations
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+class TargetMatcher:
+    """Token-level Aho–Corasick automaton; ``find`` returns the ids of all targets present."""
+
+    def __init__(self, targets: List[str], synonyms: Optional[Dict[str, List[str]]] = None):
+        self.targets = targets
+        self.surfaces: List[tuple] = []  # (target id, tokens) per compiled surface form
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[frozenset] = [frozenset()]
+        outs: List[set] = [set()]
+        synonyms = synonyms or {}
+        for tid, t in enumerate(targets):
+            for surface in [t] + synonyms.get(t.lower(), []):
+                toks = tokenize(surface)
+                if not toks:
+                    continue
+                self.surfaces.append((tid, toks))
+                node = 0
+                for tok in toks:
+                    nxt = self.goto[node].get(tok)
+                    if nxt is None:
+                        nxt = len(self.goto)
+                        self.goto[node][tok] = nxt
+                        self.goto.append({})
+                        self.fail.append(0)
+                        outs.append(set())
+                    node = nxt
+                outs[node].add(tid)
+        # BFS failure links; outputs inherit along the fail chain
+        q = deque(self.goto[0].values())
+        while q:
+            node = q.popleft()
+            for tok, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and tok not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(tok, 0)
+                outs[nxt] |= outs[self.fail[nxt]]
+                q.append(nxt)
+        self.out = [frozenset(o) for o in outs]
+
+    def find(self, text: str) -> frozenset:
+        goto, fail, out = self.goto, self.fail, self.out
+        state, hits = 0, set()
+        for tok in tokenize(text):
+            while state and tok not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(tok, 0)
+            if out[state]:
+                hits |= out[state]
+        return frozenset(hits)
+
+    def match_many(self, texts: Iterable[str]) -> List[frozenset]:
+        """``find`` over a column, scanning each distinct string only once."""
+        memo: Dict[str, frozenset] = {}
+        res = []
+        for s in texts:
+            hit = memo.get(s)
+            if hit is None:
+                hit = memo[s] = self.find(s)
+            res.append(hit)
+        return res
+
+    def match_rows(self, texts: List[str], rows: Iterable[int]) -> List[frozenset]:
+        """Like ``match_many`` but only scans ``rows`` (e.g. index candidates); other rows get no hits."""
+        memo: Dict[str, frozenset] = {}
+        res = [frozenset()] * len(texts)
+        for r in rows:
+            s = texts[r]
+            hit = memo.get(s)
+            if hit is None:
+                hit = memo[s] = self.find(s)
+            res[r] = hit
+        return res
@@ -0,0 +1,271 @@
+"""
+Ad-hoc UC-1/UC-2 queries over integrated.parquet without re-running export.
+
+`QueryService` reads the view columns of integrated.parquet once and keeps
+warm in memory:
+- the ingredient index (src.integrate.ingredient_index, built in memory):
+  token -> row ids, used to narrow a query to candidate rows before the
+  TargetMatcher confirms them, as `export --index` does
+- company / brand / source indexes: lower-cased value -> row ids
+
+`products(["Vitamin K2"], company="...")` returns the UC-1 rows export would
+write for those targets (target-major, same columns), optionally narrowed to a
+company, brand or source; `companies(...)` the matching UC-2 rows. Answers are
+kept in an LRU cache of `cache_size` entries. Before each query the service
+looks up the sha256 recorded for the Parquet in provenance/checksums.txt
+(re-read only when that file changes; the file's size/mtime when the Parquet
+is not listed) and, if it differs from the loaded one, reloads the data and
+indexes and drops the cache.
+
+HTTP (asyncio, stdlib only, keep-alive, JSON responses):
+  GET /products?ingredient=Vitamin%20K2&ingredient=Zinc&company=...&brand=...&source=DSLD&limit=100
+  GET /companies?ingredient=Vitamin%20K2
+  GET /health
+
+CLI:
+  uv run python -m src.views.query serve --in data/interim/integrated.parquet --syn rules/synonyms.csv --port 8765
+  uv run python -m src.views.query products --in data/interim/integrated.parquet --ingredient "Vitamin K2" --company "Acme"
+"""
+from __future__ import annotations
+import argparse, asyncio, json, sys, threading, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from src.integrate.ingredient_index import IngredientIndex
+from src.preprocess.canonical import load_synonyms
+from src.utils.provenance import read_checksums
+from src.utils.schema import read_table, to_pandas
+from src.views.export import READ_COLS, build_uc1, build_uc2, prepare_frame
+from src.views.matcher import TargetMatcher
+
+CHECKSUMS_PATH = Path("provenance/checksums.txt")
+FACETS = ["company_name", "brand", "source"]
+_NO_ROWS = np.empty(0, dtype=np.int64)
+
+class _LRU:
+    def __init__(self, size: int):
+        self.size = size
+        self.data: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key: tuple) -> Optional[dict]:
+        v = self.data.get(key)
+        if v is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return v
+
+    def put(self, key: tuple, value: dict) -> None:
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    def clear(self) -> None:
+        self.data.clear()
+
+def _records(frame) -> List[dict]:
+    """Row dicts; column-wise `tolist` is several times faster than to_dict on Arrow-backed columns."""
+    cols = [str(c) for c in frame.columns]
+    return [dict(zip(cols, row)) for row in zip(*(frame[c].tolist() for c in frame.columns))]
+
+class QueryService:
+    """Warm in-memory view of one curated Parquet; see the module docstring."""
+
+    def __init__(self, parquet_path: Path, syn_path: Optional[Path] = None,
+                 checksums_path: Optional[Path] = CHECKSUMS_PATH, cache_size: int = 1024):
+        self.parquet_path, self.syn_path = Path(parquet_path), syn_path
+        self._resolved = self.parquet_path.resolve().as_posix()
+        self.checksums_path = Path(checksums_path) if checksums_path else None
+        self.synonyms = load_synonyms(syn_path) if syn_path else None
+        self.cache = _LRU(cache_size)
+        self._lock = threading.Lock()
+        self._listed: Dict[str, str] = {}
+        self._listed_key: Optional[tuple] = None
+        self.version: Optional[str] = None
+        self.loads = 0
+        self._reload(self._fingerprint())
+
+    # ---------------- data ----------------
+    def _fingerprint(self) -> str:
+        """sha256 listed for the Parquet in checksums.txt, else size/mtime of the Parquet itself."""
+        if self.checksums_path is not None:
+            try:
+                st = self.checksums_path.stat()
+                key = (st.st_size, st.st_mtime_ns)
+                if key != self._listed_key:
+                    self._listed = {Path(p).resolve().as_posix(): d for p, d in read_checksums(self.checksums_path).items()}
+                    self._listed_key = key
+            except OSError:
+                self._listed, self._listed_key = {}, None
+            digest = self._listed.get(self._resolved)
+            if digest:
+                return digest
+        st = self.parquet_path.stat()
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def _reload(self, version: str) -> None:
+        t0 = time.perf_counter()
+        tbl = read_table(self.parquet_path, READ_COLS)
+        self.df = prepare_frame(to_pandas(tbl))
+        self.texts: List[str] = self.df["ingredients"].astype(str).tolist()
+        self.index = IngredientIndex.from_table(tbl, self.syn_path)
+        self.facets: Dict[str, Dict[str, np.ndarray]] = {
+            col: {k: np.asarray(v, dtype=np.int64) for k, v in self.df.groupby(self.df[col].str.lower()).indices.items()}
+            for col in FACETS
+        }
+        self.cache.clear()
+        self.version = version
+        self.loads += 1
+        self.load_seconds = round(time.perf_counter() - t0, 3)
+
+    def refresh(self) -> bool:
+        """Reload if the Parquet's checksum changed; True when it did."""
+        version = self._fingerprint()
+        if version == self.version:
+            return False
+        self._reload(version)
+        return True
+
+    # ---------------- queries ----------------
+    def _rows(self, targets: List[str], company: Optional[str], brand: Optional[str],
+              source: Optional[str]):
+        matcher = TargetMatcher(targets, self.synonyms)
+        rows = self.index.candidate_rows(matcher).astype(np.int64)
+        for col, value in zip(FACETS, (company, brand, source)):
+            if value:
+                rows = np.intersect1d(rows, self.facets[col].get(value.strip().lower(), _NO_ROWS), assume_unique=True)
+        texts = self.texts
+        return build_uc1(self.df, targets, matcher.match_many(texts[r] for r in rows.tolist()), rows)
+
+    def _query(self, kind: str, ingredients: Sequence[str], company: Optional[str], brand: Optional[str],
+               source: Optional[str], limit: Optional[int]) -> dict:
+        targets = list(dict.fromkeys(t.strip() for t in ingredients if t and t.strip()))
+        key = (kind, tuple(targets), (company or "").lower(), (brand or "").lower(), (source or "").lower(), limit)
+        with self._lock:
+            self.refresh()
+            hit = self.cache.get(key)
+            if hit is not None:
+                return {**hit, "cached": True}
+            uc1 = self._rows(targets, company, brand, source)
+            frame = uc1 if kind == "products" else build_uc2(uc1)
+            out = {"kind": kind, "ingredients": targets, "total": len(frame), "version": self.version,
+                   "results": _records(frame if limit is None else frame.head(limit))}
+            self.cache.put(key, out)
+            return {**out, "cached": False}
+
+    def products(self, ingredients: Sequence[str], company: Optional[str] = None, brand: Optional[str] = None,
+                 source: Optional[str] = None, limit: Optional[int] = None) -> dict:
+        """UC-1 rows for ``ingredients`` (export's columns and order), optionally narrowed by facet."""
+        return self._query("products", ingredients, company, brand, source, limit)
+
+    def companies(self, ingredients: Sequence[str], company: Optional[str] = None, brand: Optional[str] = None,
+                  source: Optional[str] = None, limit: Optional[int] = None) -> dict:
+        """UC-2 rows (brand/product counts per company) for ``ingredients``."""
+        return self._query("companies", ingredients, company, brand, source, limit)
+
+    def health(self) -> dict:
+        return {"rows": len(self.df), "version": self.version, "loads": self.loads, "load_seconds": self.load_seconds,
+                "cache_entries": len(self.cache.data), "cache_hits": self.cache.hits, "cache_misses": self.cache.misses}
+
+# ---------------- HTTP ----------------
+def _response(status: int, body: dict) -> bytes:
+    payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}.get(status, "Error")
+    head = (f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n")
+    return head.encode("ascii") + payload
+
+def handle_request(service: QueryService, method: str, target: str):
+    """(status, body) for one request line; used by the server and callable directly."""
+    if method != "GET":
+        return 405, {"error": "only GET is supported"}
+    url = urlsplit(target)
+    if url.path == "/health":
+        return 200, service.health()
+    if url.path not in ("/products", "/companies"):
+        return 404, {"error": f"unknown path {url.path}"}
+    q = parse_qs(url.query)
+    if not q.get("ingredient"):
+        return 400, {"error": "at least one ingredient= parameter is required"}
+    try:
+        limit = int(q["limit"][0]) if "limit" in q else None
+    except ValueError:
+        return 400, {"error": "limit must be an integer"}
+    one = lambda k: q[k][0] if k in q else None
+    fn = service.products if url.path == "/products" else service.companies
+    return 200, fn(q["ingredient"], one("company"), one("brand"), one("source"), limit)
+
+async def _serve_connection(service: QueryService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            keep_alive = True
+            while True:  # headers: only Connection matters here
+                h = await reader.readline()
+                if h in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = h.decode("latin-1").partition(":")
+                if name.strip().lower() == "connection" and value.strip().lower() == "close":
+                    keep_alive = False
+            parts = line.decode("latin-1").split()
+            status, body = (400, {"error": "bad request line"}) if len(parts) < 2 else handle_request(service, *parts[:2])
+            writer.write(_response(status, body))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def start_server(service: QueryService, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+    return await asyncio.start_server(lambda r, w: _serve_connection(service, r, w), host, port)
+
+async def _serve_forever(service: QueryService, host: str, port: int) -> None:
+    server = await start_server(service, host, port)
+    print(f"[query] {service.health()['rows']} rows loaded in {service.load_seconds}s; "
+          f"listening on http://{host}:{port}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("serve", "products", "companies"):
+        p = sub.add_parser(name)
+        p.add_argument("--in", dest="inp", type=Path, default=Path("data/interim/integrated.parquet"))
+        p.add_argument("--syn", type=Path, default=None, help="rules/synonyms.csv; aliases also match their target")
+        p.add_argument("--checksums", type=Path, default=CHECKSUMS_PATH)
+        if name == "serve":
+            p.add_argument("--host", default="127.0.0.1")
+            p.add_argument("--port", type=int, default=8765)
+            p.add_argument("--cache_size", type=int, default=1024, help="LRU entries")
+        else:
+            p.add_argument("--ingredient", nargs="+", required=True)
+            p.add_argument("--company", default=None)
+            p.add_argument("--brand", default=None)
+            p.add_argument("--source", default=None)
+            p.add_argument("--limit", type=int, default=None)
+    a = ap.parse_args()
+
+    service = QueryService(a.inp, a.syn, a.checksums, getattr(a, "cache_size", 1024))
+    if a.cmd == "serve":
+        try:
+            asyncio.run(_serve_forever(service, a.host, a.port))
+        except KeyboardInterrupt:
+            pass
+        return
+    fn = service.products if a.cmd == "products" else service.companies
+    print(json.dumps(fn(a.ingredient, a.company, a.brand, a.source, a.limit), ensure_ascii=False, default=str, indent=2))
+
+if __name__ == "__main__":
+    main()